@@ -89,12 +89,28 @@ const ChatBot = () => {
     setIsLoading(true);
 
     try {
-      const response = await analyticsAPI.askQuestion(storeId, input.trim());
-      const botMessage = { 
-        role: 'assistant', 
-        content: response.answer || response.response || 'Sorry, I could not process your request.' 
+      // The assistant bubble is added on the first token and grown in place.
+      let started = false;
+      const updateAnswer = (content) => {
+        if (!started) {
+          started = true;
+          setIsLoading(false);
+          setMessages(prev => [...prev, { role: 'assistant', content }]);
+          return;
+        }
+        setMessages(prev => [...prev.slice(0, -1), { role: 'assistant', content }]);
       };
-      setMessages(prev => [...prev, botMessage]);
+      let answer = '';
+      await analyticsAPI.askQuestionStream(storeId, input.trim(), (event, data) => {
+        if (event === 'token') {
+          answer += data.text;
+          updateAnswer(answer);
+        } else if (event === 'done') {
+          updateAnswer(data.answer || answer || 'Sorry, I could not process your request.');
+        } else if (event === 'error') {
+          throw data;
+        }
+      });
     } catch (error) {
       const errorMessage = { 
         role: 'assistant', 
@@ -22,6 +22,42 @@ export const analyticsAPI = {
       throw error.response?.data || { error: 'Failed to connect to server' };
     }
   },
+
+  // Streams Server-Sent Events from the Rails proxy. `onEvent(event, data)` is
+  // called for each "intent", "table", "token", "done" or "error" event.
+  askQuestionStream: async (storeId, question, onEvent) => {
+    let response;
+    try {
+      response = await fetch(`${API_BASE_URL}/api/v1/questions/stream`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ store_id: storeId, question }),
+      });
+    } catch (error) {
+      console.error('API Error:', error);
+      throw { error: 'Failed to connect to server' };
+    }
+    if (!response.ok || !response.body) {
+      throw await response.json().catch(() => ({ error: 'Failed to connect to server' }));
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    for (;;) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      let sep;
+      while ((sep = buffer.indexOf('\n\n')) !== -1) {
+        const raw = buffer.slice(0, sep);
+        buffer = buffer.slice(sep + 2);
+        const event = raw.match(/^event: (.*)$/m)?.[1];
+        const data = raw.match(/^data: (.*)$/m)?.[1];
+        if (event && data) onEvent(event, JSON.parse(data));
+      }
+    }
+  },
 };
 
 export default api;
@@ -1,13 +1,32 @@
-import os
+import asyncio
+import hashlib
+import importlib
 import json
-import requests
-import openai
-import re
-from dotenv import load_dotenv
-
-load_dotenv()
+import os
+import time
+from contextlib import asynccontextmanager
+from functools import cached_property
+from types import SimpleNamespace
+from cache import SingleFlight, make_result_cache, normalize_query
+from clients import chat_completion, get_http_client, shopify_graphql_url, stream_chat_completion
+from local_engine import LOCAL_REPORTS, LocalAnalyticsEngine
+from metrics import (
+    EXPLAIN_ANSWERS, REGISTRY, ROUTER_DECISIONS, UPSTREAM_BYTES, UPSTREAM_REQUESTS,
+    sample_debug_body, stage, trace_request
+)
+from query_memory import GeneratedQueryCache
+from rollup_store import ROLLUP_DAYS, DailyRollupStore
+from router import IntentRouter, tokenize
+from shopify_throttle import ShopifyScheduler
+from shopifyql import condition, graphql_body, parse as parse_shopifyql
+from warmup import ReportWarmer
 
-openai.api_key = os.getenv("OPENAI_API_KEY")
+# The NumPy-backed modules (digest, forecast, narrative, row_stream, table)
+# and the local stores are loaded on first use, so importing and constructing
+# the agent stays cheap; `AnalyticsAgent.preload` loads them ahead of traffic.
+PRELOAD_MODULES = ("numpy", "httpx", "table", "digest", "forecast", "narrative", "row_stream")
+# Explanations are not per shop; the explanation cache files them all under this key
+EXPLANATIONS = "_explanations"
 
 class AnalyticsAgent:
     PREDEFINED_QUERIES = {
@@ -249,86 +268,21 @@ VISUALIZE total_sales TYPE horizontal_bar
 """
     }
 
-    def handle(self, req):
-        # 1. Identify intent and date range
-        if hasattr(req, "force_intent") and getattr(req, "force_intent"):
-            fi = getattr(req, "force_intent")
-            fs = getattr(req, "force_since", "startOfDay(-30d)")
-            fu = getattr(req, "force_until", "today")
-            if fi == "reorder_forecast":
-                return self.handle_reorder_forecast(req, {"since": fs, "until": fu})
-            params = {"intent": fi, "since": fs, "until": fu}
-        else:
-            params = self.parse_request(req.question)
-
-        if params.get("intent") == "reorder_forecast":
-            result = self.handle_reorder_forecast(req, params)
-            return result
-        
-        # 2. Build Query (Predefined or Generated)
-        if params["intent"] in self.PREDEFINED_QUERIES:
-            print(f"🎯 Used Predefined Query: {params['intent']}")
-            query = self.PREDEFINED_QUERIES[params["intent"]].format(
-                since_date=params["since"],
-                until_date=params["until"]
-            )
-            if params.get("limit"):
-                try:
-                    n = int(params["limit"]) if int(params["limit"]) > 0 else 5
-                except Exception:
-                    n = 5
-                query = query.replace("LIMIT 1000", f"LIMIT {n}")
-        else:
-            print("🤖 Generating SQL with AI...")
-            query = self.build_shopifyql(params["intent"], req.question)
-
-        data = self.execute_shopifyql(req.shop_domain, req.access_token, query)
-        
-        # DEBUG: Check for errors immediately
-        if "errors" in data:
-            return {"answer": f"Shopify API Error: {json.dumps(data['errors'])}", "confidence": "high"}
-            
-        gql_errors = data.get("data", {}).get("shopifyqlQuery", {}).get("parseErrors", [])
-        if gql_errors:
-             return {"answer": f"Query Error: {json.dumps(gql_errors)}", "confidence": "high"}
-
-        answer = self.explain(data, req.question)
-        return {
-            "answer": answer,
-            "confidence": "high" if params["intent"] in self.PREDEFINED_QUERIES else "medium"
-        }
-
-    def parse_request(self, question):
-        # Lightweight deterministic router before LLM
-        q = (question or "").lower()
-
-        def _pick_dates(qtxt):
-            if "last week" in qtxt or "past week" in qtxt or "previous week" in qtxt:
-                return "startOfDay(-7d)", "today"
-            if "last 7" in qtxt:
-                return "startOfDay(-7d)", "today"
-            if "last 30" in qtxt or "past 30" in qtxt:
-                return "startOfDay(-30d)", "today"
-            if "last month" in qtxt:
-                return "startOfDay(-30d)", "today"
-            return "startOfDay(-30d)", "today"
-
-        def _maybe_limit(qtxt):
-            m = re.search(r"top\s*(\d+)", qtxt)
-            if m:
-                try:
-                    return int(m.group(1))
-                except Exception:
-                    return 5
-            return None
+    # Parsed once; build_query sets dates, limit and filters on a copy
+    TEMPLATES = {intent: parse_shopifyql(text) for intent, text in PREDEFINED_QUERIES.items()}
 
-        # Top-N products by sales
-        if any(k in q for k in ["top products", "top 5", "top five", "best sellers", "top selling", "top-selling", "top product"]):
-            since, until = _pick_dates(q)
-            return {"intent": "total_sales_by_product", "since": since, "until": until, "limit": _maybe_limit(q) or 5}
+    # Upper bound on ShopifyQL queries in flight per shop for execute_many
+    MAX_CONCURRENT_QUERIES_PER_SHOP = 4
+    # Approximate token budget for the result digest sent to explain()
+    EXPLAIN_TOKEN_BUDGET = int(os.getenv("EXPLAIN_TOKEN_BUDGET", "1500"))
+    # Questions explained per LLM call in handle_batch
+    EXPLAIN_BATCH_SIZE = int(os.getenv("EXPLAIN_BATCH_SIZE", "8"))
+    # Seconds an LLM explanation is reused for the same digest and question (0 disables)
+    EXPLAIN_CACHE_TTL = int(os.getenv("EXPLAIN_CACHE_TTL", "86400"))
+    # Days of daily per-SKU sales the reorder forecast is fitted on
+    FORECAST_HISTORY_DAYS = int(os.getenv("FORECAST_HISTORY_DAYS", "90"))
 
-        # Ask LLM to extract intent key and date range
-        system_prompt = """
+    PARSER_PROMPT = """
         You are a query parser. Map the user's question to a known Report ID.
         
         CRITICAL: Prefer generic reports for broad questions.
@@ -381,82 +335,823 @@ VISUALIZE total_sales TYPE horizontal_bar
         - "Last month" -> since: "startOfDay(-30d)", until: "today"
         - "Next week" (Forecast) -> since: "today", until: "startOfDay(+7d)" (Context dependent)
         """
-        
-        res = openai.ChatCompletion.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": question}
+
+    BATCH_PARSE_PROMPT = PARSER_PROMPT + """
+        BATCH MODE: The user message is a numbered list of questions.
+        Return ONE JSON object {"results": [...]} holding one object in the
+        format above per question, in the same order.
+        """
+
+    EXPLAIN_PROMPT = "You are a Chief Inventory Officer. Be CONFIDENT, CONCISE, and DIRECT.\n\nRULES:\n1. Currency: ALWAYS use ₹ (INR).\n2. **Evidence-Based**: Cite the exact numbers from the data to prove you read it. (e.g., 'With 50 units sold...' instead of 'Sales were high').\n3. **Business Translation**: Convert technical field names into business terms (e.g., 'net_items_sold' -> 'units sold', 'inventory_turnover' -> 'sales velocity').\n4. For Reorder Questions use this template:\n   'Based on the last 30 days, you sell around [daily_rate] units of [Product] per day. You should reorder at least [daily_rate * 7] units to avoid stockouts.'\n5. For Sales/Returns:\n   'Your [Metric] is [Value], which indicates [Business Insight].'"
+
+    BATCH_EXPLAIN_PROMPT = EXPLAIN_PROMPT + "\n\nBATCH MODE: The user message holds several numbered questions, each with its own data. Answer each one independently following the rules above. Return ONLY JSON: {\"answers\": [\"...\"]} with one answer string per question, in the same order."
+
+    def __init__(self):
+        self._shop_semaphores = {}
+        self.result_cache = make_result_cache()
+        # LLM explanations get their own cache, so they neither count in the
+        # Shopify result cache's stats nor evict query results
+        self.explanation_cache = make_result_cache(
+            prefix="autoshop:explain", max_bytes=int(os.getenv("EXPLAIN_CACHE_BYTES", str(8 * 1024 * 1024)))
+        )
+        # Identical concurrent LLM calls share one request (Shopify queries
+        # are coalesced by the result cache)
+        self._flights = {name: SingleFlight(name) for name in ("route", "generate", "explain")}
+        self.shopify_scheduler = ShopifyScheduler(
+            breaker_threshold=int(os.getenv("SHOPIFY_BREAKER_FAILURES", "5")),
+            breaker_cooldown=float(os.getenv("SHOPIFY_BREAKER_COOLDOWN", "30"))
+        )
+        self.router = IntentRouter()
+        self.local_engine = LocalAnalyticsEngine()
+        # Predefined time-series and top-N reports are explained from a
+        # template unless the question asks for more than the figures
+        self.explain_templates = os.getenv("EXPLAIN_TEMPLATES", "1") != "0"
+        self.warmer = ReportWarmer(
+            self,
+            interval=float(os.getenv("WARMUP_INTERVAL", "30")),
+            workers=int(os.getenv("WARMUP_WORKERS", "2")),
+            top_k=int(os.getenv("WARMUP_TOP_K", "4"))
+        )
+        self.ready = False
+        self.preload_seconds = None
+        REGISTRY.register_collector(self._cache_metrics, key="agent_caches")
+
+    @cached_property
+    def generated_queries(self):
+        # Opening it reads and indexes every stored query
+        return GeneratedQueryCache(os.getenv("GENERATED_QUERY_DB", "generated_queries.db"))
+
+    @cached_property
+    def rollups(self):
+        return DailyRollupStore(
+            os.getenv("ROLLUP_DB", "daily_rollups.db"), open_days=int(os.getenv("ROLLUP_OPEN_DAYS", "2"))
+        )
+
+    @cached_property
+    def forecaster(self):
+        from forecast import ReorderForecaster
+        return ReorderForecaster(
+            horizons=[int(h) for h in os.getenv("FORECAST_HORIZONS", "7,30,60,90").split(",")],
+            lead_time=int(os.getenv("FORECAST_LEAD_DAYS", "14")),
+            service_level=float(os.getenv("FORECAST_SERVICE_LEVEL", "0.95")),
+            # e.g. "SKU-1=21,SKU-2=7"
+            lead_times={
+                sku.strip(): int(days)
+                for sku, days in (pair.split("=") for pair in os.getenv("FORECAST_LEAD_TIMES", "").split(",") if "=" in pair)
+            }
+        )
+
+    async def close(self):
+        """Write what the local stores still hold in memory and close the
+        shared caches' connections, at shutdown."""
+        if self._opened("generated_queries"):
+            self.generated_queries.flush()
+        await self.result_cache.close()
+        await self.explanation_cache.close()
+
+    async def preload(self):
+        """Do the first-use work up front: import PRELOAD_MODULES, open the
+        local stores, build the forecaster and the HTTP client.
+
+        Imports run in a worker thread so the event loop keeps serving
+        (requests that arrive meanwhile load what they need themselves).
+        Sets `ready` when done.
+        """
+        start = time.perf_counter()
+        await asyncio.to_thread(lambda: [importlib.import_module(name) for name in PRELOAD_MODULES])
+        self.generated_queries, self.rollups, self.forecaster
+        get_http_client()
+        self.preload_seconds = time.perf_counter() - start
+        self.ready = True
+        print(f"✅ Preloaded in {self.preload_seconds * 1000:.0f} ms")
+
+    async def handle(self, req):
+        with trace_request("ask") as trace:
+            # 1. Identify intent and date range
+            params = await self._resolve_traced(req, trace)
+            if params.get("intent") == "reorder_forecast":
+                result = await self.handle_reorder_forecast(req, params)
+                return result
+
+            # 2. Build Query (Predefined or Generated)
+            query, origin = await self._build_traced(req, params, trace)
+
+            # 3. Execute
+            data, error = await self.run_query(req, query, origin)
+            if error:
+                return error
+
+            answer = await self.explain(data, req.question, params["intent"], self._report_limit(params))
+            return {
+                "answer": answer,
+                "confidence": "high" if params["intent"] in self.PREDEFINED_QUERIES else "medium"
+            }
+
+    async def handle_stream(self, req):
+        """Same pipeline as `handle`, yielding (event, payload) as stages finish.
+
+        Events: "intent" (resolved intent, dates and query), "table" (raw
+        tableData as soon as Shopify answers), "token" (explanation deltas as
+        the LLM produces them) and finally "done" with the full response.
+        """
+        with trace_request("ask_stream") as trace:
+            params = await self._resolve_traced(req, trace)
+            if params.get("intent") == "reorder_forecast":
+                yield "intent", {"intent": "reorder_forecast", "since": params.get("since"), "until": params.get("until"), "query": None}
+                yield "done", await self.handle_reorder_forecast(req, params)
+                return
+
+            query, origin = await self._build_traced(req, params, trace)
+            yield "intent", {"intent": params["intent"], "since": params.get("since"), "until": params.get("until"), "query": query}
+
+            data, error = await self.run_query(req, query, origin)
+            if error:
+                yield "done", error
+                return
+            yield "table", data.get("data", {}).get("shopifyqlQuery", {}).get("tableData", {})
+
+            parts = []
+            async for delta in self.explain_stream(data, req.question, params["intent"], self._report_limit(params)):
+                parts.append(delta)
+                yield "token", {"text": delta}
+            yield "done", {
+                "answer": "".join(parts).strip(),
+                "confidence": "high" if params["intent"] in self.PREDEFINED_QUERIES else "medium"
+            }
+
+    async def _resolve_traced(self, req, trace):
+        with stage("route"):
+            params = await self.resolve_params(req)
+        self.warmer.record(req, params)
+        trace.intent = self._intent_label(params.get("intent"))
+        if params.get("intent") == "reorder_forecast":
+            trace.origin = "predefined"
+        return params
+
+    async def _build_traced(self, req, params, trace):
+        with stage("build"):
+            query, origin = await self.build_query(req, params)
+        trace.origin = origin
+        return query, origin
+
+    def _opened(self, store):
+        # The SQLite stores are cached properties, opened on first use
+        return store in self.__dict__
+
+    def _cache_metrics(self):
+        results = self.result_cache.stats()
+        metrics = [
+            ("result_cache_requests_total", "counter", "Result cache lookups by outcome.",
+             [({"outcome": "hit"}, results["hits"]), ({"outcome": "miss"}, results["misses"])]),
+            ("result_cache_coalesced_total", "counter", "Misses that waited on an identical in-flight query instead of fetching.",
+             [({"scope": "process"}, results["coalesced"]), ({"scope": "shared"}, results.get("waited", 0))]),
+        ]
+        # A scrape does not open a store nothing has used yet
+        if self._opened("generated_queries"):
+            queries = self.generated_queries.stats()
+            metrics += [
+                ("generated_query_cache_entries", "gauge", "Stored LLM-generated ShopifyQL queries.", [({}, queries["entries"])]),
+                ("generated_query_cache_requests_total", "counter", "Generated query lookups by outcome.",
+                 [({"outcome": "hit"}, queries["hits"]), ({"outcome": "miss"}, queries["misses"])]),
             ]
+        if self._opened("rollups"):
+            rollups = self.rollups.stats()
+            metrics += [
+                ("rollup_series", "gauge", "Time series with closed days in the rollup store.", [({}, rollups["series"])]),
+                ("rollup_stored_days", "gauge", "Closed daily buckets held in the rollup store.", [({}, rollups["days"])]),
+            ]
+        if "entries" in results:
+            # Only the in-process backend knows its size; a shared server reports its own
+            metrics += [
+                ("result_cache_entries", "gauge", "Shopify results held in memory.", [({}, results["entries"])]),
+                ("result_cache_bytes", "gauge", "Approximate size of cached Shopify results.", [({}, results["bytes"])]),
+                ("result_cache_evictions_total", "counter", "Results evicted to stay under the byte cap.", [({}, results["evictions"])]),
+            ]
+        if "errors" in results:
+            metrics.append(("result_cache_errors_total", "counter", "Shared cache calls that failed.", [({}, results["errors"])]))
+        explanations = self.explanation_cache.stats()
+        metrics.append(("explanation_cache_requests_total", "counter", "Explanation cache lookups by outcome.",
+                        [({"outcome": "hit"}, explanations["hits"]), ({"outcome": "miss"}, explanations["misses"])]))
+        if "entries" in explanations:
+            metrics += [
+                ("explanation_cache_entries", "gauge", "LLM explanations held in memory.", [({}, explanations["entries"])]),
+                ("explanation_cache_bytes", "gauge", "Approximate size of cached explanations.", [({}, explanations["bytes"])]),
+                ("explanation_cache_evictions_total", "counter", "Explanations evicted to stay under the byte cap.",
+                 [({}, explanations["evictions"])]),
+            ]
+        return metrics
+
+    def _intent_label(self, intent):
+        # Keep metric label values bounded whatever the LLM parser returns
+        if intent in self.PREDEFINED_QUERIES or intent == "reorder_forecast":
+            return intent
+        return "other"
+
+    async def handle_batch(self, req):
+        """Answer `req.questions` for one shop in a single pass.
+
+        Identical questions are answered once. The router resolves what it
+        can and one LLM call parses the rest; identical ShopifyQL runs once
+        and distinct queries run concurrently under the per-shop limit;
+        explanations are requested EXPLAIN_BATCH_SIZE questions per LLM call.
+        Returns the answers in input order with per-stage timings and counts.
+        """
+        with trace_request("batch") as trace:
+            trace.intent = trace.origin = "batch"
+            started = last = time.perf_counter()
+            timing = {}
+
+            def lap(name):
+                nonlocal last
+                now = time.perf_counter()
+                timing[f"{name}_ms"] = round((now - last) * 1000, 1)
+                last = now
+
+            unique = list(dict.fromkeys(req.questions))
+            reqs = {
+                q: SimpleNamespace(
+                    shop_domain=req.shop_domain, access_token=req.access_token,
+                    question=q, bypass_cache=getattr(req, "bypass_cache", False)
+                )
+                for q in unique
+            }
+
+            # 1. Intents: router first, one batched LLM call for the remainder
+            with stage("route"):
+                params = [self.router.route(q) for q in unique]
+                pending = [i for i, p in enumerate(params) if p is None]
+                for i, parsed in zip(pending, await self.parse_many([unique[i] for i in pending])):
+                    params[i] = parsed
+            ROUTER_DECISIONS.inc(len(unique) - len(pending), resolver="router")
+            for q, p in zip(unique, params):
+                if isinstance(p, dict):
+                    self.warmer.record(reqs[q], p)
+            ROUTER_DECISIONS.inc(len(pending), resolver="llm")
+            lap("parse")
+
+            # 2. Queries, deduplicated across questions
+            async def build(q, p):
+                if p.get("intent") == "reorder_forecast":
+                    return None, "reorder"
+                return await self.build_query(reqs[q], p)
+
+            with stage("build"):
+                built = await asyncio.gather(*(build(q, p) for q, p in zip(unique, params)), return_exceptions=True)
+            distinct = {}
+            for q, b in zip(unique, built):
+                if not isinstance(b, Exception) and b[0] is not None:
+                    distinct.setdefault(normalize_query(b[0]), (b[0], b[1], reqs[q]))
+            lap("build")
+
+            # 3. Execute distinct queries concurrently; one failure does not sink the batch
+            sem = self._shop_semaphore(req.shop_domain)
+
+            async def execute(query, origin, r):
+                async with sem:
+                    return await self.run_query(r, query, origin)
+
+            jobs = [execute(*args) for args in distinct.values()]
+            reorder_q = next((q for q, b in zip(unique, built) if not isinstance(b, Exception) and b[1] == "reorder"), None)
+            if reorder_q is not None:
+                jobs.append(self.handle_reorder_forecast(reqs[reorder_q], {"intent": "reorder_forecast"}))
+            outcomes = await asyncio.gather(*jobs, return_exceptions=True)
+            executed = dict(zip(distinct, outcomes))
+            reorder_result = outcomes[-1] if reorder_q is not None else None
+            lap("execute")
+
+            # 4. Explain everything that came back with data
+            answers = {}
+            to_explain = []
+            for q, p, b in zip(unique, params, built):
+                if isinstance(b, Exception):
+                    answers[q] = {"answer": f"Error: {b}", "confidence": "low"}
+                    continue
+                outcome = reorder_result if b[1] == "reorder" else executed[normalize_query(b[0])]
+                if isinstance(outcome, Exception):
+                    answers[q] = {"answer": f"Error: {outcome}", "confidence": "low"}
+                elif b[1] == "reorder":
+                    answers[q] = outcome
+                elif outcome[1]:
+                    answers[q] = outcome[1]
+                else:
+                    to_explain.append((q, outcome[0], p["intent"], self._report_limit(p)))
+            # Templated and cached explanations need no LLM call
+            local = await asyncio.gather(*(self._explain_locally(data, q, intent, limit)
+                                           for q, data, intent, limit in to_explain))
+            unexplained = []
+            for (q, data, intent, _), (answer, _) in zip(to_explain, local):
+                confidence = "high" if intent in self.PREDEFINED_QUERIES else "medium"
+                if answer is not None:
+                    answers[q] = {"answer": answer, "confidence": confidence}
+                else:
+                    unexplained.append((q, data, confidence))
+            to_explain = unexplained
+            chunks = [to_explain[i:i + self.EXPLAIN_BATCH_SIZE] for i in range(0, len(to_explain), self.EXPLAIN_BATCH_SIZE)]
+            explained = await asyncio.gather(
+                *(self.explain_many([(data, q) for q, data, _ in chunk]) for chunk in chunks),
+                return_exceptions=True
+            )
+            for chunk, texts in zip(chunks, explained):
+                for i, (q, _, confidence) in enumerate(chunk):
+                    if isinstance(texts, Exception):
+                        answers[q] = {"answer": f"Error: {texts}", "confidence": "low"}
+                    else:
+                        answers[q] = {"answer": texts[i], "confidence": confidence}
+            lap("explain")
+            timing["total_ms"] = round((last - started) * 1000, 1)
+
+            return {
+                "answers": [{"question": q, **answers[q]} for q in req.questions],
+                "timing": timing,
+                "stats": {
+                    "questions": len(req.questions),
+                    "unique_questions": len(unique),
+                    "routed_locally": len(unique) - len(pending),
+                    "distinct_queries": len(distinct) + (1 if reorder_q is not None else 0),
+                    "explain_calls": len(chunks),
+                    "explained_locally": sum(1 for answer, _ in local if answer is not None)
+                }
+            }
+
+    async def resolve_params(self, req):
+        if hasattr(req, "force_intent") and getattr(req, "force_intent"):
+            fi = getattr(req, "force_intent")
+            fs = getattr(req, "force_since", "startOfDay(-30d)")
+            fu = getattr(req, "force_until", "today")
+            params = {"intent": fi, "since": fs, "until": fu}
+        else:
+            params = await self.parse_request(req.question)
+        # Explicit limit / filters on the request apply to predefined reports as-is
+        if getattr(req, "limit", None):
+            params = {**params, "limit": req.limit}
+        if getattr(req, "filters", None):
+            params = {**params, "filters": [dict(f) for f in req.filters]}
+        return params
+
+    async def build_query(self, req, params):
+        """Return (query, origin); origin is "predefined", "generated" or "reused"."""
+        if params["intent"] in self.TEMPLATES:
+            print(f"🎯 Used Predefined Query: {params['intent']}")
+            query = self.TEMPLATES[params["intent"]].bind(params["since"], params["until"], self._report_limit(params))
+            if params.get("filters"):
+                query = query.where(*(condition(f["field"], f.get("op", "="), f.get("value")) for f in params["filters"]))
+            return query.render(), "predefined"
+
+        query = self.generated_queries.lookup(req.question)
+        if query is not None:
+            print("♻️ Reused generated query")
+            return query, "reused"
+        print("🤖 Generating SQL with AI...")
+        return await self.build_shopifyql(params["intent"], req.question), "generated"
+
+    @staticmethod
+    def _report_limit(params):
+        """The LIMIT a predefined report is bound with, or None for the template's."""
+        if not params.get("limit"):
+            return None
+        try:
+            return int(params["limit"]) if int(params["limit"]) > 0 else 5
+        except Exception:
+            return 5
+
+    async def run_query(self, req, query, origin):
+        """Execute `query` for the request's shop. Returns (data, error_response)."""
+        data = await self.execute_shopifyql(
+            req.shop_domain, req.access_token, query,
+            use_cache=not getattr(req, "bypass_cache", False)
         )
-        content = res.choices[0].message.content.strip()
+
+        # DEBUG: Check for errors immediately
+        error = self._shopify_error(data)
+        if error:
+            if origin == "reused" and data.get("data", {}).get("shopifyqlQuery", {}).get("parseErrors"):
+                await self.generated_queries.forget(query)
+            return data, error
+        if origin == "generated":
+            await self.generated_queries.store(req.question, query)
+        return data, None
+
+    async def parse_request(self, question):
+        # Deterministic router first; only low-confidence questions go to the LLM
+        routed = self.router.route(question)
+        if routed is not None:
+            ROUTER_DECISIONS.inc(resolver="router")
+            return routed
+
+        ROUTER_DECISIONS.inc(resolver="llm")
+        # Parsing does not depend on the shop, so any identical question in flight will do
+        parsed = await self._flights["route"].do(" ".join(tokenize(question)), lambda: self._llm_parse(question))
+        return dict(parsed)
+
+    async def _llm_parse(self, question):
+        # Ask LLM to extract intent key and date range
+        content = (await chat_completion([
+            {"role": "system", "content": self.PARSER_PROMPT},
+            {"role": "user", "content": question}
+        ])).strip()
         # Ensure we get clean JSON
         try:
             return json.loads(content.replace("```json", "").replace("```", ""))
         except:
             return {"intent": "unknown", "since": "startOfDay(-30d)", "until": "today"}
 
-    def build_shopifyql(self, intent, question):
-        res = openai.ChatCompletion.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a ShopifyQL expert. Return ONLY the raw ShopifyQL query. No markdown. Examples:\n1. Top products: FROM sales SHOW product_title, total_sales GROUP BY product_title ORDER BY total_sales DESC LIMIT 5 SINCE -7d\n2. Sales trend: FROM sales SHOW total_sales GROUP BY day SINCE -30d\n3. Inventory: FROM inventory SHOW product_title, inventory_quantity GROUP BY product_title\n4. Reorder/Forecast: FROM sales SHOW product_title, net_items_sold GROUP BY product_title SINCE -30d ORDER BY net_items_sold DESC"},
-                {"role": "user", "content": f"Generate ShopifyQL for intent '{intent}' based on question: {question}"}
-            ]
+    async def parse_many(self, questions):
+        """LLM-parse several questions with one call; falls back per question."""
+        if len(questions) <= 1:
+            return [await self._llm_parse(q) for q in questions]
+        content = (await chat_completion([
+            {"role": "system", "content": self.BATCH_PARSE_PROMPT},
+            {"role": "user", "content": "\n".join(f"{i}. {q}" for i, q in enumerate(questions, 1))}
+        ])).strip()
+        try:
+            results = json.loads(content.replace("```json", "").replace("```", ""))["results"]
+            if len(results) == len(questions) and all(isinstance(r, dict) and "intent" in r for r in results):
+                return results
+        except Exception:
+            pass
+        print("⚠️ Batch parse failed, parsing questions one by one")
+        return await asyncio.gather(*(self._llm_parse(q) for q in questions))
+
+    async def build_shopifyql(self, intent, question):
+        return await self._flights["generate"].do(
+            (intent, " ".join(tokenize(question))), lambda: self._generate_shopifyql(intent, question)
         )
+
+    async def _generate_shopifyql(self, intent, question):
+        content = await chat_completion([
+            {"role": "system", "content": "You are a ShopifyQL expert. Return ONLY the raw ShopifyQL query. No markdown. Examples:\n1. Top products: FROM sales SHOW product_title, total_sales GROUP BY product_title ORDER BY total_sales DESC LIMIT 5 SINCE -7d\n2. Sales trend: FROM sales SHOW total_sales GROUP BY day SINCE -30d\n3. Inventory: FROM inventory SHOW product_title, inventory_quantity GROUP BY product_title\n4. Reorder/Forecast: FROM sales SHOW product_title, net_items_sold GROUP BY product_title SINCE -30d ORDER BY net_items_sold DESC"},
+            {"role": "user", "content": f"Generate ShopifyQL for intent '{intent}' based on question: {question}"}
+        ])
         # Clean up response just in case
-        return res.choices[0].message.content.strip().replace("`", "").replace("sql", "").replace("shopifyql", "").strip()
-
-    def execute_shopifyql(self, shop_domain, token, query):
-        # Escape quotes in the query string for the GraphQL payload
-        escaped_query = query.replace('"', '\\"')
-        graphql_query = f"""
-        {{
-          shopifyqlQuery(query: "{escaped_query}") {{
-            tableData {{
-              columns {{
-                name
-                dataType
-                displayName
-              }}
-              rows
-            }}
-            parseErrors
-          }}
-        }}
+        return content.strip().replace("`", "").replace("sql", "").replace("shopifyql", "").strip()
+
+    async def execute_shopifyql(self, shop_domain, token, query, use_cache=True, refresh=False):
+        """Run `query` for a shop, through the result cache and rollup store.
+
+        `refresh` skips the cache lookup but still stores the fresh result,
+        which is how the warm-up scheduler renews entries before they expire.
         """
-        
-        response = requests.post(
-            f"https://{shop_domain}/admin/api/2025-10/graphql.json",
-            headers={
-                "X-Shopify-Access-Token": token,
-                "Content-Type": "application/json"
-            },
-            json={"query": graphql_query}
+        if use_cache and not refresh:
+            cached = await self.result_cache.get(shop_domain, query)
+            if cached is not None:
+                return cached
+            # Identical queries already in flight, in this worker or another
+            # one sharing the cache, wait for that fetch instead of repeating it
+            return await self.result_cache.coalesce(
+                shop_domain, query, lambda: self._execute_and_store(shop_domain, token, query, use_cache)
+            )
+        return await self._execute_and_store(shop_domain, token, query, use_cache, refresh)
+
+    async def _execute_and_store(self, shop_domain, token, query, use_cache, refresh=False):
+        # Daily time series are rebuilt from stored closed days plus a small
+        # fetch; bypass_cache skips the store as well
+        plan = self.rollups.plan(query) if use_cache else None
+        # Grouped sales reports are derived from a cached base pull
+        local = self.local_engine.plan(query) if use_cache and plan is None else None
+        if plan is not None:
+            data = await self.execute_rollup(shop_domain, token, query, plan, refresh)
+            size = len(json.dumps(data))
+        elif local is not None:
+            data = await self.execute_local(shop_domain, token, query, local, refresh)
+            size = len(json.dumps(data))
+        else:
+            data, size = await self.fetch_shopifyql(shop_domain, token, query)
+        if not self._shopify_error(data):
+            await self.result_cache.put(shop_domain, query, data, size=size)
+        return data
+
+    async def fetch_shopifyql(self, shop_domain, token, query):
+        """POST one query through the shop's scheduler. Returns (data, body size)."""
+        size = 0
+
+        async def send():
+            nonlocal size
+            with stage("shopify"):
+                response = await get_http_client().post(
+                    shopify_graphql_url(shop_domain),
+                    headers=self._shopify_headers(token),
+                    content=graphql_body(query)
+                )
+            UPSTREAM_REQUESTS.inc(service="shopify", status=response.status_code)
+            UPSTREAM_BYTES.inc(len(response.request.content), service="shopify", direction="out")
+            # Bytes on the wire, so gzip shows up
+            UPSTREAM_BYTES.inc(response.num_bytes_downloaded, service="shopify", direction="in")
+            print(f"Shopify Status: {response.status_code}")
+            if sample_debug_body():
+                print(f"Shopify Response: {response.text}")
+            size = len(response.content)
+            with stage("decode"):
+                try:
+                    return response.status_code, response.json()
+                except ValueError:
+                    # e.g. an HTML error page from a proxy in front of Shopify
+                    return response.status_code, {"errors": [{"message": f"HTTP {response.status_code}: {response.text[:200]}"}]}
+
+        # Waits for the shop's cost budget and retries throttled/5xx responses
+        data = await self.shopify_scheduler.run(shop_domain, send)
+        return data, size
+
+    async def execute_rollup(self, shop_domain, token, query, plan, refresh=False):
+        """Answer a `TIMESERIES day` query from the rollup store.
+
+        Only the open days and days never fetched before are requested from
+        Shopify, one query per contiguous run; the rest come from SQLite.
+        Runs go through the result cache, so reports projected from the same
+        series share the open days' fetch while it is fresh; `refresh`
+        fetches the runs again instead. Falls back to running `query` as-is
+        if a run comes back without a `day` column.
+        """
+        with stage("rollup"):
+            columns, days = self.rollups.load(shop_domain, plan)
+        runs = self.rollups.missing_ranges(plan, days)
+        stored = sum(1 for d in days if not any(a <= d <= b for a, b in runs))
+
+        async def fetch_run(run_query):
+            cached = None if refresh else await self.result_cache.get(shop_domain, run_query)
+            if cached is not None:
+                return cached, False
+            data, size = await self.fetch_shopifyql(shop_domain, token, run_query)
+            if not self._shopify_error(data):
+                await self.result_cache.put(shop_domain, run_query, data, size=size)
+            return data, True
+
+        fetched = await asyncio.gather(*(fetch_run(self.rollups.fetch_query(plan, a, b)) for a, b in runs))
+        with stage("rollup"):
+            for (a, b), (data, _) in zip(runs, fetched):
+                if self._shopify_error(data):
+                    return data
+                merged = await self.rollups.merge(shop_domain, plan, a, b, data)
+                if merged is None:
+                    print("⚠️ Rollup fetch returned no day column, running the full query")
+                    return (await self.fetch_shopifyql(shop_domain, token, query))[0]
+                columns, new_days = merged
+                days.update(new_days)
+            from_shopify = sum((b - a).days + 1 for (a, b), (_, fresh) in zip(runs, fetched) if fresh)
+            ROLLUP_DAYS.inc(stored, source="store")
+            ROLLUP_DAYS.inc(sum((b - a).days + 1 for a, b in runs) - from_shopify, source="cache")
+            ROLLUP_DAYS.inc(from_shopify, source="shopify")
+            print(f"🗓️ Rollup: {stored} stored days, {sum(1 for _, fresh in fetched if fresh)} Shopify fetch(es)")
+            return self.rollups.assemble(plan, columns, days)
+
+    async def execute_local(self, shop_domain, token, query, plan, refresh=False):
+        """Answer a grouped sales report from the local engine.
+
+        The base pulls (the window, plus the previous one for COMPARE TO) go
+        through execute_shopifyql, so they are cached and shared by every
+        report derived from them; `refresh` refetches them. Runs `query`
+        as-is if the engine can't use a base pull.
+        """
+        bases = await asyncio.gather(*(
+            self.execute_shopifyql(shop_domain, token, q, refresh=refresh) for q in plan["bases"]
+        ))
+        for data in bases:
+            if self._shopify_error(data):
+                return data
+        with stage("local"):
+            data = self.local_engine.answer(plan, *bases)
+        if data is None:
+            LOCAL_REPORTS.inc(outcome="remote")
+            print("⚠️ Base pull unusable for the local engine, running the full query")
+            return (await self.fetch_shopifyql(shop_domain, token, query))[0]
+        LOCAL_REPORTS.inc(outcome="local")
+        print(f"🧮 Local engine: {len(data['data']['shopifyqlQuery']['tableData']['rows'])} rows from {len(bases)} base pull(s)")
+        return data
+
+    def _shopify_headers(self, token):
+        return {
+            "X-Shopify-Access-Token": token,
+            "Content-Type": "application/json"
+        }
+
+    @asynccontextmanager
+    async def stream_shopifyql(self, shop_domain, token, query):
+        """Run a ShopifyQL query and expose its rows as a ShopifyqlRowStream.
+
+        The body is parsed while it downloads, so large pulls never sit in
+        memory as text or as a decoded document. Results are not cached.
+        Like execute_shopifyql it goes through the shop's scheduler; a
+        throttled or 5xx response is retried before any rows are handed out,
+        and an open circuit yields a stream of its `errors` response.
+        """
+        import httpx
+        from row_stream import ShopifyqlRowStream
+        scheduler = self.shopify_scheduler
+        for attempt in range(scheduler.max_retries + 1):
+            async with scheduler.slot(shop_domain) as settle:
+                rejected = scheduler.rejection(shop_domain)
+                if rejected:
+                    settle(rejected)
+                    stream = ShopifyqlRowStream.from_text(json.dumps(rejected))
+                    await stream.read_header()
+                    yield stream
+                    return
+                answered = False
+                try:
+                    async with get_http_client().stream(
+                        "POST",
+                        shopify_graphql_url(shop_domain),
+                        headers=self._shopify_headers(token),
+                        content=graphql_body(query)
+                    ) as response:
+                        answered = True
+                        scheduler.record(shop_domain, response.status_code)
+                        UPSTREAM_REQUESTS.inc(service="shopify", status=response.status_code)
+                        UPSTREAM_BYTES.inc(len(response.request.content), service="shopify", direction="out")
+                        print(f"Shopify Status: {response.status_code} (streaming)")
+                        stream = ShopifyqlRowStream(response.aiter_bytes(), status=response.status_code)
+                        has_rows = await stream.read_header()
+                        reason = None if has_rows else scheduler.retry_reason(response.status_code, stream.document)
+                        if reason is None or attempt == scheduler.max_retries:
+                            yield stream
+                            settle(stream.document)
+                            UPSTREAM_BYTES.inc(response.num_bytes_downloaded, service="shopify", direction="in")
+                            return
+                        settle(stream.document)
+                except BaseException as e:
+                    # Failures before the response arrived count against the shop's circuit
+                    if not answered:
+                        scheduler.record(shop_domain, False if isinstance(e, httpx.TransportError) else None)
+                    raise
+            await scheduler.backoff(attempt, reason)
+
+    async def execute_many(self, shop_domain, token, queries, use_cache=True, run=None):
+        """Run independent ShopifyQL queries concurrently for one shop.
+
+        At most MAX_CONCURRENT_QUERIES_PER_SHOP are in flight per shop. Returns
+        (results, None) with results in the order of `queries`, or
+        (None, error_response) as soon as any query comes back with `errors`
+        or `parseErrors`; the remaining queries are cancelled. `run(query)`
+        replaces execute_shopifyql when given and must return a response
+        shaped like it.
+        """
+        sem = self._shop_semaphore(shop_domain)
+
+        async def limited(query):
+            async with sem:
+                if run is not None:
+                    return await run(query)
+                return await self.execute_shopifyql(shop_domain, token, query, use_cache=use_cache)
+
+        tasks = [asyncio.ensure_future(limited(q)) for q in queries]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                error = self._shopify_error(await next_done)
+                if error:
+                    return None, error
+            return [t.result() for t in tasks], None
+        finally:
+            for t in tasks:
+                t.cancel()
+
+    def _shop_semaphore(self, shop_domain):
+        return self._shop_semaphores.setdefault(
+            shop_domain, asyncio.Semaphore(self.MAX_CONCURRENT_QUERIES_PER_SHOP)
         )
-        print(f"Shopify Status: {response.status_code}")
-        print(f"Shopify Response: {response.text}")
-        return response.json()
-
-    def explain(self, data, question):
-        res = openai.ChatCompletion.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a Chief Inventory Officer. Be CONFIDENT, CONCISE, and DIRECT.\n\nRULES:\n1. Currency: ALWAYS use ₹ (INR).\n2. **Evidence-Based**: Cite the exact numbers from the data to prove you read it. (e.g., 'With 50 units sold...' instead of 'Sales were high').\n3. **Business Translation**: Convert technical field names into business terms (e.g., 'net_items_sold' -> 'units sold', 'inventory_turnover' -> 'sales velocity').\n4. For Reorder Questions use this template:\n   'Based on the last 30 days, you sell around [daily_rate] units of [Product] per day. You should reorder at least [daily_rate * 7] units to avoid stockouts.'\n5. For Sales/Returns:\n   'Your [Metric] is [Value], which indicates [Business Insight].'"},
-                {"role": "user", "content": f"Question: {question}\nData: {json.dumps(data)}"}
+
+    def _shopify_error(self, data):
+        if "errors" in data:
+            return {"answer": f"Shopify API Error: {json.dumps(data['errors'])}", "confidence": "high"}
+        gql_errors = data.get("data", {}).get("shopifyqlQuery", {}).get("parseErrors", [])
+        if gql_errors:
+            return {"answer": f"Query Error: {json.dumps(gql_errors)}", "confidence": "high"}
+        return None
+
+    async def explain(self, data, question, intent=None, limit=None):
+        answer, messages = await self._explain_locally(data, question, intent, limit)
+        if answer is not None:
+            return answer
+        key = self._explain_key(messages, question)
+
+        async def ask_llm():
+            content = (await chat_completion(messages)).strip()
+            await self._store_explanation(key, content)
+            return content
+
+        with stage("explain"):
+            content = await self._flights["explain"].do(key, ask_llm)
+        EXPLAIN_ANSWERS.inc(source="llm")
+        return content
+
+    async def _explain_locally(self, data, question, intent=None, limit=None):
+        """(answer, None) from a template, (answer, messages) from the
+        explanation cache, or (None, messages) when the LLM has to answer.
+
+        `limit` is the number of rows the question asked for, if any.
+        """
+        if self.explain_templates and intent in self.TEMPLATES:
+            from narrative import templated_answer
+            with stage("explain"):
+                answer = templated_answer(data, question, self.TEMPLATES[intent], limit)
+            if answer is not None:
+                EXPLAIN_ANSWERS.inc(source="template")
+                return answer, None
+        messages = self._explain_messages(data, question)
+        if self.EXPLAIN_CACHE_TTL:
+            cached = await self.explanation_cache.get(EXPLANATIONS, self._explanation_id(self._explain_key(messages, question)))
+            if cached is not None:
+                EXPLAIN_ANSWERS.inc(source="cache")
+                return cached, messages
+        return None, messages
+
+    def _explanation_id(self, key):
+        return "EXPLAIN " + " ".join(key)
+
+    async def _store_explanation(self, key, answer):
+        if self.EXPLAIN_CACHE_TTL and answer:
+            await self.explanation_cache.put(EXPLANATIONS, self._explanation_id(key), answer, size=len(answer),
+                                             ttl=self.EXPLAIN_CACHE_TTL)
+
+    async def explain_many(self, items):
+        """Explain several (data, question) pairs with one LLM call.
+
+        Falls back to one explain() per item if the reply is not a JSON list
+        with one answer per question. Answers go to the explanation cache.
+        """
+        if len(items) == 1:
+            return [await self.explain(*items[0])]
+        from digest import summarize_result
+        with stage("table"):
+            digests = [summarize_result(data, question, self.EXPLAIN_TOKEN_BUDGET) for data, question in items]
+            sections = [
+                f"### Question {i}: {question}\nData:\n{digest}"
+                for i, ((_, question), digest) in enumerate(zip(items, digests), 1)
             ]
-        )
-        return res.choices[0].message.content.strip()
+        with stage("explain"):
+            content = (await chat_completion([
+                {"role": "system", "content": self.BATCH_EXPLAIN_PROMPT},
+                {"role": "user", "content": "\n\n".join(sections)}
+            ])).strip()
+        try:
+            answers = json.loads(content.replace("```json", "").replace("```", ""))["answers"]
+            if len(answers) == len(items) and all(isinstance(a, str) for a in answers):
+                answers = [a.strip() for a in answers]
+                for (_, question), digest, answer in zip(items, digests, answers):
+                    await self._store_explanation(self._explain_key([{"content": f"Question: {question}\nData:\n{digest}"}], question), answer)
+                EXPLAIN_ANSWERS.inc(len(answers), source="llm")
+                return answers
+        except Exception:
+            pass
+        print("⚠️ Batch explain failed, explaining questions one by one")
+        return await asyncio.gather(*(self.explain(data, question) for data, question in items))
+
+    async def explain_stream(self, data, question, intent=None, limit=None):
+        answer, messages = await self._explain_locally(data, question, intent, limit)
+        if answer is not None:
+            yield answer
+            return
+        key = self._explain_key(messages, question)
+
+        async def ask_llm():
+            parts = []
+            async for delta in stream_chat_completion(messages):
+                parts.append(delta)
+                yield delta
+            await self._store_explanation(key, "".join(parts).strip())
+
+        with stage("explain"):
+            async for delta in self._flights["explain"].stream(("stream",) + key, ask_llm):
+                yield delta
+        EXPLAIN_ANSWERS.inc(source="llm")
+
+    def _explain_key(self, messages, question):
+        # Same digest and same question (up to wording noise) -> same explanation
+        digest = hashlib.sha1(messages[-1]["content"].split("\nData:\n", 1)[-1].encode()).hexdigest()
+        return (digest, " ".join(tokenize(question)))
+
+    def _explain_messages(self, data, question):
+        from digest import summarize_result
+        with stage("table"):
+            digest = summarize_result(data, question, self.EXPLAIN_TOKEN_BUDGET)
+        return [
+            {"role": "system", "content": self.EXPLAIN_PROMPT},
+            {"role": "user", "content": f"Question: {question}\nData:\n{digest}"}
+        ]
+
+    async def handle_reorder_forecast(self, req, params):
+        totals, error = await self.reorder_totals(req)
+        if error:
+            return error
+
+        with stage("table"):
+            return self._reorder_summary(*totals)
+
+    async def reorder_totals(self, req):
+        """Per-SKU daily sales and on-hand totals. Returns ((sales, inventory, start), error).
 
-    def handle_reorder_forecast(self, req, params):
+        `sales` is (skus, matrix, titles) with one column per day of the
+        last FORECAST_HISTORY_DAYS full days, the first being `start`.
+        """
+        from forecast import history_start
+        days = self.FORECAST_HISTORY_DAYS
+        start = history_start(days)
         sales_query = f"""
 FROM sales
 SHOW product_title, product_variant_sku, net_items_sold
 WHERE line_type = 'product'
-GROUP BY product_title, product_variant_sku
-SINCE startOfDay(-30d) UNTIL today
-ORDER BY net_items_sold DESC
-LIMIT 1000
+GROUP BY product_title, product_variant_sku, day
+SINCE startOfDay(-{days}d) UNTIL startOfDay(-1d)
+ORDER BY day ASC
+LIMIT 1000000
 """
         inv_query = f"""
 FROM inventory
@@ -468,85 +1163,114 @@ ORDER BY ending_inventory_units DESC
 LIMIT 2000
 """
 
-        sales_data = self.execute_shopifyql(req.shop_domain, req.access_token, sales_query)
-        if "errors" in sales_data:
-            return {"answer": f"Shopify API Error: {json.dumps(sales_data['errors'])}", "confidence": "high"}
-        if sales_data.get("data", {}).get("shopifyqlQuery", {}).get("parseErrors"):
-            return {"answer": f"Query Error: {json.dumps(sales_data['data']['shopifyqlQuery']['parseErrors'])}", "confidence": "high"}
-
-        inv_data = self.execute_shopifyql(req.shop_domain, req.access_token, inv_query)
-        if "errors" in inv_data:
-            return {"answer": f"Shopify API Error: {json.dumps(inv_data['errors'])}", "confidence": "high"}
-        if inv_data.get("data", {}).get("shopifyqlQuery", {}).get("parseErrors"):
-            return {"answer": f"Query Error: {json.dumps(inv_data['data']['shopifyqlQuery']['parseErrors'])}", "confidence": "high"}
-
-        sales_table = self._to_table(sales_data)
-        inv_table = self._to_table(inv_data)
-
-        sales_by_sku = {}
-        for row in sales_table:
-            sku = row.get("product_variant_sku") or row.get("product_title")
-            if not sku:
-                continue
-            val = row.get("net_items_sold")
-            if isinstance(val, str) and val.strip().lower() == "net_items_sold":
-                continue
-            sales_by_sku[sku] = {
-                "title": row.get("product_title") or sku,
-                "sold_30d": self._to_number(val)
-            }
+        measures = {sales_query: "net_items_sold", inv_query: "ending_inventory_units"}
+        totals = {}
 
-        inv_by_sku = {}
-        for row in inv_table:
-            sku = row.get("product_variant_sku") or row.get("product_title")
-            if not sku:
-                continue
-            val = row.get("ending_inventory_units")
-            if isinstance(val, str) and val.strip().lower() == "ending_inventory_units":
-                continue
-            inv_by_sku[sku] = {
-                "title": row.get("product_title") or sku,
-                "on_hand": self._to_number(val)
-            }
+        async def aggregate(query):
+            response, totals[query] = await self.sku_totals(
+                req.shop_domain, req.access_token, query, measures[query],
+                use_cache=not getattr(req, "bypass_cache", False),
+                daily=(start, days) if query is sales_query else None
+            )
+            return response
+
+        _, error = await self.execute_many(
+            req.shop_domain, req.access_token, [sales_query, inv_query], run=aggregate
+        )
+        if error:
+            return None, error
+        return (totals[sales_query], totals[inv_query], start), None
+
+    async def sku_totals(self, shop_domain, token, query, measure, use_cache=True, daily=None):
+        """Stream `query` and sum `measure` per SKU (falling back to title).
 
-        days = 30
-        results = []
-        total_forecast = 0
-        total_inventory = 0
-        total_reorder = 0
-
-        skus = set(list(sales_by_sku.keys()) + list(inv_by_sku.keys()))
-        for sku in skus:
-            sold_30d = sales_by_sku.get(sku, {}).get("sold_30d", 0.0)
-            on_hand = inv_by_sku.get(sku, {}).get("on_hand", 0.0)
-            daily_rate = sold_30d / days if days else 0.0
-            next_month_need = daily_rate * 30
-            reorder_qty = max(0.0, next_month_need - on_hand)
-            title = sales_by_sku.get(sku, {}).get("title") or inv_by_sku.get(sku, {}).get("title") or sku
-
-            total_forecast += next_month_need
-            total_inventory += on_hand
-            total_reorder += reorder_qty
-
-            if reorder_qty > 0:
-                results.append({
-                    "sku": sku,
-                    "title": title,
-                    "daily_rate": daily_rate,
-                    "forecast_30d": next_month_need,
-                    "on_hand": on_hand,
-                    "reorder_qty": reorder_qty
-                })
-
-        results.sort(key=lambda x: x["reorder_qty"], reverse=True)
+        Rows are folded into running per-SKU sums batch by batch, so memory
+        follows the number of SKUs, not the size of the response. With
+        `daily=(start, days)` the sums are kept per day instead, as a SKU x
+        day matrix (see GroupedDaily). Returns (response, (skus, sums,
+        titles)) where `response` is the document without rows, for error
+        checks. The totals, not the rows, are what goes into the result cache.
+        """
+        cache_key = f"{query}\n-- sku totals of {measure}"
+        if daily:
+            cache_key += f" per day from {daily[0].isoformat()}"
+        if use_cache:
+            cached = await self.result_cache.get(shop_domain, cache_key)
+            if cached is not None:
+                return {}, cached
+            return await self.result_cache.coalesce(
+                shop_domain, cache_key,
+                lambda: self._stream_sku_totals(shop_domain, token, query, measure, cache_key, daily),
+                cached=lambda totals: ({}, totals)
+            )
+        return await self._stream_sku_totals(shop_domain, token, query, measure, cache_key, daily)
+
+    async def _stream_sku_totals(self, shop_domain, token, query, measure, cache_key, daily=None):
+        from table import GroupedDaily, GroupedSum
+        grouped = GroupedDaily(*daily) if daily else GroupedSum()
+        with stage("shopify"):
+            async with self.stream_shopifyql(shop_domain, token, query) as stream:
+                async for table in stream.tables():
+                    self._add_sku_totals(grouped, table, measure)
+        response = stream.document
+        totals = grouped.result()
+        if not self._shopify_error(response):
+            size = sum(arr.nbytes for arr in totals[:2]) + sum(len(t) for t in totals[2])
+            await self.result_cache.put(shop_domain, cache_key, totals, size=size)
+        return response, totals
+
+    def _add_sku_totals(self, grouped, table, measure):
+        import numpy as np
+        from table import GroupedDaily
+        # Key by SKU, falling back to title; rows with neither are dropped
+        keys = table.key("product_variant_sku", "product_title")
+        mask = keys != ""
+        titles = table.key("product_title", "product_variant_sku")
+        if isinstance(grouped, GroupedDaily):
+            grouped.add(keys[mask], table.get("day", np.full(len(table), None))[mask], table.numeric(measure)[mask], titles[mask])
+        else:
+            grouped.add(keys[mask], table.numeric(measure)[mask], titles[mask])
+
+    def _reorder_summary(self, sales_totals, inv_totals, start):
+        import numpy as np
+        from table import align
+        s_keys, sold, s_titles = sales_totals
+        i_keys, on_hand_by_key, i_titles = inv_totals
+        skus, daily_sales, on_hand = align(s_keys, sold, i_keys, on_hand_by_key)
+        plan = self.forecaster.forecast(skus, daily_sales, on_hand, start)
+
+        demand = {h: d.sum() for h, d in plan["demand"].items()}
+        reorder_qty = plan["reorder"][30]
+        total_inventory = on_hand.sum()
+        total_reorder = reorder_qty.sum()
+        lead = int(self.forecaster.lead_time)
+
+        def title(sku):
+            for keys, names in ((s_keys, s_titles), (i_keys, i_titles)):
+                j = np.searchsorted(keys, sku)
+                if j < len(keys) and keys[j] == sku:
+                    return names[j]
+            return sku
+
+        top = np.argsort(-reorder_qty, kind="stable")[:5]
+        top = top[reorder_qty[top] > 0]
         top_lines = []
-        for item in results[:5]:
-            top_lines.append(f"- {item['title']} ({item['sku']}): need ~{int(round(item['forecast_30d']))}, on hand {int(round(item['on_hand']))} → reorder {int(round(item['reorder_qty']))}")
+        for i in top:
+            cover = plan["cover_days"][i]
+            cover = f"~{int(cover)} days of cover" if np.isfinite(cover) else "no recent sales"
+            top_lines.append(
+                f"- {title(skus[i])} ({skus[i]}): need ~{int(round(plan['demand'][30][i]))} next month, "
+                f"on hand {int(round(on_hand[i]))} ({cover}) → reorder {int(round(reorder_qty[i]))}"
+            )
 
         summary = (
-            f"Based on the last 30 days, you will likely need about {int(round(total_forecast))} units next month across all products. "
+            f"Based on daily sales over the last {daily_sales.shape[1]} days (trend and weekday pattern), "
+            f"you will likely need about {int(round(demand[30]))} units next month across all products. "
             f"You currently have ~{int(round(total_inventory))} units on hand. "
-            f"Planned reorder: {int(round(total_reorder))} units.\n\n"
+            f"With a {lead}-day lead time and {self.forecaster.service_level:.0%} service level "
+            f"(~{int(round(plan['safety_stock'].sum()))} units of safety stock), "
+            f"planned reorder: {int(round(total_reorder))} units.\n\n"
+            "Expected demand: " + ", ".join(f"next {h} days ~{int(round(v))}" for h, v in demand.items()) + ".\n\n"
         )
         if top_lines:
             summary += "Top products to reorder:\n" + "\n".join(top_lines)
@@ -554,44 +1278,3 @@ LIMIT 2000
             summary += "No immediate reorders are required given current inventory levels and recent demand."
 
         return {"answer": summary, "confidence": "high"}
-
-    def _to_table(self, data):
-        table = data.get("data", {}).get("shopifyqlQuery", {}).get("tableData", {})
-        cols = [c.get("name") for c in table.get("columns", [])]
-        rows = table.get("rows", [])
-        out = []
-        for r in rows:
-            # ShopifyQL may return rows as dicts (keyed by column name)
-            # or as arrays in the same order as `columns`.
-            if isinstance(r, dict):
-                out.append(r)
-                continue
-            obj = {}
-            if isinstance(r, (list, tuple)):
-                for i, v in enumerate(r):
-                    if i < len(cols):
-                        obj[cols[i]] = v
-            else:
-                # Fallback: single value row, map to the first column if present
-                if cols:
-                    obj[cols[0]] = r
-            out.append(obj)
-        return out
-
-    def _to_number(self, v):
-        if v is None:
-            return 0.0
-        if isinstance(v, (int, float)):
-            return float(v)
-        if isinstance(v, str):
-            s = v.strip()
-            if s == "":
-                return 0.0
-            s = re.sub(r"[^0-9\.-]", "", s)
-            if s in ("", ".", "-", "-."):
-                return 0.0
-            try:
-                return float(s)
-            except Exception:
-                return 0.0
-        return 0.0
@@ -0,0 +1,147 @@
+"""Load benchmark for POST /ask: blocking (legacy) vs asyncio pipeline.
+
+Both services answer "top products" questions, which take the keyword route in
+``parse_request`` and therefore cost one Shopify round trip plus one LLM round
+trip per request. Upstreams are the local stubs from ``stub_servers``.
+
+    python benchmarks/bench_ask_load.py --requests 400 --concurrency 32
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+sys.path.insert(0, SERVICE_DIR)
+
+from stub_servers import free_port, start_stub_server, stub_env, wait_for_port  # noqa: E402
+
+
+def _make_legacy_app():
+    """The pre-async /ask: a sync handler doing blocking requests.post calls."""
+    import json
+    import requests
+    from fastapi import FastAPI
+    from pydantic import BaseModel
+    from agent import AnalyticsAgent
+
+    app = FastAPI()
+    shopify_url = os.environ["SHOPIFY_GRAPHQL_URL"]
+    llm_url = os.environ["OPENAI_BASE_URL"] + "/chat/completions"
+
+    class QuestionRequest(BaseModel):
+        shop_domain: str
+        access_token: str
+        question: str
+
+    @app.post("/ask")
+    def ask(req: QuestionRequest):
+        query = AnalyticsAgent.PREDEFINED_QUERIES["total_sales_by_product"].format(
+            since_date="startOfDay(-30d)", until_date="today"
+        ).replace("LIMIT 1000", "LIMIT 5")
+        escaped_query = query.replace('"', '\\"')
+        data = requests.post(
+            shopify_url.format(shop_domain=req.shop_domain),
+            headers={"X-Shopify-Access-Token": req.access_token},
+            json={"query": f'{{ shopifyqlQuery(query: "{escaped_query}") {{ tableData {{ columns {{ name dataType displayName }} rows }} parseErrors }} }}'}
+        ).json()
+        res = requests.post(llm_url, json={
+            "model": "gpt-4o-mini",
+            "messages": [
+                {"role": "system", "content": "You are a Chief Inventory Officer."},
+                {"role": "user", "content": f"Question: {req.question}\nData: {json.dumps(data)}"}
+            ]
+        }).json()
+        return {"answer": res["choices"][0]["message"]["content"].strip(), "confidence": "high"}
+
+    return app
+
+
+def _serve(kind, port, env):
+    os.environ.update(env)
+    sys.stdout = open(os.devnull, "w")
+    import uvicorn
+    if kind == "sync":
+        app = _make_legacy_app()
+    else:
+        from main import app
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def start_service(kind, env):
+    port = free_port()
+    proc = multiprocessing.Process(target=_serve, args=(kind, port, env), daemon=True)
+    proc.start()
+    wait_for_port(port)
+    return proc, f"http://127.0.0.1:{port}"
+
+
+async def run_load(base_url, total, concurrency):
+    latencies = []
+    errors = 0
+    sem = asyncio.Semaphore(concurrency)
+    payload = {"shop_domain": "bench.myshopify.com", "access_token": "shpat_stub", "question": "top 5 products last 30 days"}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=120.0) as client:
+        await client.post(base_url + "/ask", json=payload)
+
+        async def one():
+            nonlocal errors
+            async with sem:
+                t0 = time.perf_counter()
+                try:
+                    r = await client.post(base_url + "/ask", json=payload)
+                    r.raise_for_status()
+                except httpx.HTTPError:
+                    errors += 1
+                    return
+                latencies.append(time.perf_counter() - t0)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        elapsed = time.perf_counter() - start
+    latencies = sorted(latencies) or [float("nan")]
+    return {
+        "errors": errors,
+        "rps": (total - errors) / elapsed,
+        "p50": statistics.median(latencies) * 1000,
+        "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--shopify-latency", type=float, default=0.05)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    stub, stub_url = start_stub_server(shopify_latency=args.shopify_latency, llm_latency=args.llm_latency)
+    print(f"{'path':<6} {'requests':>8} {'conc':>5} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>6}")
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = {**stub_env(stub_url), "GENERATED_QUERY_DB": os.path.join(tmp, "generated.db"),
+                   "ROLLUP_DB": os.path.join(tmp, "rollups.db")}
+            for kind in ("sync", "async"):
+                proc, url = start_service(kind, env)
+                try:
+                    r = asyncio.run(run_load(url, args.requests, args.concurrency))
+                finally:
+                    proc.terminate()
+                print(f"{kind:<6} {args.requests:>8} {args.concurrency:>5} {r['rps']:>8.1f} {r['p50']:>8.1f} "
+                      f"{r['p99']:>8.1f} {r['errors']:>6}")
+    finally:
+        stub.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""N single POST /ask calls vs one POST /ask/batch for the same questions.
+
+Draws a question list from the labelled corpus (with repeats, like a
+reporting job), then answers it three ways against stub upstreams: one
+/ask at a time (what the Rails controller does today), all /ask calls
+concurrently, and a single /ask/batch. Reports wall time and the Shopify
+and LLM calls each way made, plus the batch's own per-stage timing. The
+result cache is bypassed throughout so only batching is measured.
+
+    python benchmarks/bench_batch.py --questions 24 --repeats 6
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from bench_ask_load import start_service  # noqa: E402
+from stub_servers import start_stub_server, stub_env  # noqa: E402
+
+SHOP = {"shop_domain": "bench.myshopify.com", "access_token": "shpat_stub", "bypass_cache": True}
+
+
+def pick_questions(n, repeats, seed):
+    with open(os.path.join(HERE, "corpus", "questions.jsonl")) as f:
+        corpus = [json.loads(line)["question"] for line in f if line.strip()]
+    rng = random.Random(seed)
+    distinct = rng.sample(corpus, n - repeats)
+    questions = distinct + rng.choices(distinct, k=repeats)
+    rng.shuffle(questions)
+    return questions
+
+
+async def sequential(client, url, questions):
+    return [(await client.post(url + "/ask", json={**SHOP, "question": q})).json() for q in questions]
+
+
+async def concurrent(client, url, questions):
+    responses = await asyncio.gather(*(client.post(url + "/ask", json={**SHOP, "question": q}) for q in questions))
+    return [r.json() for r in responses]
+
+
+async def batched(client, url, questions):
+    body = (await client.post(url + "/ask/batch", json={**SHOP, "questions": questions})).json()
+    batched.last = body
+    return body["answers"]
+
+
+async def run(stub_url, url, questions):
+    rows = []
+    async with httpx.AsyncClient(timeout=300.0) as client:
+        for name, fn in (("sequential /ask", sequential), ("concurrent /ask", concurrent), ("/ask/batch", batched)):
+            await client.get(stub_url + "/_stats", params={"reset": True})
+            t0 = time.perf_counter()
+            answers = await fn(client, url, questions)
+            elapsed = (time.perf_counter() - t0) * 1000
+            calls = (await client.get(stub_url + "/_stats")).json()
+            assert len(answers) == len(questions)
+            rows.append((name, elapsed, calls["shopify"], calls["llm"]))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--questions", type=int, default=24)
+    parser.add_argument("--repeats", type=int, default=6, help="how many of the questions are repeats")
+    parser.add_argument("--shopify-latency", type=float, default=0.2)
+    parser.add_argument("--llm-latency", type=float, default=0.8)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    questions = pick_questions(args.questions, args.repeats, args.seed)
+    stub, stub_url = start_stub_server(shopify_latency=args.shopify_latency, llm_latency=args.llm_latency)
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {**stub_env(stub_url), "GENERATED_QUERY_DB": os.path.join(tmp, "generated.db"),
+               "ROLLUP_DB": os.path.join(tmp, "rollups.db")}
+        service, url = start_service("async", env)
+        try:
+            rows = asyncio.run(run(stub_url, url, questions))
+        finally:
+            service.terminate()
+            stub.terminate()
+
+    print(f"{len(questions)} questions ({len(set(questions))} distinct)")
+    print(f"{'mode':<18} {'wall ms':>9} {'shopify':>8} {'llm':>5}")
+    for name, elapsed, shopify, llm in rows:
+        print(f"{name:<18} {elapsed:>9.0f} {shopify:>8} {llm:>5}")
+    print("batch timing:", json.dumps(batched.last["timing"]))
+    print("batch stats: ", json.dumps(batched.last["stats"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""Bulk export of shop × report jobs through BulkExport vs one report at a time.
+
+Exports ``--shops`` shops × the INTENTS reports (1000 jobs by default)
+against the stub Shopify, with a fresh agent, result cache and rollup
+store per run:
+
+* "one at a time": one worker, one report per shop at once, i.e. the
+  same reports asked one after another
+* the worker pool at each ``--workers`` count
+
+Reports wall time, jobs/s, the service's CPU time per job, Shopify calls
+and the most queries any one shop had in flight. The stub and the export
+share the machine, so once both keep every core busy more workers stop
+helping.
+
+Checks, exiting non-zero on failure:
+
+* every job is written exactly once, and sampled records hold the same
+  rows as the report run directly against Shopify
+* no shop has more than ``--per-shop`` reports' queries in flight
+* a shop whose Shopify always fails gets failed jobs in the checkpoint and
+  nothing in the output, without holding up the other shops
+* an export cancelled halfway, with a torn line left at the end of its
+  output, resumes from the checkpoint: the finished jobs are skipped and
+  the output ends with every job exactly once
+
+    python benchmarks/bench_bulk_export.py --shops 250 --workers 16,64
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+from stub_servers import start_stub_server, stub_env  # noqa: E402
+
+TOKEN = "shpat_stub"
+INTENTS = ("total_sales_over_time", "total_sales_by_product", "top_product_variants_by_units_sold",
+           "orders_over_time")
+DOWN_SHOP = "down.example"
+# Queries one report can have in flight at once: a window's and the previous window's base pull
+QUERIES_PER_REPORT = 2
+
+
+def read_output(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+async def quiet(coro):
+    with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+        return await coro
+
+
+async def run(args, stub_url, tmp):
+    from agent import AnalyticsAgent
+    from bulk_export import BulkExport
+    failures = []
+    shops = [{"shop_domain": f"store-{i}.myshopify.com", "access_token": TOKEN} for i in range(args.shops)]
+    jobs = len(shops) * len(INTENTS)
+
+    def fresh_agent(label):
+        os.environ["ROLLUP_DB"] = os.path.join(tmp, f"rollups_{label}.db")
+        agent = AnalyticsAgent()
+        agent.shopify_scheduler.base_backoff = 0.01
+        return agent
+
+    async with httpx.AsyncClient() as control:
+        async def stats():
+            return (await control.get(stub_url + "/_stats", params={"reset": True})).json()
+
+        print(f"{jobs} jobs ({len(shops)} shops × {len(INTENTS)} reports), Shopify {args.shopify_latency * 1000:.0f} ms, "
+              f"per shop {args.per_shop}, {os.cpu_count()} CPU(s)")
+        print(f"{'run':<18} {'wall s':>7} {'jobs/s':>7} {'cpu ms/job':>11} {'failed':>7} {'shopify calls':>14} {'max per shop':>13}")
+        runs = [("one at a time", 1, 1)] + [(f"{w} workers", w, args.per_shop) for w in args.workers]
+        for label, workers, per_shop in runs:
+            agent = fresh_agent(label.replace(" ", "_"))
+            await agent.result_cache.clear()
+            path = os.path.join(tmp, label.replace(" ", "_") + ".ndjson")
+            export = BulkExport(agent, path, workers=workers, per_shop=per_shop)
+            await stats()
+            t0, cpu = time.perf_counter(), time.process_time()
+            status = await quiet(export.run(shops, INTENTS, resume=False))
+            wall, cpu = time.perf_counter() - t0, time.process_time() - cpu
+            s = await stats()
+            print(f"{label:<18} {wall:>7.2f} {jobs / wall:>7.1f} {cpu / jobs * 1000:>11.2f} {status['failed']:>7} {s['shopify']:>14} "
+                  f"{s['max_shop_in_flight']:>13}")
+            records = read_output(path)
+            keys = [(r["shop"], r["intent"]) for r in records]
+            if status["failed"] or len(keys) != jobs or len(set(keys)) != jobs:
+                failures.append(f"{label}: {len(set(keys))} distinct of {len(keys)} records for {jobs} jobs, "
+                                f"{status['failed']} failed")
+            if s["max_shop_in_flight"] > per_shop * QUERIES_PER_REPORT:
+                failures.append(f"{label}: {s['max_shop_in_flight']} queries in flight for one shop")
+
+        # Sampled records vs the same report run directly
+        for record in random.Random(0).sample(records, 12):
+            params = {"intent": record["intent"], "since": record["since"], "until": record["until"]}
+            query, _ = await quiet(agent.build_query(SimpleNamespace(question=""), params))
+            remote = (await quiet(agent.fetch_shopifyql(record["shop"], TOKEN, query)))[0]
+            table = remote["data"]["shopifyqlQuery"]["tableData"]
+            if record["query"] != query or record["rows"] != table["rows"]:
+                failures.append(f"{record['shop']} {record['intent']}: exported rows differ from Shopify's")
+
+        # A failing shop among healthy ones
+        agent = fresh_agent("down")
+        path = os.path.join(tmp, "down.ndjson")
+        mixed = [{"shop_domain": DOWN_SHOP, "access_token": TOKEN}] + shops[:20]
+        status = await quiet(BulkExport(agent, path, workers=8, per_shop=args.per_shop).run(mixed, INTENTS, resume=False))
+        with open(path + ".checkpoint", encoding="utf-8") as f:
+            failed = {e["intent"] for e in map(json.loads, f) if e.get("ok") is False and e["shop"] == DOWN_SHOP}
+        written = read_output(path)
+        print(f"failing shop: {status['failed']} failed, {status['done']} written")
+        if failed != set(INTENTS) or status["done"] != 20 * len(INTENTS) or any(r["shop"] == DOWN_SHOP for r in written):
+            failures.append(f"failing shop: {status}, failed intents {sorted(failed)}")
+
+        # Cancel halfway, tear the last line, resume
+        agent = fresh_agent("resume")
+        await agent.result_cache.clear()
+        path = os.path.join(tmp, "resume.ndjson")
+        export = BulkExport(agent, path, workers=args.workers[-1], per_shop=args.per_shop)
+        with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+            task = export.start(shops, INTENTS, resume=False)
+            while export.stats["done"] < jobs // 2:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        first = export.stats["done"]
+        with open(path, "a", encoding="utf-8") as f:
+            f.write('{"shop": "store-0.myshopify.com", "intent": "tot')
+        resumed = await quiet(BulkExport(agent, path, workers=args.workers[-1], per_shop=args.per_shop).run(shops, INTENTS))
+        keys = [(r["shop"], r["intent"]) for r in read_output(path)]
+        print(f"resume: cancelled after {first} jobs, resumed with {resumed['skipped']} skipped and "
+              f"{resumed['done']} run; output has {len(keys)} records")
+        if resumed["skipped"] != first or len(keys) != jobs or len(set(keys)) != jobs:
+            failures.append(f"resume: {first} done before, {resumed}, {len(keys)} records ({len(set(keys))} distinct)")
+
+    for f in failures[:20]:
+        print("FAIL", f)
+    print("all checks passed" if not failures else f"{len(failures)} check(s) failed")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shops", type=int, default=250)
+    parser.add_argument("--workers", type=lambda s: [int(w) for w in s.split(",")], default=[16, 64])
+    parser.add_argument("--per-shop", type=int, default=2)
+    parser.add_argument("--shopify-latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    stub, url = start_stub_server(shopify_latency=args.shopify_latency)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update({
+            **stub_env(url),
+            "WARMUP_INTERVAL": "0",
+            "SHOPIFY_BREAKER_FAILURES": "3",
+            "GENERATED_QUERY_DB": os.path.join(tmp, "generated.db")
+        })
+        try:
+            failures = asyncio.run(run(args, url, tmp))
+        finally:
+            stub.terminate()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Upstream calls behind a burst of identical questions, with and without coalescing.
+
+Sends N simultaneous identical questions through ``AnalyticsAgent.handle``
+(and ``handle_stream``) against the stub upstreams, once with the agent's
+per-stage single-flight and once with every stage calling upstream
+directly. Questions are ones the deterministic router cannot resolve, so
+each goes through the LLM parser; the "custom" one also needs ShopifyQL
+generation. Templated explanations are turned off, so every answer needs
+the LLM. Reports LLM parse / generate / explain calls, Shopify calls and
+wall time for both modes.
+
+With coalescing, every burst must make exactly one upstream call per stage
+and every caller must get the same answer (streamed answers must match
+the non-streamed one); the script exits non-zero otherwise.
+
+    python benchmarks/bench_coalesce.py --burst 50
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+from stub_servers import start_stub_server, stub_env  # noqa: E402
+
+TOKEN = "shpat_stub"
+STAGES = ("llm_parse", "llm_sql", "shopify", "llm_explain")
+SCENARIOS = (
+    # (name, question, streamed, expected calls per stage)
+    ("parsed question", "how did the store do lately", False, (1, 0, 1, 1)),
+    ("generated query", "give me a custom breakdown of discounts by channel", False, (1, 1, 1, 1)),
+    ("streamed, generated", "a custom view of gift card usage", True, (1, 1, 1, 1)),
+)
+
+
+class NoFlight:
+    """Stand-in for SingleFlight that runs every call."""
+
+    coalesced = 0
+
+    async def do(self, key, fn):
+        return await fn()
+
+    def stream(self, key, make):
+        return make()
+
+
+async def ask(agent, req, streamed):
+    if not streamed:
+        return (await agent.handle(req))["answer"]
+    answer = None
+    async for event, payload in agent.handle_stream(req):
+        if event == "done":
+            answer = payload["answer"]
+    return answer
+
+
+async def run(args, stub_url, tmp):
+    from agent import AnalyticsAgent
+    from cache import SingleFlight
+    from query_memory import GeneratedQueryCache
+    with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+        agent = AnalyticsAgent()
+    # Every answer is explained by the LLM, so explain coalescing is measured
+    agent.explain_templates = False
+    flights = agent._flights
+    results = {}
+    failures = []
+
+    async with httpx.AsyncClient() as control:
+        for mode in ("direct", "coalesced"):
+            if mode == "direct":
+                agent._flights = {name: NoFlight() for name in flights}
+                agent.result_cache._flights = NoFlight()
+            else:
+                agent._flights = flights
+                agent.result_cache._flights = SingleFlight()
+            for name, question, streamed, expected in SCENARIOS:
+                # Fresh shop and query memory so nothing is answered from an earlier run
+                agent.generated_queries = GeneratedQueryCache(os.path.join(tmp, f"{mode}-{name}.db"))
+                await agent.result_cache.clear()
+                await agent.explanation_cache.clear()
+                req = SimpleNamespace(shop_domain=f"{mode}.myshopify.com", access_token=TOKEN, question=question)
+                await control.get(stub_url + "/_stats", params={"reset": True})
+                t0 = time.perf_counter()
+                with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+                    answers = await asyncio.gather(*(ask(agent, req, streamed) for _ in range(args.burst)))
+                elapsed = time.perf_counter() - t0
+                calls = (await control.get(stub_url + "/_stats")).json()
+                results[mode, name] = (tuple(calls[s] for s in STAGES), elapsed)
+
+                if mode == "coalesced":
+                    got = results[mode, name][0]
+                    if got != expected:
+                        failures.append(f"{name}: upstream calls {dict(zip(STAGES, got))}, expected {dict(zip(STAGES, expected))}")
+                    if len(set(answers)) != 1 or not answers[0]:
+                        failures.append(f"{name}: callers got {len(set(answers))} different answers")
+                    if streamed:
+                        req.shop_domain = "check.myshopify.com"
+                        with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+                            plain = await ask(agent, req, False)
+                        if plain != answers[0]:
+                            failures.append(f"{name}: streamed answer differs from the non-streamed one")
+    return results, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--burst", type=int, default=50)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--shopify-latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    stub, url = start_stub_server(shopify_latency=args.shopify_latency, llm_latency=args.llm_latency)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update({
+            **stub_env(url),
+            "ROLLUP_DB": os.path.join(tmp, "rollups.db"),
+            "GENERATED_QUERY_DB": os.path.join(tmp, "generated.db"),
+            "WARMUP_INTERVAL": "0"
+        })
+        try:
+            results, failures = asyncio.run(run(args, url, tmp))
+        finally:
+            stub.terminate()
+
+    print(f"burst of {args.burst} identical questions; upstream calls as parse/generate/shopify/explain")
+    print(f"{'scenario':<22} {'direct calls':>17} {'direct s':>9} {'coalesced calls':>16} {'coalesced s':>12}")
+    for name, _, _, _ in SCENARIOS:
+        (dc, ds), (cc, cs) = results["direct", name], results["coalesced", name]
+        print(f"{name:<22} {'/'.join(map(str, dc)):>17} {ds:>9.2f} {'/'.join(map(str, cc)):>16} {cs:>12.2f}")
+    for f in failures:
+        print("FAIL", f)
+    print("all checks passed" if not failures else f"{len(failures)} check(s) failed")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""Cold-start cost of the service: import time, time to ready and first-request latency.
+
+Every measurement uses a fresh interpreter:
+
+* ``import main`` alone, and followed by the modules the agent loads lazily
+  (``PRELOAD_MODULES``: what importing the service cost when they were
+  imported at module load), median of ``--repeat`` runs
+* ``uvicorn main:app`` started with each ``PRELOAD`` mode (``off``,
+  ``background``, ``blocking``) against the stub upstreams: time from
+  process start to the first answer on ``/ready`` and to it answering 200,
+  then (traffic gated on readiness, like a load balancer would) the latency
+  of the first and second ``/ask`` for a predefined report and for the
+  reorder forecast (the NumPy-heavy path)
+
+Checks that importing the service loads none of ``PRELOAD_MODULES``, that
+``/ready`` turns 200 in every mode, that a ``/metrics`` scrape before the
+first request opens no SQLite store (with ``PRELOAD=off``) and lists each
+metric once, and that every answer is a real one; exits non-zero otherwise.
+
+    python benchmarks/bench_cold_start.py --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+
+from stub_servers import free_port, start_stub_server, stub_env  # noqa: E402
+
+QUESTIONS = (("sales", "How are my sales doing?"), ("reorder", "What should I reorder?"))
+ERROR_PREFIXES = ("Error:", "Shopify API Error:", "Query Error:")
+
+IMPORT_SNIPPET = """
+import json, sys, time
+t = time.perf_counter()
+import main
+imported = time.perf_counter() - t
+from agent import PRELOAD_MODULES
+loaded = [m for m in PRELOAD_MODULES if m in sys.modules]
+for name in PRELOAD_MODULES:
+    __import__(name)
+print(json.dumps({"import": imported, "eager": time.perf_counter() - t, "loaded": loaded}))
+"""
+
+
+def import_times(env, repeat):
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], cwd=SERVICE_DIR, env=env,
+                             capture_output=True, text=True, check=True)
+        runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return (statistics.median(r["import"] for r in runs), statistics.median(r["eager"] for r in runs),
+            sorted({m for r in runs for m in r["loaded"]}))
+
+
+def http(method, url, body=None, timeout=60.0):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, method=method, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as r:
+            return r.status, json.loads(r.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b"null")
+
+
+def cold_start(mode, env, timeout=30.0):
+    """Start the service with PRELOAD=mode, wait for /ready like a readiness
+    probe, then ask QUESTIONS twice each. Returns timings and answers."""
+    port = free_port()
+    tmp = tempfile.mkdtemp(prefix="bench_cold_")
+    env = dict(env, PRELOAD=mode, WARMUP_INTERVAL="0",
+               GENERATED_QUERY_DB=os.path.join(tmp, "generated.db"), ROLLUP_DB=os.path.join(tmp, "rollups.db"))
+    base = f"http://127.0.0.1:{port}"
+    t0 = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+                            cwd=SERVICE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    out = {"mode": mode, "answers": [], "ready": None}
+    try:
+        while out["ready"] is None:
+            if proc.poll() is not None or time.perf_counter() - t0 > timeout:
+                return out
+            try:
+                status, _ = http("GET", base + "/ready", timeout=1.0)
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.005)
+                continue
+            out.setdefault("port", time.perf_counter() - t0)
+            if status == 200:
+                out["ready"] = time.perf_counter() - t0
+            else:
+                time.sleep(0.005)
+
+        # A scrape before any request must not open the SQLite stores
+        with urllib.request.urlopen(base + "/metrics", timeout=10.0) as r:
+            out["metrics"] = r.read().decode()
+        out["opened"] = [name for name in ("generated.db", "rollups.db") if os.path.exists(os.path.join(tmp, name))]
+
+        for name, question in QUESTIONS:
+            for attempt in ("1st", "2nd"):
+                payload = {"shop_domain": "bench.myshopify.com", "access_token": "shpat_stub", "question": question,
+                           "bypass_cache": True}
+                t = time.perf_counter()
+                status, body = http("POST", base + "/ask", payload)
+                out[f"{name} {attempt}"] = time.perf_counter() - t
+                out["answers"].append((question, status, (body or {}).get("answer", "")))
+    finally:
+        proc.terminate()
+        proc.wait()
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--shopify-latency", type=float, default=0.05)
+    parser.add_argument("--llm-latency", type=float, default=0.1)
+    args = parser.parse_args()
+
+    failures = []
+    stub, stub_url = start_stub_server(shopify_latency=args.shopify_latency, llm_latency=args.llm_latency)
+    env = dict(os.environ, **stub_env(stub_url))
+    try:
+        imported, eager, loaded = import_times(env, args.repeat)
+        if loaded:
+            failures.append(f"importing the service loads {', '.join(loaded)}")
+        print(f"import main                 {imported * 1000:>7.0f} ms")
+        print(f"  + PRELOAD_MODULES         {eager * 1000:>7.0f} ms  (importing everything at load)")
+        print()
+        columns = ["port", "ready"] + [f"{name} {attempt}" for name, _ in QUESTIONS for attempt in ("1st", "2nd")]
+        print(f"{'PRELOAD':<11}" + "".join(f"{c + ' ms':>15}" for c in columns))
+        for mode in ("off", "background", "blocking"):
+            runs = [cold_start(mode, env) for _ in range(args.repeat)]
+            if any(run["ready"] is None for run in runs):
+                failures.append(f"PRELOAD={mode}: /ready never answered 200")
+                continue
+            for run in runs:
+                if mode == "off" and run["opened"]:
+                    failures.append(f"PRELOAD=off: a /metrics scrape opened {', '.join(run['opened'])}")
+                helps = [line.split()[2] for line in run["metrics"].splitlines() if line.startswith("# HELP")]
+                if len(helps) != len(set(helps)):
+                    failures.append(f"PRELOAD={mode}: /metrics repeats {sorted({h for h in helps if helps.count(h) > 1})}")
+                for question, status, answer in run["answers"]:
+                    if status != 200 or not answer or answer.startswith(ERROR_PREFIXES):
+                        failures.append(f"PRELOAD={mode}: {question!r} -> HTTP {status} {answer[:100]}")
+            row = {c: statistics.median(r[c] for r in runs) for c in columns}
+            print(f"{mode:<11}" + "".join(f"{row[c] * 1000:>15.0f}" for c in columns))
+    finally:
+        stub.terminate()
+
+    for f in failures[:10]:
+        print("FAIL", f)
+    print("all checks passed" if not failures else f"{len(failures)} check(s) failed")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
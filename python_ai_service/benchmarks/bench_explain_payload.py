@@ -0,0 +1,107 @@
+"""Prompt size and explain() latency: raw JSON payload vs the compact digest.
+
+For synthetic shopifyqlQuery results of growing size, compares the legacy
+prompt (``json.dumps`` of the whole response) against ``summarize_result``:
+prompt bytes, estimated tokens, local build time, and end-to-end explain
+latency against a stub LLM whose latency grows with prompt size. The
+explanation cache is off (``EXPLAIN_CACHE_TTL=0``), so every repeat of the
+digest explain is an LLM round trip rather than a cache hit. Exits
+non-zero if a digest of a table holding NaN or infinite ratios fails.
+
+    python benchmarks/bench_explain_payload.py --rows 100 1000 10000
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+from stub_servers import start_stub_server, stub_env, synthetic_table  # noqa: E402
+
+REPORTS = ("total_sales_over_time", "total_sales_by_product")
+
+
+def timed(fn, repeat=5):
+    samples = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        out = fn()
+        samples.append(time.perf_counter() - t)
+    return out, statistics.median(samples) * 1000
+
+
+async def explain_latency(agent, chat_completion, data, question, repeat):
+    raw_ms, digest_ms = [], []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        await chat_completion([
+            agent._explain_messages(data, question)[0],
+            {"role": "user", "content": f"Question: {question}\nData: {json.dumps(data)}"}
+        ])
+        raw_ms.append(time.perf_counter() - t)
+        t = time.perf_counter()
+        await agent.explain(data, question)
+        digest_ms.append(time.perf_counter() - t)
+    return statistics.median(raw_ms) * 1000, statistics.median(digest_ms) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--budget", type=int, default=1500)
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--llm-latency-per-kb", type=float, default=0.01)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    stub, url = start_stub_server(llm_latency=args.llm_latency, llm_latency_per_kb=args.llm_latency_per_kb)
+    os.environ.update(stub_env(url))
+    os.environ["EXPLAIN_TOKEN_BUDGET"] = str(args.budget)
+    os.environ["EXPLAIN_CACHE_TTL"] = "0"
+    from agent import AnalyticsAgent
+    from clients import chat_completion, close_http_client
+    from digest import estimate_tokens, summarize_result
+    agent = AnalyticsAgent()
+
+    # A ratio over a zero base comes back as NaN or infinity
+    data = {"data": {"shopifyqlQuery": {"tableData": {
+        "columns": [{"name": "day", "dataType": "DAY"}, {"name": "returned_quantity_rate", "dataType": "PERCENT"}],
+        "rows": [["2025-01-01", "0.1"], ["2025-01-02", "Infinity"], ["2025-01-03", "NaN"]]
+    }}}}
+    try:
+        print(f"digest with NaN / inf: {summarize_result(data, 'return rate').splitlines()[1]}")
+    except (ValueError, OverflowError) as e:
+        stub.terminate()
+        sys.exit(f"digest with NaN / inf failed: {e!r}")
+
+    print(f"{'report':<24} {'rows':>6} {'raw KB':>8} {'raw tok':>8} {'raw ms':>7} "
+          f"{'dig KB':>7} {'dig tok':>8} {'dig ms':>7} {'explain raw':>12} {'explain dig':>12}")
+
+    async def run():
+        for report in REPORTS:
+            query = AnalyticsAgent.PREDEFINED_QUERIES[report]
+            for n in args.rows:
+                data = synthetic_table(query, n)
+                question = "How are my total sales doing?"
+                raw, raw_ms = timed(lambda: json.dumps(data))
+                dig, dig_ms = timed(lambda: summarize_result(data, question, args.budget))
+                e_raw, e_dig = await explain_latency(agent, chat_completion, data, question, args.repeat)
+                print(f"{report:<24} {n:>6} {len(raw) / 1024:>8.1f} {estimate_tokens(raw):>8} {raw_ms:>7.2f} "
+                      f"{len(dig) / 1024:>7.1f} {estimate_tokens(dig):>8} {dig_ms:>7.2f} "
+                      f"{e_raw:>10.0f}ms {e_dig:>10.0f}ms")
+        await close_http_client()
+
+    try:
+        asyncio.run(run())
+    finally:
+        stub.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""Explanations from local templates and the explanation cache vs the LLM for every answer.
+
+Replays the question corpus through ``AnalyticsAgent.handle`` against the
+stub upstreams twice over (a first pass, then the same questions again),
+once with templates and the explanation cache disabled (every answer is
+an LLM call, the old behaviour) and once with both on. Reports per pass:
+answers by source (template, cache, LLM), LLM explain calls, the share of
+answers served without an LLM call, and mean / p50 / p90 latency per
+question, plus the mean latency saved.
+
+Checks, exiting non-zero on failure:
+
+* templated answers state the figures of the data they explain: the
+  period total (or average) and the previous-period figure for daily
+  series, the leading rows and their values for top-N reports, as many
+  rows as a "top 10" question asks for
+* stock-level questions on the inventory report go to the LLM rather than
+  a ranking by units sold per day
+* open-ended questions ("why ...", "what should I ...") still go to the LLM
+* an LLM explanation is reused for the same digest and question, from the
+  explanation cache rather than the Shopify result cache
+* no answer is an error, and fewer LLM explain calls are made with
+  templates and the cache than without
+
+    python benchmarks/bench_explain_templates.py --concurrency 16
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import re
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+from bench_replay import load_corpus, percentile  # noqa: E402
+from stub_servers import daily_series, grouped_sales, start_stub_server, stub_env  # noqa: E402
+
+SHOP = "explain.myshopify.com"
+TOKEN = "shpat_stub"
+SOURCES = ("template", "cache", "llm")
+ERROR_PREFIXES = ("Error:", "Shopify API Error:", "Query Error:")
+OPEN_ENDED = ("Why did my sales drop this month?", "What should I do about my returns?")
+
+
+def check_templates(failures):
+    """Templated answers for every covered report carry the data's figures."""
+    from agent import AnalyticsAgent
+    from narrative import _fmt_value, label, templated_answer
+    from table import ColumnarTable
+
+    covered = 0
+    for intent, template in AnalyticsAgent.TEMPLATES.items():
+        query = template.bind("startOfDay(-30d)", "today").render()
+        data = grouped_sales(SHOP, query) or (daily_series(SHOP, query) or (None,))[0]
+        if data is None:
+            continue
+        answer = templated_answer(data, "show me the numbers", template)
+        if answer is None:
+            failures.append(f"{intent}: no templated answer")
+            continue
+        covered += 1
+        table = ColumnarTable.from_shopifyql(data)
+        measure = template.visualize.split(" ")[0]
+        if template.timeseries:
+            expected = _series_figures(table, measure)
+        else:
+            values, percent = _values(table, measure)
+            top = values.argmax()
+            expected = [str(table[template.group_by[0]][top]), _fmt_value(measure, values[top], percent)]
+        missing = [e for e in expected if e not in answer]
+        if missing:
+            failures.append(f"{intent}: templated answer lacks {missing}: {answer!r}")
+
+    # A question naming another measure of the report gets that measure's
+    # figures; one naming a measure the report lacks goes to the LLM
+    template = AnalyticsAgent.TEMPLATES["total_sales_over_time"]
+    data = daily_series(SHOP, template.bind("startOfDay(-30d)", "today").render())[0]
+    table = ColumnarTable.from_shopifyql(data)
+    for question, measure in (("What were my net sales last week?", "net_sales"),
+                              ("How much tax did I collect", "taxes"),
+                              ("How much were my sales?", "total_sales")):
+        answer = templated_answer(data, question, template) or ""
+        missing = [e for e in _series_figures(table, measure) if e not in answer]
+        if missing or not answer.lower().startswith(label(measure)):
+            failures.append(f"{question!r}: answer lacks {measure} figures {missing}: {answer!r}")
+    for question, intent in (("How much tax did I collect on my top products", "total_sales_by_product"),
+                             ("What were my net sales and taxes", "total_sales_over_time")):
+        template = AnalyticsAgent.TEMPLATES[intent]
+        query = template.bind("startOfDay(-30d)", "today").render()
+        data = grouped_sales(SHOP, query) or daily_series(SHOP, query)[0]
+        answer = templated_answer(data, question, template)
+        if answer is not None:
+            failures.append(f"{question!r}: templated answer instead of the LLM: {answer!r}")
+
+    # A top-N question lists as many rows as it asked for
+    template = AnalyticsAgent.TEMPLATES["total_sales_by_product"]
+    data = grouped_sales(SHOP, template.bind("startOfDay(-30d)", "today", 10).render())
+    table = ColumnarTable.from_shopifyql(data)
+    answer = templated_answer(data, "top 10 products last month", template, 10) or ""
+    listed = [line for line in answer.splitlines() if re.match(r"\d+\. ", line)]
+    if len(listed) != min(10, len(table)) or "The top 5" in answer:
+        failures.append(f"top 10 of {len(table)} rows lists {len(listed)}: {answer!r}")
+
+    # Stock questions are about what is on hand, not how fast it sells
+    template = AnalyticsAgent.TEMPLATES["inventory_sold_daily_by_product"]
+    data = {"data": {"shopifyqlQuery": {"tableData": {
+        "columns": [{"name": d, "dataType": "STRING"} for d in template.group_by] +
+                   [{"name": m, "dataType": "NUMBER"} for m in ("inventory_units_sold", "ending_inventory_units",
+                                                                "inventory_units_sold_per_day")],
+        "rows": [[f"Product {i}", "Default", f"SKU-{i}", 30 - i, i * 4, (30 - i) / 30] for i in range(8)]
+    }}}}
+    for question in ("what is out of stock", "which products are running low on stock",
+                     "how many units do i have on hand", "check my inventory"):
+        answer = templated_answer(data, question, template)
+        if answer is not None:
+            failures.append(f"{question!r}: templated sales-speed answer instead of the LLM: {answer!r}")
+    if templated_answer(data, "which products sell fastest", template) is None:
+        failures.append("a sales-speed question on the inventory report was not templated")
+
+    # A small rate declared PERCENT reads as such, not scaled by its magnitude
+    template = AnalyticsAgent.TEMPLATES["return_rate_over_time"]
+    rate = template.visualize.split(" ")[0]
+    data = {"data": {"shopifyqlQuery": {"tableData": {
+        "columns": [{"name": "day", "dataType": "DAY"}, {"name": rate, "dataType": "PERCENT"}],
+        "rows": [["2025-01-01", 0.004], ["2025-01-02", 0.004]]
+    }}}}
+    answer = templated_answer(data, "what was my return rate", template) or ""
+    if "0.4%" not in answer:
+        failures.append(f"a 0.4% return rate reads as {answer!r}")
+    return covered
+
+
+def _values(table, measure):
+    from narrative import _percent_values
+    percent = table.types.get(measure) == "PERCENT" or "rate" in measure
+    return (_percent_values(table, measure) if percent else table.numeric(measure)), percent
+
+
+def _series_figures(table, measure):
+    """The period total (or average) and the previous period's, as a daily series answer states them."""
+    from narrative import _fmt_value
+    values, percent = _values(table, measure)
+    averaged = percent or "average" in measure or "per_order" in measure
+    figures = [_fmt_value(measure, values.mean() if averaged else values.sum(), percent)]
+    if f"{measure}__previous_period" in table:
+        before, _ = _values(table, f"{measure}__previous_period")
+        figures.append(_fmt_value(measure, before.mean() if averaged else before.sum(), percent))
+    return figures
+
+
+async def replay(agent, questions, concurrency):
+    from metrics import EXPLAIN_ANSWERS
+    sem = asyncio.Semaphore(concurrency)
+    latencies, errors = [], []
+
+    async def ask(question):
+        req = SimpleNamespace(shop_domain=SHOP, access_token=TOKEN, question=question)
+        async with sem:
+            t0 = time.perf_counter()
+            result = await agent.handle(req)
+            latencies.append(time.perf_counter() - t0)
+        if result["answer"].startswith(ERROR_PREFIXES):
+            errors.append(f"{question!r}: {result['answer'][:100]}")
+
+    before = {s: EXPLAIN_ANSWERS.value(source=s) for s in SOURCES}
+    with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+        await asyncio.gather(*(ask(q) for q in questions))
+    sources = {s: EXPLAIN_ANSWERS.value(source=s) - before[s] for s in SOURCES}
+    return sorted(latencies), errors, sources
+
+
+async def run(args, stub_url, tmp):
+    from agent import AnalyticsAgent
+    failures = []
+    questions = list(dict.fromkeys(load_corpus(args.corpus)))
+    covered = check_templates(failures)
+    print(f"templates: {covered} predefined reports answered with the data's figures")
+
+    results = {}
+    async with httpx.AsyncClient() as control:
+        async def explain_calls():
+            return (await control.get(stub_url + "/_stats", params={"reset": True})).json()["llm_explain"]
+
+        for mode in ("LLM only", "templates + cache"):
+            os.environ["ROLLUP_DB"] = os.path.join(tmp, f"rollups_{len(results)}.db")
+            os.environ["GENERATED_QUERY_DB"] = os.path.join(tmp, f"generated_{len(results)}.db")
+            agent = AnalyticsAgent()
+            agent.explain_templates = mode != "LLM only"
+            agent.EXPLAIN_CACHE_TTL = 0 if mode == "LLM only" else 86400
+            await agent.result_cache.clear()
+            for label in ("first pass", "repeat"):
+                await explain_calls()
+                latencies, errors, sources = await replay(agent, questions, args.concurrency)
+                results[(mode, label)] = (latencies, sources, await explain_calls())
+                failures += [f"{mode}, {label}: {e}" for e in errors[:5]]
+
+            if mode != "LLM only":
+                # Open-ended questions need the LLM; a repeat reuses its explanation
+                for question in OPEN_ENDED:
+                    for attempt in ("first", "repeat"):
+                        await explain_calls()
+                        with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+                            await agent.handle(SimpleNamespace(shop_domain=SHOP, access_token=TOKEN, question=question))
+                        calls = await explain_calls()
+                        if attempt == "first" and calls != 1:
+                            failures.append(f"{question!r}: {calls} LLM explain calls, expected 1")
+                        if attempt == "repeat" and calls:
+                            failures.append(f"{question!r} repeated: {calls} LLM explain calls, expected the cached explanation")
+                # Explanations live in their own cache, not among Shopify results
+                from agent import EXPLANATIONS
+                mixed = sum(1 for shop, _ in agent.result_cache._entries if shop == EXPLANATIONS)
+                if mixed or not agent.explanation_cache.stats()["entries"]:
+                    failures.append(f"{mixed} explanations in the result cache, "
+                                    f"{agent.explanation_cache.stats()['entries']} in the explanation cache")
+
+    print(f"{len(questions)} distinct corpus questions, concurrency {args.concurrency}, LLM {args.llm_latency * 1000:.0f} ms")
+    print(f"{'mode':<20} {'pass':<11} {'template':>9} {'cache':>6} {'llm':>5} {'llm calls':>10} {'no LLM':>7} "
+          f"{'mean ms':>8} {'p50 ms':>7} {'p90 ms':>7}")
+    for (mode, label), (lat, sources, calls) in results.items():
+        explained = sum(sources.values()) or 1
+        print(f"{mode:<20} {label:<11} {sources['template']:>9.0f} {sources['cache']:>6.0f} {sources['llm']:>5.0f} "
+              f"{calls:>10} {(sources['template'] + sources['cache']) / explained:>7.0%} "
+              f"{sum(lat) / len(lat) * 1000:>8.1f} {percentile(lat, 0.5) * 1000:>7.1f} {percentile(lat, 0.9) * 1000:>7.1f}")
+    for label in ("first pass", "repeat"):
+        base, new = results[("LLM only", label)], results[("templates + cache", label)]
+        saved = (sum(base[0]) / len(base[0]) - sum(new[0]) / len(new[0])) * 1000
+        print(f"mean latency saved, {label}: {saved:.1f} ms per question")
+        if new[2] >= base[2]:
+            failures.append(f"{label}: {new[2]} LLM explain calls with templates and cache, {base[2]} without")
+
+    for f in failures[:20]:
+        print("FAIL", f)
+    print("all checks passed" if not failures else f"{len(failures)} check(s) failed")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", default=os.path.join(HERE, "corpus", "questions.jsonl"))
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--shopify-latency", type=float, default=0.05)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    stub, url = start_stub_server(shopify_latency=args.shopify_latency, llm_latency=args.llm_latency)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update({**stub_env(url), "WARMUP_INTERVAL": "0"})
+        try:
+            failures = asyncio.run(run(args, url, tmp))
+        finally:
+            stub.terminate()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
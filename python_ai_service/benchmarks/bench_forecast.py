@@ -0,0 +1,182 @@
+"""Reorder forecast at catalogue scale: 100k SKUs x 90 days of daily sales.
+
+Generates intermittent daily demand per SKU (lognormal base rates, a
+trend, a weekday pattern, Poisson noise) for 90 history days plus a 30-day
+holdout, and measures:
+
+* folding the history rows (one per SKU-day with sales, in Shopify-sized
+  batches) into the SKU x day matrix with ``GroupedDaily``
+* ``ReorderForecaster.forecast`` over every SKU at once, with its peak
+  memory, against the same algorithm run SKU by SKU in plain Python on a
+  sample (extrapolated to the full catalogue)
+* accuracy of the 30-day demand on the holdout (WAPE and bias) for the
+  forecast vs the flat ``sold_30d / 30`` rate it replaced
+
+Checks that the folded matrix equals the generated one and that the
+vectorized forecast matches the per-SKU reference on the sample; exits
+non-zero otherwise.
+
+    python benchmarks/bench_forecast.py --skus 100000 --days 90
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from forecast import ReorderForecaster, history_start  # noqa: E402
+from table import GroupedDaily, align  # noqa: E402
+
+HOLDOUT = 30
+
+
+def make_demand(skus, days, seed):
+    """(n, days + HOLDOUT) daily units with trend, weekday pattern and intermittency."""
+    rng = np.random.default_rng(seed)
+    total = days + HOLDOUT
+    base = rng.lognormal(mean=0.0, sigma=1.2, size=(skus, 1))
+    trend = 1.0 + rng.normal(0.0, 0.004, size=(skus, 1)) * np.arange(total)
+    week = 1.0 + 0.35 * np.sin(2 * np.pi * (np.arange(total) + rng.integers(0, 7, size=(skus, 1))) / 7)
+    return rng.poisson(np.clip(base * trend * week, 0.0, None)).astype(np.float32)
+
+
+def fold_rows(sales, start, batch_rows):
+    """Feed the history to GroupedDaily as (sku, day, units, title) row batches."""
+    n, days = sales.shape
+    keys = np.array([f"SKU-{i:06d}" for i in range(n)], dtype=object)
+    titles = np.array([f"Product {i}" for i in range(n)], dtype=object)
+    day_names = np.array([(start + timedelta(days=j)).isoformat() for j in range(days)], dtype=object)
+    sku_idx, day_idx = np.nonzero(sales)
+    grouped = GroupedDaily(start, days)
+    elapsed = 0.0
+    for lo in range(0, len(sku_idx), batch_rows):
+        s, d = sku_idx[lo:lo + batch_rows], day_idx[lo:lo + batch_rows]
+        batch = (keys[s].astype(str), day_names[d], sales[s, d].astype(np.float64), titles[s])
+        t = time.perf_counter()
+        grouped.add(*batch)
+        elapsed += time.perf_counter() - t
+    t = time.perf_counter()
+    result = grouped.result()
+    return result, elapsed + time.perf_counter() - t, len(sku_idx)
+
+
+def reference(series, start, on_hand, lead, forecaster):
+    """The forecast for one SKU, in plain Python."""
+    days = len(series)
+    weekday = [(start.weekday() + t) % 7 for t in range(days)]
+    factors = [1.0] * 7
+    if days >= 28:
+        sums, counts = [0.0] * 7, [0] * 7
+        for t, v in enumerate(series):
+            sums[weekday[t]] += v
+            counts[weekday[t]] += 1
+        mean = sum(series) / days
+        factors = [(sums[d] + 7.0) / (mean * counts[d] + 7.0) for d in range(7)]
+        norm = sum(factors) / 7
+        factors = [f / norm for f in factors]
+    values = [v / factors[weekday[t]] for t, v in enumerate(series)]
+    a, b, phi = forecaster.alpha, forecaster.beta, forecaster.phi
+    level, trend, sq = sum(values[:7]) / min(7, days), 0.0, 0.0
+    for t, v in enumerate(values):
+        predicted = level + phi * trend
+        err = v - predicted
+        if t >= 7:
+            sq += err * err
+        level = predicted + a * err
+        trend = phi * trend + a * b * err
+    sigma = (sq / max(1, days - 7)) ** 0.5
+
+    def demand(h):
+        total, damp = 0.0, 0.0
+        for k in range(1, h + 1):
+            damp += phi ** k
+            total += (level + damp * trend) * factors[(start.weekday() + days + k - 1) % 7]
+        return max(0.0, total)
+
+    safety = forecaster.z * sigma * lead ** 0.5
+    return {
+        "demand": {h: demand(h) for h in forecaster.horizons},
+        "reorder": {h: max(0.0, demand(lead + h) + safety - on_hand) for h in forecaster.horizons},
+        "safety_stock": safety
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--skus", type=int, default=100000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--sample", type=int, default=300, help="SKUs checked against the per-SKU reference")
+    parser.add_argument("--batch-rows", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    failures = []
+    start = history_start(args.days, today=date.today())
+    demand = make_demand(args.skus, args.days, seed=args.skus)
+    history, holdout = demand[:, :args.days], demand[:, args.days:]
+    rng = np.random.default_rng(1)
+    on_hand = rng.integers(0, 200, size=args.skus).astype(np.float64)
+
+    (sold_keys, sold, _), fold_s, rows = fold_rows(history, start, args.batch_rows)
+    # Joined with inventory like the agent does; SKUs with no sales get zero rows
+    all_keys = np.array([f"SKU-{i:06d}" for i in range(args.skus)])
+    skus, matrix, on_hand = align(sold_keys, sold, all_keys, on_hand)
+    if not np.array_equal(matrix, history):
+        failures.append("folded matrix differs from the generated daily sales")
+
+    forecaster = ReorderForecaster()
+    samples = []
+    for _ in range(args.repeat):
+        t = time.perf_counter()
+        plan = forecaster.forecast(skus, matrix, on_hand, start)
+        samples.append(time.perf_counter() - t)
+    vector_s = statistics.median(samples)
+    tracemalloc.start()
+    forecaster.forecast(skus, matrix, on_hand, start)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    sample = np.linspace(0, args.skus - 1, min(args.sample, args.skus)).astype(int)
+    t = time.perf_counter()
+    expected = [reference(history[i].astype(float).tolist(), start, on_hand[i], forecaster.lead_time, forecaster) for i in sample]
+    loop_s = (time.perf_counter() - t) / len(sample) * args.skus
+    for i, ref in zip(sample, expected):
+        got = [plan["demand"][h][i] for h in forecaster.horizons] + [plan["reorder"][h][i] for h in forecaster.horizons]
+        want = [ref["demand"][h] for h in forecaster.horizons] + [ref["reorder"][h] for h in forecaster.horizons]
+        if not np.allclose(got + [plan["safety_stock"][i]], want + [ref["safety_stock"]], rtol=1e-6, atol=1e-6):
+            failures.append(f"{skus[i]}: vectorized forecast differs from the per-SKU reference")
+            break
+
+    actual = holdout.sum(axis=1)
+    flat = history[:, -30:].sum(axis=1) / 30 * 30
+    smoothed = plan["demand"][30]
+
+    def wape(pred):
+        return np.abs(pred - actual).sum() / actual.sum() * 100
+
+    def bias(pred):
+        return (pred - actual).sum() / actual.sum() * 100
+
+    print(f"{args.skus} SKUs x {args.days} days, {rows} sales rows, horizons {forecaster.horizons}, "
+          f"lead time {forecaster.lead_time}d, service level {forecaster.service_level:.0%}")
+    print(f"fold rows into matrix    {fold_s * 1000:>9.0f} ms  ({rows / fold_s / 1e6:.1f}M rows/s)")
+    print(f"forecast, vectorized     {vector_s * 1000:>9.0f} ms  (peak {peak / 2**20:.0f} MB)")
+    print(f"forecast, per-SKU loop   {loop_s * 1000:>9.0f} ms  (extrapolated from {len(sample)} SKUs, {loop_s / vector_s:.0f}x slower)")
+    print(f"30-day holdout           {'WAPE':>8} {'bias':>8}")
+    print(f"  flat 30-day rate       {wape(flat):>7.1f}% {bias(flat):>+7.1f}%")
+    print(f"  forecast               {wape(smoothed):>7.1f}% {bias(smoothed):>+7.1f}%")
+    for f in failures:
+        print("FAIL", f)
+    print("all checks passed" if not failures else f"{len(failures)} check(s) failed")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
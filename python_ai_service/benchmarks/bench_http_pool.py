@@ -0,0 +1,247 @@
+"""Pooled upstream connections vs a new TLS connection per call, plus timeouts and circuit breakers.
+
+Runs against the stubs served over HTTPS with a throwaway self-signed
+certificate (needs the ``openssl`` CLI) and gzip enabled. For each mode,
+"new connection per call" (``HTTP_KEEPALIVE=0``: every request opens and
+closes its own connection, like a bare ``requests.post``) and "pooled"
+(the default clients):
+
+* repeated Shopify queries for one shop, sequentially
+* the same queries spread over several shops, concurrently
+* repeated chat completions through the LLM client
+
+Reports the TCP+TLS handshakes the stub saw, mean / p50 / p90 latency per
+call, and Shopify bytes on the wire vs decoded.
+
+Then, with a short read timeout and a low breaker threshold, a shop that
+never answers in time and a shop that always fails with 503: how long the
+first query takes to give up, and how long queries take once the shop's
+circuit is open.
+
+Checks, exiting non-zero on failure:
+
+* pooled calls reuse connections: at most one handshake per shop (and
+  one for the LLM), against one per call without keep-alive
+* Shopify responses arrive gzip-compressed
+* a hanging shop's query ends within its timeouts instead of hanging, and
+  once the circuit is open queries fail fast without reaching Shopify,
+  while another shop's queries keep succeeding
+* after the cooldown a single probe is sent; the circuit closes again
+  when the probe succeeds
+
+    python benchmarks/bench_http_pool.py --queries 100
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+from bench_replay import percentile  # noqa: E402
+from stub_servers import make_tls_cert, start_stub_server, stub_env  # noqa: E402
+
+TOKEN = "shpat_stub"
+QUERY = "FROM sales SHOW total_sales, net_items_sold GROUP BY product_title SINCE 2025-01-01 UNTIL 2025-01-31"
+SLOW_SHOP = "slow-5s.example"
+DOWN_SHOP = "down.example"
+HEALTHY_SHOP = "healthy.myshopify.com"
+
+
+async def quiet(coro):
+    with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+        return await coro
+
+
+async def _all(coros):
+    return await asyncio.gather(*coros)
+
+
+def check_breaker(failures):
+    """The breaker's state machine, on a fake clock."""
+    from shopify_throttle import CircuitBreaker
+    b = CircuitBreaker(threshold=3, cooldown=10.0)
+    for t in range(2):
+        b.record(False, now=t)
+    b.record(True, now=2)
+    steps = [("a success resets the count", b.state(now=2), "closed")]
+    for t in range(3, 6):
+        b.record(False, now=t)
+    steps += [("3 failures in a row open it", b.state(now=6), "open"),
+              ("closed calls are refused", b.allow(now=14), False),
+              ("after the cooldown one probe goes out", b.allow(now=16), True),
+              ("and only one", b.allow(now=16), False)]
+    b.record(False, now=17)
+    steps += [("a failed probe reopens it", b.state(now=20), "open"),
+              ("for a full cooldown", b.allow(now=26), False),
+              ("then probes again", b.allow(now=28), True)]
+    b.record(True, now=28)
+    steps += [("a successful probe closes it", b.state(now=28), "closed"), ("times opened", b.opens, 2)]
+    for name, got, expected in steps:
+        if got != expected:
+            failures.append(f"breaker: {name}: got {got!r}, expected {expected!r}")
+
+
+async def run(args, stub_url):
+    import clients
+    from agent import AnalyticsAgent
+    from metrics import UPSTREAM_BYTES
+    failures = []
+    check_breaker(failures)
+    shops = [f"pool-{i}.myshopify.com" for i in range(args.shops)]
+    messages = [{"role": "system", "content": "Summarize."}, {"role": "user", "content": "Question: sales?"}]
+
+    async with httpx.AsyncClient(verify=False) as control:
+        async def stats():
+            return (await control.get(stub_url + "/_stats", params={"reset": True})).json()
+
+        results = {}
+        for mode, keepalive in (("new connection per call", 0), ("pooled", 20)):
+            clients.HTTP_KEEPALIVE = keepalive
+            await clients.close_http_client()
+            agent = AnalyticsAgent()
+
+            async def timed(coro, latencies):
+                t0 = time.perf_counter()
+                result = await coro
+                latencies.append(time.perf_counter() - t0)
+                return result
+
+            for phase in ("one shop", "shops concurrent", "llm"):
+                await stats()
+                wire_before = UPSTREAM_BYTES.value(service="shopify", direction="in")
+                latencies, decoded = [], 0
+
+                async def one_shop():
+                    nonlocal decoded
+                    for _ in range(args.queries):
+                        data, size = await timed(agent.fetch_shopifyql(shops[0], TOKEN, QUERY), latencies)
+                        decoded += size
+
+                async def per_shop(shop):
+                    nonlocal decoded
+                    for _ in range(args.queries // len(shops)):
+                        data, size = await timed(agent.fetch_shopifyql(shop, TOKEN, QUERY), latencies)
+                        decoded += size
+
+                async def llm():
+                    for _ in range(args.queries // 4):
+                        await timed(clients.chat_completion(messages), latencies)
+
+                runner = {"one shop": one_shop, "shops concurrent": lambda: _all(per_shop(s) for s in shops), "llm": llm}
+                await quiet(runner[phase]())
+                wire = UPSTREAM_BYTES.value(service="shopify", direction="in") - wire_before
+                results[(mode, phase)] = (sorted(latencies), (await stats())["connections"], wire, decoded)
+            await clients.close_http_client()
+
+        print(f"TLS stub, Shopify {args.shopify_latency * 1000:.0f} ms, LLM {args.llm_latency * 1000:.0f} ms, "
+              f"{args.queries} queries ({args.shops} shops concurrent), {args.queries // 4} chat completions")
+        print(f"{'mode':<25} {'calls':<17} {'handshakes':>10} {'mean ms':>8} {'p50 ms':>7} {'p90 ms':>7} {'wire KB':>8} {'decoded KB':>11}")
+        for (mode, phase), (lat, connections, wire, decoded) in results.items():
+            print(f"{mode:<25} {phase:<17} {connections:>10} {sum(lat) / len(lat) * 1000:>8.2f} "
+                  f"{percentile(lat, 0.5) * 1000:>7.2f} {percentile(lat, 0.9) * 1000:>7.2f} "
+                  f"{wire / 1024:>8.1f} {decoded / 1024:>11.1f}")
+        for phase, limit in (("one shop", 1), ("shops concurrent", args.shops), ("llm", 1)):
+            base, pooled = results[("new connection per call", phase)], results[("pooled", phase)]
+            saved = (sum(base[0]) / len(base[0]) - sum(pooled[0]) / len(pooled[0])) * 1000
+            print(f"mean latency saved by pooling, {phase}: {saved:.2f} ms per call")
+            if pooled[1] > limit:
+                failures.append(f"pooled, {phase}: {pooled[1]} handshakes, expected at most {limit}")
+            if base[1] != len(base[0]):
+                failures.append(f"no keep-alive, {phase}: {base[1]} handshakes for {len(base[0])} calls")
+        lat, _, wire, decoded = results[("pooled", "one shop")]
+        if not wire or wire >= decoded:
+            failures.append(f"Shopify responses not compressed: {wire} bytes on the wire for {decoded} decoded")
+
+        # Timeouts and circuit breakers
+        clients.HTTP_KEEPALIVE = 20
+        clients.READ_TIMEOUTS["shopify"] = args.read_timeout
+        await clients.close_http_client()
+        os.environ.update({"SHOPIFY_BREAKER_FAILURES": "3", "SHOPIFY_BREAKER_COOLDOWN": str(args.cooldown)})
+        agent = AnalyticsAgent()
+        agent.shopify_scheduler.base_backoff = 0.01
+
+        async def query(shop):
+            t0 = time.perf_counter()
+            try:
+                data = (await agent.fetch_shopifyql(shop, TOKEN, QUERY))[0]
+            except httpx.TransportError as e:
+                data = {"errors": [{"message": type(e).__name__}]}
+            return data, time.perf_counter() - t0
+
+        def circuit_open(data):
+            return any((e.get("extensions") or {}).get("code") == "CIRCUIT_OPEN" for e in data.get("errors") or [])
+
+        print(f"read timeout {args.read_timeout}s, circuit opens after 3 failures for {args.cooldown}s:")
+        for shop in (SLOW_SHOP, DOWN_SHOP):
+            await stats()
+            (first, first_s), healthy = await quiet(asyncio.gather(
+                query(shop), asyncio.gather(*(query(HEALTHY_SHOP) for _ in range(5)))
+            ))
+            first_calls = (await stats())["shopify"] - len(healthy)
+            second, second_s = await quiet(query(shop))
+            second_calls = (await stats())["shopify"]
+            print(f"  {shop:<18} first query {first_s * 1000:>7.1f} ms ({first_calls} calls), "
+                  f"then {second_s * 1000:.2f} ms ({second_calls} calls): {first['errors'][0]['message'][:60]}")
+            if not circuit_open(first) or first_s > 3 * args.read_timeout + 1:
+                failures.append(f"{shop}: first query took {first_s:.1f}s and returned {first}")
+            if not circuit_open(second) or second_calls or second_s > 0.05:
+                failures.append(f"{shop}: open circuit took {second_s * 1000:.1f} ms and {second_calls} calls")
+            if any("errors" in d for d, _ in healthy):
+                failures.append(f"{HEALTHY_SHOP} failed while {shop} was down")
+
+        # After the cooldown exactly one probe goes out; it fails, so the circuit reopens
+        await asyncio.sleep(args.cooldown)
+        probes = await quiet(_all(query(DOWN_SHOP) for _ in range(5)))
+        calls = (await stats())["shopify"]
+        print(f"  after the cooldown: {calls} probe(s) sent for 5 concurrent queries")
+        if calls != 1 or not all(circuit_open(d) or "errors" in d for d, _ in probes):
+            failures.append(f"half-open: {calls} calls sent, expected one probe")
+        stats_ = agent.shopify_scheduler.stats()
+        if stats_[DOWN_SHOP]["circuit"] != "open" or stats_[HEALTHY_SHOP]["circuit"] != "closed":
+            failures.append(f"circuit states: {({s: v['circuit'] for s, v in stats_.items()})}")
+        await clients.close_http_client()
+
+    for f in failures[:20]:
+        print("FAIL", f)
+    print("all checks passed" if not failures else f"{len(failures)} check(s) failed")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--shops", type=int, default=4)
+    parser.add_argument("--shopify-latency", type=float, default=0.005)
+    parser.add_argument("--llm-latency", type=float, default=0.005)
+    parser.add_argument("--read-timeout", type=float, default=0.5)
+    parser.add_argument("--cooldown", type=float, default=1.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tls = make_tls_cert(tmp)
+        stub, url = start_stub_server(tls=tls, gzip=True, shopify_latency=args.shopify_latency,
+                                      llm_latency=args.llm_latency, token_delay=0)
+        os.environ.update({
+            **stub_env(url),
+            "SSL_CERT_FILE": tls[0],
+            "WARMUP_INTERVAL": "0",
+            "ROLLUP_DB": os.path.join(tmp, "rollups.db"),
+            "GENERATED_QUERY_DB": os.path.join(tmp, "generated.db")
+        })
+        try:
+            failures = asyncio.run(run(args, url))
+        finally:
+            stub.terminate()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""Derived reports from one base pull per shop and window vs one Shopify query each.
+
+Runs against a stub Shopify whose grouped ``FROM sales`` answers are
+aggregated from per-day order lines (``stub_servers.grouped_sales``) and
+whose daily series are date-accurate, so a remote answer is the reference
+for the local one.
+
+Equivalence, for several windows:
+
+* grouped product reports (total_sales_by_product, top variants, returns by
+  product, ...) with the template as-is, a smaller LIMIT and dimension
+  filters, answered by the local engine from base pulls vs the same query
+  run by Shopify: same columns, same dimension values in the same order,
+  numbers equal within 1e-9 (percent changes as formatted)
+* unfiltered daily sales reports, projected from the shared daily sales
+  series in the rollup store vs the same query run by Shopify
+
+Upstream calls: every derivable report over a window, once as a Shopify
+query per report and once through the result cache, rollup store and local
+engine of a fresh agent (at most 4 calls: the window's and the previous
+window's base pulls, the shared daily series, and its open days once);
+calls and wall time for each. Then a refresh of one grouped and one daily
+report, as the warm-up scheduler sends it, which must reach Shopify.
+
+Exits non-zero if any check fails.
+
+    python benchmarks/bench_local_engine.py
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+from stub_servers import start_stub_server, stub_env  # noqa: E402
+
+SHOP = "local.myshopify.com"
+TOKEN = "shpat_stub"
+GROUPED = ("total_sales_by_product", "total_sales_by_product_variant", "top_product_variants_by_units_sold",
+           "items_returned_by_product", "orders_and_returns_by_product")
+DAILY = ("items_ordered_over_time", "items_returned_over_time", "orders_over_time", "return_rate_over_time",
+         "gross_sales_over_time", "total_returns_over_time", "total_sales_over_time", "average_order_quantity_over_time")
+
+
+def windows():
+    last = date.today().replace(day=1) - timedelta(days=1)
+    return [("startOfDay(-30d)", "today"), ("-7d", "today"), (last.replace(day=1).isoformat(), last.isoformat())]
+
+
+VARIANTS = (
+    ("template", None, []),
+    ("limit 3", 3, []),
+    ("title contains", None, [{"field": "product_title", "op": "CONTAINS", "value": "product 1"}]),
+    ("vendor + type", 10, [{"field": "product_vendor", "op": "=", "value": "Vendor 2"},
+                           {"field": "product_type", "op": "!=", "value": "Hats"}]),
+)
+
+
+def table(data):
+    t = data["data"]["shopifyqlQuery"]["tableData"]
+    return [c["name"] for c in t["columns"]], t["rows"]
+
+
+def same_cell(a, b):
+    if isinstance(a, str) or isinstance(b, str) or a is None or b is None:
+        return a == b
+    return abs(a - b) <= 1e-9 * max(1.0, abs(a), abs(b))
+
+
+def differences(local, remote):
+    (lc, lr), (rc, rr) = table(local), table(remote)
+    if lc != rc:
+        return f"columns {lc} != {rc}"
+    if len(lr) != len(rr):
+        return f"{len(lr)} rows != {len(rr)}"
+    for i, (a, b) in enumerate(zip(lr, rr)):
+        if not all(same_cell(x, y) for x, y in zip(a, b)):
+            return f"row {i}: {a} != {b}"
+    return None
+
+
+async def run(args, stub_url):
+    from agent import AnalyticsAgent
+    agent = AnalyticsAgent()
+    failures = []
+
+    async def quiet(coro):
+        with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+            return await coro
+
+    async def build(report, since, until, limit=None, filters=()):
+        params = {"intent": report, "since": since, "until": until, "limit": limit, "filters": list(filters)}
+        return (await quiet(agent.build_query(SimpleNamespace(question=""), params)))[0]
+
+    async with httpx.AsyncClient() as control:
+        async def stats():
+            return (await control.get(stub_url + "/_stats", params={"reset": True})).json()
+
+        checked = 0
+        for since, until in windows():
+            for report in GROUPED:
+                for label, limit, filters in VARIANTS:
+                    name = f"{report} {since}..{until} ({label})"
+                    query = await build(report, since, until, limit, filters)
+                    plan = agent.local_engine.plan(query)
+                    if plan is None:
+                        failures.append(f"{name}: not planned by the local engine")
+                        continue
+                    remote = (await quiet(agent.fetch_shopifyql(SHOP, TOKEN, query)))[0]
+                    local = await quiet(agent.execute_local(SHOP, TOKEN, query, plan))
+                    problem = differences(local, remote)
+                    if problem:
+                        failures.append(f"{name}: {problem}")
+                    checked += 1
+            for report in DAILY:
+                query = await build(report, since, until)
+                remote = (await quiet(agent.fetch_shopifyql(SHOP, TOKEN, query)))[0]
+                await agent.result_cache.clear()
+                projected = await quiet(agent.execute_shopifyql(SHOP, TOKEN, query))
+                problem = differences(projected, remote)
+                if problem:
+                    failures.append(f"{report} {since}..{until} (daily series): {problem}")
+                checked += 1
+        print(f"equivalence: {checked} report/window/variant combinations checked")
+
+        # Every derivable report over one window: one Shopify query each vs derived
+        os.environ["ROLLUP_DB"] = os.path.join(args.tmp, "rollups_fresh.db")
+        fresh = AnalyticsAgent()
+        await fresh.result_cache.clear()
+        since, until = windows()[0]
+        queries = [await build(r, since, until) for r in GROUPED + DAILY]
+        print(f"{len(queries)} reports over {since}..{until}:")
+        print(f"{'':<24} {'shopify calls':>14} {'ms':>9}")
+        for label, runner in (
+            ("one query per report", lambda q: fresh.fetch_shopifyql(SHOP, TOKEN, q)),
+            ("derived", lambda q: fresh.execute_shopifyql(SHOP, TOKEN, q)),
+        ):
+            await stats()
+            t0 = time.perf_counter()
+            for q in queries:
+                data = await quiet(runner(q))
+                data = data[0] if isinstance(data, tuple) else data
+                if "data" not in data:
+                    failures.append(f"{label}: {data}")
+            elapsed = (time.perf_counter() - t0) * 1000
+            calls = (await stats())["shopify"]
+            print(f"{label:<24} {calls:>14} {elapsed:>9.1f}")
+            if label == "derived" and calls > 4:
+                failures.append(f"derived reports made {calls} Shopify calls, expected at most 4 base pulls")
+
+        # A refresh, as the warm-up scheduler sends, refetches the base pulls
+        # and open days instead of re-storing what is cached
+        for report in (GROUPED[0], DAILY[0]):
+            await quiet(fresh.execute_shopifyql(SHOP, TOKEN, await build(report, since, until), refresh=True))
+            calls = (await stats())["shopify"]
+            print(f"refresh of {report}: {calls} Shopify call(s)")
+            if not calls:
+                failures.append(f"refresh of {report} was answered from the cache")
+
+    for f in failures[:20]:
+        print("FAIL", f)
+    print("all checks passed" if not failures else f"{len(failures)} check(s) failed")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shopify-latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    stub, url = start_stub_server(shopify_latency=args.shopify_latency)
+    with tempfile.TemporaryDirectory() as tmp:
+        args.tmp = tmp
+        os.environ.update({
+            **stub_env(url),
+            "ROLLUP_DB": os.path.join(tmp, "rollups.db"),
+            "GENERATED_QUERY_DB": os.path.join(tmp, "generated.db")
+        })
+        try:
+            failures = asyncio.run(run(args, url))
+        finally:
+            stub.terminate()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""Generated-query cache lookups: in-memory TF-IDF matrix vs a per-entry scan.
+
+Fills a ``GeneratedQueryCache`` with ``--entries`` synthetic questions
+(a few windows and top-N limits, so signatures differ) and looks up
+paraphrases, exact questions and unrelated ones. For each size reports the
+mean / p99 lookup time of the cache and of the previous algorithm (rebuild
+every stored question's vector and compare one by one), and the SQLite
+statements lookups ran.
+
+Checks, exiting non-zero on failure:
+
+* the cache returns the same entry as the scan for every lookup
+* lookups, stores and forgets run no SQLite statements on the caller's
+  thread; hit counts reach SQLite in batches once ``flush_every`` are
+  pending, and on ``flush()``
+* a question with another breakdown ("by country" for a stored "by
+  channel") or a word no stored question has is not matched
+
+    python benchmarks/bench_query_memory.py --entries 500 5000
+"""
+import argparse
+import asyncio
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+from bench_replay import percentile  # noqa: E402
+
+SUBJECTS = ("sales", "orders", "refunds", "units", "customers", "discounts", "shipping", "taxes", "inventory",
+            "vendors", "collections", "variants", "gift cards", "tips", "duties", "subscriptions")
+SHAPES = ("{s} split by {d}", "show {s} for each {d}", "breakdown of {s} per {d} {w}", "which {d} had the most {s} {w}",
+          "compare {s} across {d} {w}", "list {d} ranked by {s} {w}")
+DIMENSIONS = ("sales channel", "country", "city", "device", "referrer", "landing page", "payment gateway",
+              "shipping method", "discount code", "pos location", "staff member", "market")
+WINDOWS = ("", "last 7 days", "this month", "in 2024", "top 10")
+VENDORS = ("", "", "") + tuple(f"for vendor {name}" for name in (
+    "acme", "globex", "initech", "umbrella", "hooli", "stark", "wayne", "wonka", "tyrell", "cyberdyne",
+    "soylent", "vandelay", "oscorp", "aperture", "gringotts", "monarch", "dunder", "pied", "massive", "virtucon"))
+
+
+def questions(n, rng):
+    seen = set()
+    while len(seen) < n:
+        question = rng.choice(SHAPES).format(s=rng.choice(SUBJECTS), d=rng.choice(DIMENSIONS), w=rng.choice(WINDOWS))
+        seen.add(" ".join(f"{question} {rng.choice(VENDORS)}".split()))
+    return list(seen)
+
+
+def scan(cache, question):
+    """The previous lookup: every stored question's vector rebuilt and compared in turn."""
+    from query_memory import _signature, _terms
+
+    def vector(terms):
+        n = len(cache._entries) + 1
+        vec = {t: c * (math.log(n / (cache._df[t] + 1)) + 1.0) for t, c in terms.items()}
+        norm = math.sqrt(sum(v * v for v in vec.values())) or 1.0
+        return {t: v / norm for t, v in vec.items()}
+
+    from router import tokenize
+    entry = cache._entries.get(" ".join(tokenize(question)))
+    if entry is not None:
+        return entry
+    terms = _terms(question)
+    if not terms or any(cache._df[t] <= 0 for t in terms):
+        return None
+    signature = _signature(question)
+    qvec = vector(terms)
+    best, best_score = None, cache.min_similarity
+    for entry in cache._entries.values():
+        if entry["signature"] != signature:
+            continue
+        evec = vector(entry["terms"])
+        score = sum(w * evec.get(t, 0.0) for t, w in qvec.items())
+        if score >= best_score:
+            best, best_score = entry, score
+    return best
+
+
+async def run(args, tmp):
+    from query_memory import GeneratedQueryCache
+    from router import tokenize
+    failures = []
+    rng = random.Random(0)
+    print(f"{'entries':>8} {'lookups':>8} {'hits':>6} {'matrix mean us':>15} {'p99 us':>8} {'scan mean us':>13} "
+          f"{'p99 us':>8} {'sqlite on loop':>15}")
+    for n in args.entries:
+        cache = GeneratedQueryCache(os.path.join(tmp, f"generated_{n}.db"), max_entries=n)
+        stored = questions(n, rng)
+        for i, q in enumerate(stored):
+            await cache.store(q, f"FROM sales SHOW total_sales -- {i}")
+        probes = [rng.choice(stored) for _ in range(args.lookups // 3)]
+        probes += [q.replace("show", "give me").replace("for each", "by") + " please" for q in rng.sample(stored, args.lookups // 3)]
+        probes += [f"{rng.choice(SUBJECTS)} by {rng.choice(SUBJECTS)} weekly" for _ in range(args.lookups - len(probes))]
+
+        cache._vectors()  # built once after the stores, not per lookup
+        statements = []
+        cache._db.set_trace_callback(lambda s: statements.append((threading.get_ident(), s)))
+        loop_thread = threading.get_ident()
+        cache.flush_every = len(probes) * 2
+        matrix, scanned, hits = [], [], 0
+        for q in probes:
+            t0 = time.perf_counter()
+            query = cache.lookup(q)
+            matrix.append(time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            expected = scan(cache, q)
+            scanned.append(time.perf_counter() - t0)
+            hits += query is not None
+            if query != (expected["query"] if expected else None):
+                failures.append(f"{n} entries, {q!r}: cache returned {query!r}, scan {expected and expected['query']!r}")
+        on_loop = sum(1 for thread, _ in statements if thread == loop_thread)
+        matrix.sort()
+        scanned.sort()
+        print(f"{n:>8} {len(probes):>8} {hits:>6} {sum(matrix) / len(matrix) * 1e6:>15.1f} "
+              f"{percentile(matrix, 0.99) * 1e6:>8.1f} {sum(scanned) / len(scanned) * 1e6:>13.1f} "
+              f"{percentile(scanned, 0.99) * 1e6:>8.1f} {on_loop:>15}")
+        if on_loop:
+            failures.append(f"{n} entries: {on_loop} SQLite statements during lookups")
+
+        # Past flush_every pending entries, one batch goes to a worker thread
+        cache.flush_every = len(cache._used) + 8
+        for q in [q for q in stored if cache._entries[" ".join(tokenize(q))]["key"] not in cache._used][:8]:
+            cache.lookup(q)
+        if cache._flushing is not None:
+            await cache._flushing
+        batch = [(thread, s) for thread, s in statements if s.startswith(("UPDATE", "COMMIT"))]
+        updates = sum(1 for _, s in batch if s.startswith("UPDATE"))
+        commits = sum(1 for _, s in batch if s.startswith("COMMIT"))
+        on_loop = sum(1 for thread, _ in batch if thread == loop_thread)
+        # Stores and forgets write from a worker thread too
+        statements.clear()
+        await cache.store("net sales by weekday from the outlet", "FROM sales SHOW net_sales -- outlet")
+        await cache.forget("FROM sales SHOW net_sales -- outlet")
+        writes = [thread for thread, s in statements if s.startswith(("INSERT", "DELETE", "COMMIT"))]
+        if not writes or loop_thread in writes:
+            failures.append(f"{n} entries: store and forget ran {len(writes)} writes, "
+                            f"{writes.count(loop_thread)} on the loop thread")
+        cache._db.set_trace_callback(None)
+        cache.lookup(stored[0])
+        cache.flush()
+        if cache._flushing is not None:
+            await cache._flushing
+        total = cache._db.execute("SELECT SUM(hits) FROM generated_queries").fetchone()[0]
+        print(f"{'':>8} batch of {cache.flush_every} pending entries: {updates} updates, {commits} commit(s), "
+              f"{on_loop} on the loop thread")
+        if updates != cache.flush_every or commits != 1 or on_loop or cache._used or total != hits + 9:
+            failures.append(f"{n} entries: {updates} updates and {commits} commits ({on_loop} on the loop) for "
+                            f"{cache.flush_every} pending entries, {total} hits stored for {hits + 9} lookups")
+
+    # Same window and near-identical wording, but another breakdown or an unknown word
+    cache = GeneratedQueryCache(os.path.join(tmp, "breakdowns.db"))
+    await cache.store("sales by channel last week", "FROM sales SHOW total_sales GROUP BY sales_channel SINCE -7d")
+    for question in ("sales by country last week", "sales by channel last week for wholesale"):
+        if cache.lookup(question) is not None:
+            failures.append(f"{question!r} reused the query for 'sales by channel last week'")
+    if cache.lookup("show me sales by channel last week") is None:
+        failures.append("a paraphrase of 'sales by channel last week' was not matched")
+
+    for f in failures[:20]:
+        print("FAIL", f)
+    print("all checks passed" if not failures else f"{len(failures)} check(s) failed")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, nargs="+", default=[500, 5000])
+    parser.add_argument("--lookups", type=int, default=300)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        failures = asyncio.run(run(args, tmp))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Rendering predefined ShopifyQL into a request body: text templates vs the query builder.
+
+The old path formatted the template text with the dates, patched the LIMIT
+with ``str.replace``, escaped quotes into a GraphQL document built with an
+f-string and JSON-encoded it. The new path sets dates / limit / filters on
+the template parsed once at import (``AnalyticsAgent.TEMPLATES``), renders
+it and appends it as a variable to the pre-encoded ``SHOPIFYQL_DOCUMENT``.
+Reports microseconds per request body for both, per template and overall.
+
+Checks, exiting non-zero on failure:
+
+* every template renders to the same ShopifyQL as the old path (modulo
+  whitespace) for the same dates and limit; templates whose text had fixed
+  dates are compared with those dates
+* the query survives the JSON variables round trip, including quotes,
+  backslashes and non-ASCII filter values
+* a limit and filters on a predefined intent are applied by
+  ``build_query`` without any LLM call
+
+    python benchmarks/bench_query_render.py --iterations 20000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+
+from agent import AnalyticsAgent  # noqa: E402
+from cache import normalize_query  # noqa: E402
+from shopifyql import condition, graphql_body  # noqa: E402
+
+SINCE, UNTIL, LIMIT = "2025-01-01", "2025-01-31", 25
+
+
+def old_body(template, since, until, limit):
+    query = template.format(since_date=since, until_date=until).replace("LIMIT 1000", f"LIMIT {limit}")
+    escaped_query = query.replace('"', '\\"')
+    graphql_query = f"""
+        {{
+          shopifyqlQuery(query: "{escaped_query}") {{
+            tableData {{
+              columns {{
+                name
+                dataType
+                displayName
+              }}
+              rows
+            }}
+            parseErrors
+          }}
+        }}
+        """
+    return query, json.dumps({"query": graphql_query}).encode()
+
+
+def new_body(parsed, since, until, limit, filters=()):
+    query = parsed.bind(since, until, limit)
+    if filters:
+        query = query.where(*filters)
+    text = query.render()
+    return text, graphql_body(text)
+
+
+def per_op(fn, iterations):
+    t = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - t) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    agent = AnalyticsAgent()
+    failures = []
+    filters = (condition("product_title", "CONTAINS", "Bob's \"best\" tee \\ ünïcode"), condition("net_sales", ">", 100))
+
+    print(f"{'template':<40} {'old us':>8} {'new us':>8} {'filtered us':>12}")
+    totals = [0.0, 0.0, 0.0]
+    for name, template in AnalyticsAgent.PREDEFINED_QUERIES.items():
+        parsed = AnalyticsAgent.TEMPLATES[name]
+        # Templates with fixed dates ignored the requested ones
+        fixed = "{since_date}" not in template
+        since, until = (parsed.since, parsed.until) if fixed else (SINCE, UNTIL)
+        old_query, _ = old_body(template, since, until, LIMIT)
+        new_query, body = new_body(parsed, since, until, LIMIT)
+        if "LIMIT" in old_query and normalize_query(old_query) != normalize_query(new_query):
+            failures.append(f"{name}: rendered query differs\n  old: {normalize_query(old_query)}\n  new: {normalize_query(new_query)}")
+        filtered_query, filtered_body = new_body(parsed, SINCE, UNTIL, LIMIT, filters)
+        for q, b in ((new_query, body), (filtered_query, filtered_body)):
+            if json.loads(b)["variables"]["query"] != q:
+                failures.append(f"{name}: query does not survive the GraphQL variables round trip")
+
+        times = (
+            per_op(lambda: old_body(template, SINCE, UNTIL, LIMIT), args.iterations),
+            per_op(lambda: new_body(parsed, SINCE, UNTIL, LIMIT), args.iterations),
+            per_op(lambda: new_body(parsed, SINCE, UNTIL, LIMIT, filters), args.iterations)
+        )
+        totals = [a + b for a, b in zip(totals, times)]
+        print(f"{name:<40} {times[0]:>8.2f} {times[1]:>8.2f} {times[2]:>12.2f}")
+    n = len(AnalyticsAgent.PREDEFINED_QUERIES)
+    print(f"{'mean':<40} {totals[0] / n:>8.2f} {totals[1] / n:>8.2f} {totals[2] / n:>12.2f}  "
+          f"({totals[0] / totals[1]:.1f}x faster)")
+
+    # Limit and filters on a predefined intent: no LLM call, both in the query
+    intent = next(iter(AnalyticsAgent.PREDEFINED_QUERIES))
+    req = SimpleNamespace(question="top sellers", shop_domain="bench.myshopify.com", access_token="shpat_bench")
+    params = {"intent": intent, "since": SINCE, "until": UNTIL, "limit": 7,
+              "filters": [{"field": "product_title", "op": "contains", "value": "it's"}]}
+
+    async def no_llm(*a, **k):
+        failures.append("build_query called the LLM for a predefined intent")
+        return ""
+
+    agent._generate_shopifyql = no_llm
+    query, source = asyncio.run(agent.build_query(req, params))
+    if source != "predefined" or "LIMIT 7" not in query or "product_title CONTAINS 'it\\'s'" not in query:
+        failures.append(f"limit / filter not applied to {intent}: {normalize_query(query)}")
+
+    for f in failures:
+        print("FAIL", f)
+    print("all checks passed" if not failures else f"{len(failures)} check(s) failed")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""Replay a question corpus through POST /ask against stub upstreams.
+
+Starts the stubs (``stub_servers``) and the real service (``main:app``) in
+child processes, with fresh generated-query and rollup databases and no
+background warm-up, then sends ``--requests`` questions from the corpus
+(cycled, optionally shuffled) at ``--concurrency``. Stub latency, jitter,
+payload size and error rates are flags. Reports:
+
+* throughput, and p50 / p90 / p99 / max latency of the timed requests
+* failed requests: non-200 responses and error answers
+* upstream calls per request, by stage, from the stubs' ``/_stats``
+* service memory: RSS before the replay and peak RSS (Linux ``/proc``)
+
+As a regression gate: ``--save-baseline FILE`` writes the summary as JSON
+and ``--baseline FILE`` compares against it, failing when throughput drops,
+latency or peak memory grows by more than ``--tolerance`` (default 20%),
+upstream calls per request grow by more than ``--calls-tolerance`` (default
+5%), or the failure share grows by more than a point. Without injected
+errors any failed request is a failure too. Exits non-zero on failure.
+
+    python benchmarks/bench_replay.py --save-baseline /tmp/replay.json     # on the base commit
+    python benchmarks/bench_replay.py --baseline /tmp/replay.json          # on the change
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+from bench_ask_load import start_service  # noqa: E402
+from stub_servers import start_stub_server, stub_env  # noqa: E402
+
+CORPUS = os.path.join(HERE, "corpus", "questions.jsonl")
+STAGES = ("shopify", "llm_parse", "llm_sql", "llm_explain")
+ERROR_PREFIXES = ("Error:", "Shopify API Error:", "Query Error:")
+# Options that change the workload; a baseline only applies to the same ones
+WORKLOAD = ("requests", "concurrency", "shuffle", "bypass_cache", "shop", "rows", "shopify_latency",
+            "llm_latency", "jitter", "answer_bytes", "error_rate", "shopify_error_rate", "llm_error_rate")
+
+
+def load_corpus(path):
+    with open(path) as f:
+        return [json.loads(line)["question"] for line in f if line.strip()]
+
+
+def memory_kb(pid):
+    """(current RSS, peak RSS) of a process in kB, or (None, None) without /proc."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(":", 1) for line in f)
+    except OSError:
+        return None, None
+    return int(fields["VmRSS"].split()[0]), int(fields["VmHWM"].split()[0])
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+async def replay(base_url, stub_url, questions, args):
+    latencies, failures = [], []
+    sem = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=args.timeout) as client:
+        async def ask(question):
+            payload = {"shop_domain": args.shop, "access_token": "shpat_stub", "question": question,
+                       "bypass_cache": args.bypass_cache}
+            async with sem:
+                t0 = time.perf_counter()
+                try:
+                    r = await client.post(base_url + "/ask", json=payload)
+                except httpx.HTTPError as e:
+                    failures.append(f"{question!r}: {type(e).__name__}")
+                    return
+                elapsed = time.perf_counter() - t0
+            if r.status_code != 200:
+                failures.append(f"{question!r}: HTTP {r.status_code}")
+            elif r.json().get("answer", "").startswith(ERROR_PREFIXES):
+                failures.append(f"{question!r}: {r.json()['answer'][:120]}")
+            else:
+                latencies.append(elapsed)
+
+        # Untimed: imports, connection pools and first-request setup
+        for question in questions[:args.warmup]:
+            await ask(question)
+        latencies.clear()
+        failures.clear()
+        await client.get(stub_url + "/_stats", params={"reset": True})
+
+        start = time.perf_counter()
+        await asyncio.gather(*(ask(q) for q in questions))
+        wall = time.perf_counter() - start
+        calls = (await client.get(stub_url + "/_stats", params={"reset": True})).json()
+    return latencies, failures, wall, calls
+
+
+def summarize(latencies, failures, wall, calls, rss, args):
+    lat = sorted(latencies)
+    n = args.requests
+    return {
+        "workload": {k: getattr(args, k) for k in WORKLOAD},
+        "throughput": len(lat) / wall,
+        "p50_ms": percentile(lat, 0.50) * 1000,
+        "p90_ms": percentile(lat, 0.90) * 1000,
+        "p99_ms": percentile(lat, 0.99) * 1000,
+        "max_ms": (lat[-1] if lat else float("nan")) * 1000,
+        "failed": len(failures),
+        "failed_share": len(failures) / n,
+        "calls_per_request": {stage: calls.get(stage, 0) / n for stage in STAGES},
+        "upstream_errors": calls.get("shopify_errors", 0) + calls.get("llm_errors", 0),
+        "rss_mb": rss[0] / 1024 if rss[0] else None,
+        "peak_rss_mb": rss[1] / 1024 if rss[1] else None
+    }
+
+
+def compare(summary, baseline, tolerance, calls_tolerance):
+    """Regressions of `summary` against `baseline`, as messages."""
+    if summary["workload"] != baseline.get("workload"):
+        return [f"baseline was recorded with a different workload: {baseline.get('workload')}"]
+    out = []
+    if summary["throughput"] < baseline["throughput"] * (1 - tolerance):
+        out.append(f"throughput {summary['throughput']:.1f} req/s < baseline {baseline['throughput']:.1f}")
+    for key in ("p50_ms", "p90_ms", "p99_ms"):
+        if summary[key] > baseline[key] * (1 + tolerance):
+            out.append(f"{key} {summary[key]:.0f} > baseline {baseline[key]:.0f}")
+    for stage, value in summary["calls_per_request"].items():
+        base = baseline["calls_per_request"].get(stage, 0.0)
+        if value > base * (1 + calls_tolerance) + 0.005:
+            out.append(f"{stage} calls per request {value:.3f} > baseline {base:.3f}")
+    if summary["peak_rss_mb"] and baseline.get("peak_rss_mb") and summary["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + tolerance):
+        out.append(f"peak RSS {summary['peak_rss_mb']:.0f} MB > baseline {baseline['peak_rss_mb']:.0f} MB")
+    if summary["failed_share"] > baseline["failed_share"] + 0.01:
+        out.append(f"failed share {summary['failed_share']:.1%} > baseline {baseline['failed_share']:.1%}")
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", default=CORPUS)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--shuffle", type=int, default=None, metavar="SEED", help="replay in a seeded random order")
+    parser.add_argument("--warmup", type=int, default=5, help="untimed requests before the replay")
+    parser.add_argument("--bypass-cache", action="store_true", help="send bypass_cache with every question")
+    parser.add_argument("--shop", default="bench.myshopify.com",
+                        help='shop domain; "rows-N.example" makes Shopify return N rows per query')
+    parser.add_argument("--rows", type=int, default=30, help="rows per Shopify response")
+    parser.add_argument("--shopify-latency", type=float, default=0.05)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--jitter", type=float, default=0.2, help="latencies vary uniformly by this fraction")
+    parser.add_argument("--answer-bytes", type=int, default=0, help="pad LLM answers to about this size")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of Shopify and LLM calls that fail")
+    parser.add_argument("--shopify-error-rate", type=float, default=None)
+    parser.add_argument("--llm-error-rate", type=float, default=None)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--baseline", help="summary JSON to compare against")
+    parser.add_argument("--save-baseline", help="write this run's summary JSON here")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--calls-tolerance", type=float, default=0.05)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    if args.shuffle is not None:
+        random.Random(args.shuffle).shuffle(corpus)
+    questions = [corpus[i % len(corpus)] for i in range(args.requests)]
+    shopify_error_rate = args.error_rate if args.shopify_error_rate is None else args.shopify_error_rate
+    llm_error_rate = args.error_rate if args.llm_error_rate is None else args.llm_error_rate
+
+    stub, stub_url = start_stub_server(
+        shopify_latency=args.shopify_latency, llm_latency=args.llm_latency, rows=args.rows, jitter=args.jitter,
+        shopify_error_rate=shopify_error_rate, llm_error_rate=llm_error_rate, answer_bytes=args.answer_bytes
+    )
+    tmp = tempfile.mkdtemp(prefix="bench_replay_")
+    env = dict(stub_env(stub_url), WARMUP_INTERVAL="0",
+               GENERATED_QUERY_DB=os.path.join(tmp, "generated.db"), ROLLUP_DB=os.path.join(tmp, "rollups.db"))
+    try:
+        proc, url = start_service("async", env)
+        try:
+            latencies, failures, wall, calls = asyncio.run(replay(url, stub_url, questions, args))
+            rss = memory_kb(proc.pid)
+        finally:
+            proc.terminate()
+    finally:
+        stub.terminate()
+
+    summary = summarize(latencies, failures, wall, calls, rss, args)
+    print(f"{args.requests} requests from {len(corpus)} corpus questions, concurrency {args.concurrency}, "
+          f"shopify {args.shopify_latency * 1000:.0f} ms / llm {args.llm_latency * 1000:.0f} ms ± {args.jitter:.0%}, "
+          f"{args.rows} rows, errors {shopify_error_rate:.0%} / {llm_error_rate:.0%}"
+          + (", cache bypassed" if args.bypass_cache else ""))
+    print(f"throughput      {summary['throughput']:>8.1f} req/s  ({wall:.2f} s)")
+    print(f"latency ms      p50 {summary['p50_ms']:.0f}  p90 {summary['p90_ms']:.0f}  "
+          f"p99 {summary['p99_ms']:.0f}  max {summary['max_ms']:.0f}")
+    print(f"failed          {summary['failed']:>8}  ({summary['failed_share']:.1%}; {summary['upstream_errors']} injected upstream errors)")
+    print("calls/request   " + "  ".join(f"{stage} {v:.2f}" for stage, v in summary["calls_per_request"].items()))
+    if summary["peak_rss_mb"]:
+        print(f"service memory  RSS {summary['rss_mb']:.0f} MB, peak {summary['peak_rss_mb']:.0f} MB")
+
+    problems = []
+    if not shopify_error_rate and not llm_error_rate:
+        problems += failures[:5] + ([f"... {len(failures) - 5} more failed requests"] if len(failures) > 5 else [])
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems += compare(summary, json.load(f), args.tolerance, args.calls_tolerance)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"baseline written to {args.save_baseline}")
+    for p in problems:
+        print("FAIL", p)
+    print("all checks passed" if not problems else f"{len(problems)} check(s) failed")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""Repeated time-series reports with and without the daily rollup store.
+
+Runs predefined ``TIMESERIES day`` reports against a stub Shopify that
+returns date-accurate daily rows (including COMPARE TO previous_period
+columns). Each report is answered four ways: a direct query (what
+execute_shopifyql used to send), a first pass through the rollup store, a
+repeat once its closed days are stored, and a repeat after new orders
+land on today. Reports daily buckets Shopify had to aggregate, upstream
+calls and latency for each, and checks the rollup tables against the
+direct answer:
+
+* identical columns and rows, including previous-period and percent-change
+  values and the first/last day of the window
+* no row outside SINCE..UNTIL, and LIMIT / day ordering applied
+* a repeat only fetches the open days in the window
+* a wider window over a stored series fetches only the days it lacks
+* today's bucket reflects orders that arrived after it was first fetched
+* merged days are written to SQLite off the event loop thread
+
+Exits non-zero if any check fails.
+
+    python benchmarks/bench_rollup.py --repeats 5
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+from stub_servers import start_stub_server, stub_env  # noqa: E402
+
+SHOP = "rollup.myshopify.com"
+TOKEN = "shpat_stub"
+
+
+def scenarios():
+    first = (date.today().replace(day=1) - timedelta(days=1)).replace(day=1)
+    last = date.today().replace(day=1) - timedelta(days=1)
+    return [
+        ("total_sales_over_time", "startOfDay(-30d)", "today", None),
+        ("orders_over_time", "-7d", "today", None),
+        # Same series as the first report, three times the window
+        ("total_sales_over_time", "startOfDay(-90d)", "today", None),
+        ("gross_sales_over_time", first.isoformat(), last.isoformat(), None),
+        ("return_rate_over_time", "yesterday", "yesterday", None),
+        ("average_order_value_over_time", "startOfDay(-14d)", "today", 5),
+    ]
+
+
+def table(data):
+    t = data["data"]["shopifyqlQuery"]["tableData"]
+    return [c["name"] for c in t["columns"]], t["rows"]
+
+
+async def run(args, stub_url):
+    from agent import AnalyticsAgent
+    agent = AnalyticsAgent()
+    failures = []
+    out = []
+    writes = []
+    agent.rollups._db.set_trace_callback(
+        lambda s: s.startswith(("INSERT", "COMMIT")) and writes.append(threading.get_ident()))
+
+    async with httpx.AsyncClient() as control:
+        async def stats():
+            return (await control.get(stub_url + "/_stats", params={"reset": True})).json()
+
+        async def timed(coro):
+            await stats()
+            t0 = time.perf_counter()
+            with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+                data = await coro
+            elapsed = (time.perf_counter() - t0) * 1000
+            return data, elapsed, await stats()
+
+        def check(ok, name, what):
+            if not ok:
+                failures.append(f"{name}: {what}")
+
+        for report, since, until, limit in scenarios():
+            name = f"{report} {since}..{until}" + (f" LIMIT {limit}" if limit else "")
+            with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+                query, _ = await agent.build_query(
+                    SimpleNamespace(question=""), {"intent": report, "since": since, "until": until, "limit": limit}
+                )
+            plan = agent.rollups.plan(query)
+            check(plan is not None, name, "not served by the rollup store")
+            if plan is None:
+                continue
+            start, end = agent.rollups.needed_range(plan)
+            first_open = plan["today"] - timedelta(days=agent.rollups.open_days - 1)
+            open_days = sum(1 for i in range((end - start).days + 1) if start + timedelta(days=i) >= first_open)
+
+            direct, direct_ms, direct_stats = await timed(agent.fetch_shopifyql(SHOP, TOKEN, query))
+            direct = direct[0]
+            await agent.result_cache.clear()
+            stored_before = len(agent.rollups.load(SHOP, plan)[1])
+            first, first_ms, first_stats = await timed(agent.execute_shopifyql(SHOP, TOKEN, query))
+            check(table(first) == table(direct), name, "first pass differs from the direct query")
+            check(first_stats["days"] == (end - start).days + 1 - stored_before, name,
+                  f"first pass fetched {first_stats['days']} days, expected only the {(end - start).days + 1 - stored_before} not stored")
+
+            columns, rows = table(first)
+            days = [r[columns.index("day")] for r in rows]
+            check(all(plan["since"].isoformat() <= d <= plan["until"].isoformat() for d in days), name, "row outside the window")
+            check(days == sorted(days), name, "rows not ordered by day")
+            check(limit is None or len(rows) <= limit, name, "LIMIT not applied")
+
+            warm_ms = []
+            for _ in range(args.repeats):
+                await agent.result_cache.clear()
+                warm, ms, warm_stats = await timed(agent.execute_shopifyql(SHOP, TOKEN, query))
+                warm_ms.append(ms)
+                check(table(warm) == table(direct), name, "repeat differs from the direct query")
+                check(warm_stats["days"] == open_days, name,
+                      f"repeat fetched {warm_stats['days']} days, expected {open_days} open days")
+
+            await control.post(stub_url + "/_today", params={"add": 7})
+            fresh, _, _ = await timed(agent.fetch_shopifyql(SHOP, TOKEN, query))
+            await agent.result_cache.clear()
+            after, _, _ = await timed(agent.execute_shopifyql(SHOP, TOKEN, query))
+            check(table(after) == table(fresh[0]), name, "today's bucket not refreshed after new orders")
+
+            out.append((name, direct_stats, direct_ms, first_stats, first_ms, warm_stats, statistics.median(warm_ms)))
+
+    print(f"{'report':<58} {'direct days/calls/ms':>21} {'first pass':>16} {'repeat':>16}")
+    for name, ds, dms, fs, fms, ws, wms in out:
+        print(f"{name:<58} {ds['days']:>6} {ds['shopify']:>3} {dms:>9.1f}  "
+              f"{fs['days']:>4} {fs['shopify']:>2} {fms:>7.1f}  {ws['days']:>4} {ws['shopify']:>2} {wms:>7.1f}")
+    print(f"store: {agent.rollups.stats()}")
+    on_loop = writes.count(threading.get_ident())
+    print(f"store writes: {len(writes)} statements, {on_loop} on the event loop thread")
+    if not writes or on_loop:
+        failures.append(f"{on_loop} of {len(writes)} rollup store writes ran on the event loop thread")
+    for f in failures:
+        print("FAIL", f)
+    print("all checks passed" if not failures else f"{len(failures)} check(s) failed")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--shopify-latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    # A cost bucket like Shopify's, so responses carry throttleStatus for the scheduler
+    stub, url = start_stub_server(shopify_latency=args.shopify_latency, throttle_bucket=1000, throttle_restore=100)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update({
+            **stub_env(url),
+            "ROLLUP_DB": os.path.join(tmp, "rollups.db"),
+            "GENERATED_QUERY_DB": os.path.join(tmp, "generated.db")
+        })
+        try:
+            failures = asyncio.run(run(args, url))
+        finally:
+            stub.terminate()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Routing accuracy and latency of the deterministic IntentRouter.
+
+Replays the labelled corpus (corpus/questions.jsonl) through
+``IntentRouter.route`` and reports, per run:
+- local share: questions answered without an LLM call
+- intent accuracy on locally routed questions, and over the whole corpus
+  (questions labelled "unknown" count as correct when the router abstains)
+- date accuracy (since/until) on correctly routed questions
+- per-question routing latency
+
+Then the probes in corpus/router_probes.jsonl: phrasings the router must
+leave to the LLM (periods it cannot parse such as "Q1 2024" or "last
+weekend", breakdowns no report has such as "by channel", a specific SKU),
+labelled "llm", next to similar ones it must still route with the right
+dates. Exits non-zero if any probe is handled wrongly.
+
+    python benchmarks/bench_router.py [--threshold 0.25] [--show-misses]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from router import IntentRouter  # noqa: E402
+
+
+def load_corpus(path=os.path.join(HERE, "corpus", "questions.jsonl")):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threshold", type=float, default=None)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--show-misses", action="store_true")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    router = IntentRouter() if args.threshold is None else IntentRouter(threshold=args.threshold)
+    build_ms = (time.perf_counter() - t0) * 1000
+    corpus = load_corpus()
+
+    routed = correct = overall = dates_ok = 0
+    misses = []
+    latencies = []
+    for item in corpus:
+        for _ in range(args.repeat):
+            t = time.perf_counter()
+            params = router.route(item["question"])
+            latencies.append(time.perf_counter() - t)
+        if params is None:
+            overall += item["intent"] == "unknown"
+            if item["intent"] != "unknown":
+                misses.append((item["question"], item["intent"], "<llm>"))
+            continue
+        routed += 1
+        if params["intent"] == item["intent"]:
+            correct += 1
+            overall += 1
+            dates_ok += (params["since"], params["until"]) == (item["since"], item["until"])
+        else:
+            misses.append((item["question"], item["intent"], params["intent"]))
+
+    n = len(corpus)
+    latencies.sort()
+    print(f"corpus questions        {n}")
+    print(f"index build             {build_ms:.2f} ms")
+    print(f"resolved without LLM    {routed}/{n} ({routed / n:.1%})")
+    print(f"accuracy (routed)       {correct}/{routed} ({correct / max(routed, 1):.1%})")
+    print(f"accuracy (overall)      {overall}/{n} ({overall / n:.1%})")
+    print(f"date accuracy (routed)  {dates_ok}/{correct} ({dates_ok / max(correct, 1):.1%})")
+    print(f"latency per question    mean {statistics.mean(latencies) * 1e6:.1f} us, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1e6:.1f} us")
+    if args.show_misses:
+        for q, want, got in misses:
+            print(f"  MISS {q!r}: want {want}, got {got}")
+
+    failures = []
+    probes = load_corpus(os.path.join(HERE, "corpus", "router_probes.jsonl"))
+    for item in probes:
+        params = router.route(item["question"])
+        if item["intent"] == "llm":
+            if params is not None:
+                failures.append(f"{item['question']!r}: routed to {params}, expected the LLM")
+        elif params is None or (params["intent"], params["since"], params["until"]) != (
+                item["intent"], item["since"], item["until"]):
+            failures.append(f"{item['question']!r}: routed to {params}, expected {item['intent']} "
+                            f"{item['since']}..{item['until']}")
+    print(f"probes                  {len(probes) - len(failures)}/{len(probes)} handled as labelled")
+    for f in failures:
+        print("FAIL", f)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
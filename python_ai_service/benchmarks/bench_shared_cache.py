@@ -0,0 +1,130 @@
+"""Shopify calls behind identical questions on a multi-worker deployment.
+
+Starts the service as ``uvicorn main:app --workers N`` twice against the
+stub upstreams, once with the default in-process result cache and once
+with the shared backend pointed at the Redis-protocol stand-in, and
+sends:
+
+* a burst of concurrent identical questions (one ShopifyQL query), and a
+  burst of concurrent reorder-forecast questions (two streamed queries),
+  each request on a fresh connection so they spread over the workers
+* a run of sequential repeats of another question, again one connection
+  per request (over another window: grouped product reports over the same
+  window share one base pull, see ``local_engine.py``)
+
+Reports Shopify calls and wall time per phase. With the shared backend
+every phase must cost exactly one Shopify call per distinct query, and the
+reorder answer must match the in-process one (per-SKU totals go through
+the shared cache as JSON); the script exits non-zero otherwise.
+
+    python benchmarks/bench_shared_cache.py --workers 4 --burst 32 --repeats 16
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+
+from stub_servers import free_port, start_resp_server, start_stub_server, stub_env, wait_for_port  # noqa: E402
+
+TOKEN = "shpat_stub"
+# One shop for both backends: the stub's figures, and so templated answers, depend on it
+SHOP = "bench.myshopify.com"
+PHASES = (
+    ("burst: top products", "top 5 products last 30 days", "burst", 1),
+    ("burst: reorder forecast", "how much should I reorder next month", "burst", 2),
+    ("repeats: returns by product", "which products had the most returns last 7 days", "repeat", 1),
+)
+
+
+def start_workers(workers, env):
+    port = free_port()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=SERVICE_DIR, env={**os.environ, **env}, stdout=subprocess.DEVNULL
+    )
+    wait_for_port(port, timeout=60.0)
+    return proc, f"http://127.0.0.1:{port}"
+
+
+async def ask(url, shop, question):
+    # A fresh connection per request, so the kernel spreads them over workers
+    async with httpx.AsyncClient(timeout=120.0, limits=httpx.Limits(max_keepalive_connections=0)) as client:
+        r = await client.post(url + "/ask", json={"shop_domain": shop, "access_token": TOKEN, "question": question})
+        r.raise_for_status()
+        return r.json()["answer"]
+
+
+async def run(args, stub_url, url, shop):
+    rows = []
+    async with httpx.AsyncClient() as control:
+        for name, question, kind, queries in PHASES:
+            await control.get(stub_url + "/_stats", params={"reset": True})
+            t0 = time.perf_counter()
+            if kind == "burst":
+                answers = await asyncio.gather(*(ask(url, shop, question) for _ in range(args.burst)))
+            else:
+                answers = [await ask(url, shop, question) for _ in range(args.repeats)]
+            elapsed = time.perf_counter() - t0
+            calls = (await control.get(stub_url + "/_stats")).json()["shopify"]
+            rows.append((name, queries, calls, elapsed, answers[0]))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--burst", type=int, default=32)
+    parser.add_argument("--repeats", type=int, default=16)
+    parser.add_argument("--shopify-latency", type=float, default=0.3)
+    args = parser.parse_args()
+
+    stub, stub_url = start_stub_server(shopify_latency=args.shopify_latency, llm_latency=0.05)
+    resp, resp_url = start_resp_server()
+    results = {}
+    try:
+        for backend in ("in-process", "shared"):
+            with tempfile.TemporaryDirectory() as tmp:
+                env = {
+                    **stub_env(stub_url),
+                    "GENERATED_QUERY_DB": os.path.join(tmp, "generated.db"),
+                    "ROLLUP_DB": os.path.join(tmp, "rollups.db"),
+                    "WARMUP_INTERVAL": "0",
+                    "RESULT_CACHE_URL": resp_url if backend == "shared" else ""
+                }
+                service, url = start_workers(args.workers, env)
+                try:
+                    results[backend] = asyncio.run(run(args, stub_url, url, SHOP))
+                finally:
+                    service.terminate()
+                    service.wait()
+    finally:
+        stub.terminate()
+        resp.terminate()
+
+    failures = []
+    print(f"{args.workers} workers, burst of {args.burst}, {args.repeats} sequential repeats")
+    print(f"{'phase':<30} {'queries':>7} {'in-process calls':>17} {'shared calls':>13} {'in-process s':>13} {'shared s':>9}")
+    for local, shared in zip(results["in-process"], results["shared"]):
+        name, queries = local[0], local[1]
+        print(f"{name:<30} {queries:>7} {local[2]:>17} {shared[2]:>13} {local[3]:>13.2f} {shared[3]:>9.2f}")
+        if shared[2] != queries:
+            failures.append(f"{name}: {shared[2]} Shopify calls with the shared cache, expected {queries}")
+        if shared[4] != local[4]:
+            failures.append(f"{name}: answers differ between backends")
+    for f in failures:
+        print("FAIL", f)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Peak memory of the reorder forecast: buffered vs streamed Shopify responses.
+
+Runs the two reorder_forecast queries against a stub that serves N synthetic
+rows per query, once through ``execute_shopifyql`` (whole body read, printed
+and decoded, then summed) and once through ``handle_reorder_forecast``, which
+parses rows while they download and folds them into per-SKU (daily) sums. Reports
+the tracemalloc peak and wall time for each, and checks that both produce
+the same answer, and that an HTML error page from Shopify comes back from
+either path as the same Shopify API error.
+
+By default every row is a distinct SKU, so the streamed peak still grows
+with the per-SKU sums. Pass ``--skus`` to repeat a fixed set of SKUs and see
+memory that is flat in the row count.
+
+    python benchmarks/bench_stream_memory.py --rows 2000 20000 100000 200000
+    python benchmarks/bench_stream_memory.py --skus 1000
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+from stub_servers import start_stub_server, stub_env  # noqa: E402
+
+MEASURES = ("net_items_sold", "ending_inventory_units")
+
+
+async def buffered(agent, req, queries):
+    from forecast import history_start
+    from table import ColumnarTable, GroupedDaily, GroupedSum
+    results, error = await agent.execute_many(req.shop_domain, req.access_token, queries, use_cache=False)
+    assert error is None, error
+    start = history_start(agent.FORECAST_HISTORY_DAYS)
+    totals = []
+    for data, measure in zip(results, MEASURES):
+        # Daily per-SKU sales, on-hand totals
+        grouped = GroupedDaily(start, agent.FORECAST_HISTORY_DAYS) if not totals else GroupedSum()
+        agent._add_sku_totals(grouped, ColumnarTable.from_shopifyql(data), measure)
+        totals.append(grouped.result())
+    return agent._reorder_summary(*totals, start)
+
+
+async def streamed(agent, req, queries):
+    return await agent.handle_reorder_forecast(req, {"intent": "reorder_forecast"})
+
+
+async def measure(fn, *args):
+    with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+        t = time.perf_counter()
+        await fn(*args)
+        elapsed = time.perf_counter() - t
+        tracemalloc.start()
+        out = await fn(*args)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return out, peak / 2**20, elapsed * 1000
+
+
+async def capture_queries(agent, req):
+    # Reuse the exact queries handle_reorder_forecast sends
+    seen = []
+
+    async def record(shop_domain, token, queries, use_cache=True, run=None):
+        seen.extend(queries)
+        return None, {"answer": "captured"}
+
+    original, agent.execute_many = agent.execute_many, record
+    try:
+        await agent.handle_reorder_forecast(req, {"intent": "reorder_forecast"})
+    finally:
+        agent.execute_many = original
+    return seen
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[2000, 20000, 100000, 200000])
+    parser.add_argument("--skus", type=int, default=None, help="distinct SKUs per response (default: one per row)")
+    parser.add_argument("--shopify-latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    stub, url = start_stub_server(shopify_latency=args.shopify_latency)
+    os.environ.update(stub_env(url))
+    from agent import AnalyticsAgent
+    from clients import close_http_client
+    agent = AnalyticsAgent()
+
+    print(f"{'rows':>7} {'buffered MB':>12} {'buffered ms':>12} {'streamed MB':>12} {'streamed ms':>12}")
+
+    async def run():
+        for n in args.rows:
+            shop = f"rows-{n}-keys-{args.skus}.example" if args.skus else f"rows-{n}.example"
+            req = SimpleNamespace(shop_domain=shop, access_token="stub", bypass_cache=True)
+            queries = await capture_queries(agent, req)
+            b_out, b_mb, b_ms = await measure(buffered, agent, req, queries)
+            s_out, s_mb, s_ms = await measure(streamed, agent, req, queries)
+            assert b_out == s_out, (b_out, s_out)
+            print(f"{n:>7} {b_mb:>12.1f} {b_ms:>12.0f} {s_mb:>12.1f} {s_ms:>12.0f}")
+
+        # A proxy's HTML error page is an error document, not a crash; one
+        # agent per path so the first does not open the shop's circuit
+        req = SimpleNamespace(shop_domain="html.example", access_token="stub", bypass_cache=True)
+        fresh = [AnalyticsAgent() for _ in range(2)]
+        for each in fresh:
+            each.shopify_scheduler.base_backoff = 0.01
+            each.shopify_scheduler.breaker_threshold = 100
+        with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+            queries = await capture_queries(fresh[0], req)
+            _, error = await fresh[0].execute_many(req.shop_domain, req.access_token, queries, use_cache=False)
+            answer = (await streamed(fresh[1], req, queries))["answer"]
+        print(f"HTML 502 page: buffered {error['answer'][:60]!r}, streamed {answer[:60]!r}")
+        assert answer == error["answer"] and "HTTP 502" in answer, (error, answer)
+        await close_http_client()
+
+    try:
+        asyncio.run(run())
+    finally:
+        stub.terminate()
+
+
+if __name__ == "__main__":
+    main()
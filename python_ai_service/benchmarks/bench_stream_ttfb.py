@@ -0,0 +1,71 @@
+"""Time to first byte of POST /ask vs the SSE variant POST /ask/stream.
+
+Runs sequential questions against the async service with stub upstreams
+and reports, per endpoint, time to first byte, time to the first answer
+token (stream only) and time to the complete answer.
+
+    python benchmarks/bench_stream_ttfb.py --requests 20 --llm-latency 1.5
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from bench_ask_load import start_service  # noqa: E402
+from stub_servers import start_stub_server, stub_env  # noqa: E402
+
+
+def measure(client, url, payload):
+    t0 = time.perf_counter()
+    ttfb = first_token = None
+    with client.stream("POST", url, json=payload) as r:
+        for chunk in r.iter_text():
+            now = time.perf_counter() - t0
+            if ttfb is None:
+                ttfb = now
+            if first_token is None and "event: token" in chunk:
+                first_token = now
+    return ttfb, first_token, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--shopify-latency", type=float, default=0.3)
+    parser.add_argument("--llm-latency", type=float, default=1.5)
+    parser.add_argument("--token-delay", type=float, default=0.03)
+    args = parser.parse_args()
+
+    stub, stub_url = start_stub_server(
+        shopify_latency=args.shopify_latency, llm_latency=args.llm_latency, token_delay=args.token_delay
+    )
+    payload = {"shop_domain": "bench.myshopify.com", "access_token": "shpat_stub",
+               "question": "How are my sales doing?", "bypass_cache": True}
+    print(f"{'endpoint':<12} {'ttfb ms':>9} {'1st token ms':>13} {'total ms':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {**stub_env(stub_url), "GENERATED_QUERY_DB": os.path.join(tmp, "generated.db"),
+               "ROLLUP_DB": os.path.join(tmp, "rollups.db")}
+        service, url = start_service("async", env)
+        try:
+            with httpx.Client(timeout=120.0) as client:
+                for path in ("/ask", "/ask/stream"):
+                    runs = [measure(client, url + path, payload) for _ in range(args.requests)]
+                    ttfb = statistics.median(r[0] for r in runs) * 1000
+                    tokens = [r[1] for r in runs if r[1] is not None]
+                    tok = f"{statistics.median(tokens) * 1000:>13.1f}" if tokens else f"{'-':>13}"
+                    total = statistics.median(r[2] for r in runs) * 1000
+                    print(f"{path:<12} {ttfb:>9.1f} {tok} {total:>9.1f}")
+        finally:
+            service.terminate()
+            stub.terminate()
+
+
+if __name__ == "__main__":
+    main()
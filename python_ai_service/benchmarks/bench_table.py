@@ -0,0 +1,141 @@
+"""Micro-benchmark: dict-per-row tables vs ColumnarTable for the reorder math.
+
+Compares, for 1k-100k SKU rows, the legacy path (``_to_table`` dicts plus a
+regex ``_to_number`` per cell, joined in a Python loop) against
+``ColumnarTable`` parsing, vectorized per-SKU sums and an ``align`` join,
+both on the flat 30-day reorder model the agent started with (the current
+forecast is benchmarked by ``bench_forecast.py``). Also checks that both
+produce the same totals.
+
+    python benchmarks/bench_table.py --rows 1000 10000 100000
+"""
+import argparse
+import os
+import random
+import re
+import statistics
+import sys
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from agent import AnalyticsAgent  # noqa: E402
+from table import ColumnarTable, GroupedSum, align  # noqa: E402
+
+
+def legacy_to_table(data):
+    table = data.get("data", {}).get("shopifyqlQuery", {}).get("tableData", {})
+    cols = [c.get("name") for c in table.get("columns", [])]
+    out = []
+    for r in table.get("rows", []):
+        if isinstance(r, dict):
+            out.append(r)
+            continue
+        obj = {}
+        for i, v in enumerate(r):
+            if i < len(cols):
+                obj[cols[i]] = v
+        out.append(obj)
+    return out
+
+
+def legacy_to_number(v):
+    if v is None:
+        return 0.0
+    if isinstance(v, (int, float)):
+        return float(v)
+    s = v.strip()
+    if s == "":
+        return 0.0
+    s = re.sub(r"[^0-9\.-]", "", s)
+    if s in ("", ".", "-", "-."):
+        return 0.0
+    try:
+        return float(s)
+    except Exception:
+        return 0.0
+
+
+def legacy_reorder(sales_data, inv_data):
+    sales_by_sku, inv_by_sku = {}, {}
+    for table, out, col, field in ((legacy_to_table(sales_data), sales_by_sku, "net_items_sold", "sold_30d"),
+                                   (legacy_to_table(inv_data), inv_by_sku, "ending_inventory_units", "on_hand")):
+        for row in table:
+            sku = row.get("product_variant_sku") or row.get("product_title")
+            if not sku:
+                continue
+            val = row.get(col)
+            if isinstance(val, str) and val.strip().lower() == col:
+                continue
+            out[sku] = {"title": row.get("product_title") or sku, field: legacy_to_number(val)}
+    total_forecast = total_inventory = total_reorder = 0.0
+    results = []
+    for sku in set(list(sales_by_sku.keys()) + list(inv_by_sku.keys())):
+        sold_30d = sales_by_sku.get(sku, {}).get("sold_30d", 0.0)
+        on_hand = inv_by_sku.get(sku, {}).get("on_hand", 0.0)
+        need = sold_30d / 30 * 30
+        reorder_qty = max(0.0, need - on_hand)
+        total_forecast += need
+        total_inventory += on_hand
+        total_reorder += reorder_qty
+        if reorder_qty > 0:
+            results.append((reorder_qty, sku))
+    results.sort(reverse=True)
+    return round(total_forecast), round(total_inventory), round(total_reorder)
+
+
+def columnar_reorder(agent, sales_data, inv_data):
+    totals = []
+    for data, measure in ((sales_data, "net_items_sold"), (inv_data, "ending_inventory_units")):
+        grouped = GroupedSum()
+        agent._add_sku_totals(grouped, ColumnarTable.from_shopifyql(data), measure)
+        totals.append(grouped.result())
+    (s_keys, sold, _), (i_keys, on_hand, _) = totals
+    _, sold_30d, on_hand = align(s_keys, sold, i_keys, on_hand)
+    need = sold_30d / 30 * 30
+    return round(need.sum()), round(on_hand.sum()), round(np.maximum(0.0, need - on_hand).sum())
+
+
+def make_data(n, metric):
+    rng = random.Random(n)
+    cols = [{"name": "product_title", "dataType": "STRING"},
+            {"name": "product_variant_sku", "dataType": "STRING"},
+            {"name": metric, "dataType": "NUMBER"}]
+    rows = [[f"Product {i}", f"SKU-{i:06d}", f"{rng.randint(0, 5000):,}"] for i in range(n)]
+    return {"data": {"shopifyqlQuery": {"tableData": {"columns": cols, "rows": rows}, "parseErrors": []}}}
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t)
+    return statistics.median(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    agent = AnalyticsAgent.__new__(AnalyticsAgent)
+
+    print(f"{'rows':>7} {'legacy parse':>13} {'column parse':>13} {'legacy reorder':>15} {'column reorder':>15} {'speedup':>8}")
+    for n in args.rows:
+        sales, inv = make_data(n, "net_items_sold"), make_data(n, "ending_inventory_units")
+        lp = timed(lambda: [legacy_to_number(r["net_items_sold"]) for r in legacy_to_table(sales)], args.repeat)
+        cp = timed(lambda: ColumnarTable.from_shopifyql(sales), args.repeat)
+        lr = timed(lambda: legacy_reorder(sales, inv), args.repeat)
+        cr = timed(lambda: columnar_reorder(agent, sales, inv), args.repeat)
+        expected = legacy_reorder(sales, inv)
+        got = columnar_reorder(agent, sales, inv)
+        assert got == expected, (expected, got)
+        print(f"{n:>7} {lp:>11.1f}ms {cp:>11.1f}ms {lr:>13.1f}ms {cr:>13.1f}ms {lr / cr:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Burst of ShopifyQL queries against a throttling stub, with and without the scheduler.
+
+The stub gives each shop a Shopify-style leaky bucket (``--bucket`` points,
+refilling at ``--restore`` per second, ``--cost`` per query). A burst of
+``--queries`` concurrent queries for one shop is sent twice: as raw
+POSTs (what execute_shopifyql used to do) and through
+``AnalyticsAgent.execute_shopifyql`` with its ShopifyScheduler. Reports
+answered vs failed queries, THROTTLED responses the stub sent, retries,
+peak queue depth, per-query latency and wall time against the best
+possible drain time of the bucket. Exits non-zero if any scheduled query
+fails.
+
+    python benchmarks/bench_throttle.py --queries 60 --bucket 100 --restore 50 --cost 10
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+from stub_servers import start_stub_server, stub_env  # noqa: E402
+
+SHOP = "burst.myshopify.com"
+QUERY = "FROM sales SHOW total_sales GROUP BY product_title SINCE -30d UNTIL today"
+
+
+def summarize(name, results, latencies, elapsed, throttled, retries, depth):
+    failed = sum(1 for r in results if "errors" in r)
+    lat = sorted(latencies)
+    print(f"{name:<12} {len(results) - failed:>5} {failed:>6} {throttled:>10} {retries:>8} {depth:>6} "
+          f"{statistics.median(lat) * 1000:>8.0f} {lat[int(len(lat) * 0.99) - 1] * 1000:>8.0f} {elapsed:>7.2f}")
+    return failed
+
+
+async def run(args, stub_url):
+    from agent import AnalyticsAgent
+    from clients import close_http_client, get_http_client, shopify_graphql_url
+    from shopify_throttle import SHOPIFY_RETRIES
+    from shopifyql import graphql_body
+    agent = AnalyticsAgent()
+    payload = graphql_body(QUERY)
+    headers = agent._shopify_headers("shpat_stub")
+
+    async def timed(coro):
+        t = time.perf_counter()
+        out = await coro
+        return out, time.perf_counter() - t
+
+    async def raw():
+        response = await get_http_client().post(shopify_graphql_url(SHOP), headers=headers, content=payload)
+        return response.json()
+
+    async with httpx.AsyncClient() as control:
+        async def stub_throttled():
+            return (await control.get(stub_url + "/_stats", params={"reset": True})).json()["throttled"]
+
+        print(f"{'mode':<12} {'ok':>5} {'failed':>6} {'throttled':>10} {'retries':>8} {'depth':>6} "
+              f"{'p50 ms':>8} {'p99 ms':>8} {'wall s':>7}")
+
+        await stub_throttled()
+        t0 = time.perf_counter()
+        out = await asyncio.gather(*(timed(raw()) for _ in range(args.queries)))
+        summarize("raw", [o for o, _ in out], [t for _, t in out], time.perf_counter() - t0, await stub_throttled(), 0, 0)
+
+        # Let the stub bucket refill before the scheduled run
+        await asyncio.sleep(args.bucket / args.restore + 0.5)
+        await stub_throttled()
+        depth = 0
+
+        async def watch():
+            nonlocal depth
+            while True:
+                depth = max([depth] + [s["queued"] for s in agent.shopify_scheduler.stats().values()])
+                await asyncio.sleep(0.01)
+
+        watcher = asyncio.ensure_future(watch())
+        retries_before = sum(SHOPIFY_RETRIES._values.values())
+        t0 = time.perf_counter()
+        with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+            out = await asyncio.gather(*(
+                timed(agent.execute_shopifyql(SHOP, "shpat_stub", QUERY, use_cache=False)) for _ in range(args.queries)
+            ))
+        elapsed = time.perf_counter() - t0
+        watcher.cancel()
+        retries = sum(SHOPIFY_RETRIES._values.values()) - retries_before
+        failed = summarize("scheduled", [o for o, _ in out], [t for _, t in out], elapsed, await stub_throttled(), retries, depth)
+    best = max(0.0, (args.queries * args.cost - args.bucket) / args.restore)
+    print(f"best possible drain time: {best:.2f}s")
+    await close_http_client()
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--queries", type=int, default=60)
+    parser.add_argument("--bucket", type=int, default=100)
+    parser.add_argument("--restore", type=float, default=50.0)
+    parser.add_argument("--cost", type=int, default=10)
+    parser.add_argument("--shopify-latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    stub, url = start_stub_server(
+        shopify_latency=args.shopify_latency, throttle_bucket=args.bucket,
+        throttle_restore=args.restore, query_cost=args.cost
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update({
+            **stub_env(url),
+            "ROLLUP_DB": os.path.join(tmp, "rollups.db"),
+            "GENERATED_QUERY_DB": os.path.join(tmp, "generated.db")
+        })
+        try:
+            failed = asyncio.run(run(args, url))
+        finally:
+            stub.terminate()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
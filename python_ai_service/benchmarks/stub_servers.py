@@ -0,0 +1,672 @@
+"""Local stand-ins for the Shopify GraphQL and OpenAI chat-completions APIs.
+
+The stubs only implement what AnalyticsAgent touches: ``shopifyqlQuery``
+returning a synthetic table shaped after the query's SHOW / GROUP BY clauses,
+and ``/v1/chat/completions`` answering parser, query-writer and explain
+prompts, plus a Redis-protocol stand-in for the shared result cache. Each
+stub runs in its own process so it does not compete with the service under
+test for the GIL.
+"""
+import asyncio
+import fnmatch
+import json
+import multiprocessing
+import os
+import random
+import re
+import socket
+import subprocess
+import time
+import zlib
+from datetime import date, timedelta
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
+
+
+# Responses larger than this are rendered and sent in pieces
+STREAM_ROWS_ABOVE = 5000
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=15.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def _clause(query, keyword):
+    m = re.search(rf"\b{keyword}\s+(.+?)(?:\s+WITH\b|\n|$)", query)
+    if not m:
+        return []
+    return [c.strip() for c in m.group(1).split(",") if c.strip()]
+
+
+def _table_shape(query):
+    dims = _clause(query, "GROUP BY")
+    if re.search(r"\bTIMESERIES\s+day\b", query) and "day" not in dims:
+        dims = ["day"] + dims
+    metrics = [c for c in _clause(query, "SHOW") if c not in dims]
+    columns = [{"name": d, "dataType": "STRING", "displayName": d} for d in dims]
+    columns += [{"name": m, "dataType": "NUMBER", "displayName": m} for m in metrics]
+    return dims, metrics, columns
+
+
+def _recent_days():
+    # Synthetic "day" values cycle over the 28 full days before today
+    today = date.today()
+    return [(today - timedelta(days=28 - j)).isoformat() for j in range(28)]
+
+
+def _synthetic_row(i, dims, metrics, keys=None, days=None):
+    k = i % keys if keys else i
+    row = [(days or _recent_days())[i % 28] if d == "day" else f"{d}-{k}" for d in dims]
+    return row + [str((i * 7 + j * 13) % 97 + 1) for j in range(len(metrics))]
+
+
+def synthetic_table(query, rows, keys=None):
+    dims, metrics, columns = _table_shape(query)
+    days = _recent_days()
+    out = [_synthetic_row(i, dims, metrics, keys, days) for i in range(rows)]
+    return {"data": {"shopifyqlQuery": {"tableData": {"columns": columns, "rows": out}, "parseErrors": []}}}
+
+
+def synthetic_table_chunks(query, rows, keys=None, chunk_rows=1000, extensions=None):
+    """The same document as ``synthetic_table``, rendered in pieces."""
+    dims, metrics, columns = _table_shape(query)
+    days = _recent_days()
+    yield '{"data": {"shopifyqlQuery": {"tableData": {"columns": ' + json.dumps(columns) + ', "rows": ['
+    for start in range(0, rows, chunk_rows):
+        piece = ", ".join(json.dumps(_synthetic_row(i, dims, metrics, keys, days)) for i in range(start, min(rows, start + chunk_rows)))
+        yield (", " if start else "") + piece
+    tail = f', "extensions": {json.dumps(extensions)}' if extensions else ""
+    yield ']}, "parseErrors": []}}' + tail + '}'
+
+
+def _stub_date(expr, today):
+    expr = expr.strip()
+    if re.fullmatch(r"\d{4}-\d{2}-\d{2}", expr):
+        return date.fromisoformat(expr)
+    if expr in ("today", "yesterday"):
+        return today - timedelta(days=expr == "yesterday")
+    m = re.fullmatch(r"(?:startOfDay\()?-(\d+)d\)?", expr)
+    return today - timedelta(days=int(m.group(1))) if m else None
+
+
+def daily_value(shop_domain, metric, day, today_extra=0):
+    """The stub's figure for one metric on one day; days with crc % 23 == 0 have no sales."""
+    if zlib.crc32(f"{shop_domain}|{day.isoformat()}".encode()) % 23 == 0:
+        return None
+    value = zlib.crc32(f"{shop_domain}|{metric}|{day.isoformat()}".encode()) % 500 + 1
+    return value + (today_extra if day == date.today() else 0)
+
+
+def daily_series(shop_domain, query, today_extra=0):
+    """Date-accurate table for an ungrouped ``TIMESERIES day`` query, or None.
+
+    One row per day between SINCE and UNTIL that had sales. With ``COMPARE TO
+    previous_period`` each row also carries ``<metric>__previous_period``
+    (and ``<metric>__percent_change`` with PERCENT_CHANGE) from the same
+    offset in the preceding window. Returns (data, days), where days counts
+    the daily buckets Shopify would have had to aggregate.
+    """
+    if not re.search(r"\bTIMESERIES\s+day\b", query) or re.search(r"\bGROUP BY\b", query):
+        return None
+    since, until = re.search(r"\bSINCE\s+(\S+)", query), re.search(r"\bUNTIL\s+(\S+)", query)
+    today = date.today()
+    since = since and _stub_date(since.group(1), today)
+    until = until and _stub_date(until.group(1), today)
+    if not since or not until:
+        return None
+    show = re.search(r"\bSHOW\s+(.+?)(?=\s+(?:WHERE|TIMESERIES|SINCE|UNTIL|COMPARE|ORDER|LIMIT|VISUALIZE)\b|$)", query, re.S)
+    metrics = [c.strip() for c in show.group(1).split(",") if c.strip() not in ("", "day")] if show else []
+    if not metrics:
+        return None
+    compare = "COMPARE TO previous_period" in query
+    percent = compare and "PERCENT_CHANGE" in query
+    columns = [{"name": "day", "dataType": "DAY", "displayName": "Day"}]
+    columns += [{"name": m, "dataType": "NUMBER", "displayName": m} for m in metrics]
+    if compare:
+        columns += [{"name": f"{m}__previous_period", "dataType": "NUMBER", "displayName": f"{m} (previous period)"} for m in metrics]
+    if percent:
+        columns += [{"name": f"{m}__percent_change", "dataType": "PERCENT", "displayName": f"{m} (% change)"} for m in metrics]
+
+    length = (until - since).days + 1
+    rows = []
+    for i in range(length):
+        day = since + timedelta(days=i)
+        current = [daily_value(shop_domain, m, day, today_extra) for m in metrics]
+        if current[0] is None:
+            continue
+        row = [day.isoformat()] + [str(v) for v in current]
+        if compare:
+            before = [daily_value(shop_domain, m, day - timedelta(days=length), today_extra) for m in metrics]
+            row += [None if b is None else str(b) for b in before]
+            if percent:
+                row += [None if not b else f"{(c - b) / b * 100:.2f}" for c, b in zip(current, before)]
+        rows.append(row)
+    if re.search(r"ORDER BY day DESC", query):
+        rows.reverse()
+    limit = re.search(r"\bLIMIT\s+(\d+)", query)
+    if limit:
+        rows = rows[:int(limit.group(1))]
+    data = {"data": {"shopifyqlQuery": {"tableData": {"columns": columns, "rows": rows}, "parseErrors": []}}}
+    return data, length * (2 if compare else 1)
+
+
+# Order lines behind grouped `FROM sales` reports: (dimensions, measures)
+SALES_LINE_DIMENSIONS = ("product_title", "product_vendor", "product_type", "product_variant_title",
+                         "product_variant_sku", "line_type")
+SALES_LINE_MEASURES = ("quantity_ordered", "quantity_returned", "net_items_sold", "gross_sales", "discounts",
+                       "returns", "net_sales", "taxes", "total_sales")
+# Ratio measures, recomputed from summed parts: name -> (numerator, denominator)
+SALES_LINE_RATIOS = {"returned_quantity_rate": ("quantity_returned", "quantity_ordered")}
+_CATALOGUE_PRODUCTS = 30
+
+
+def _catalogue():
+    # 30 products, 1-3 variants each, across 4 vendors and 3 types
+    lines = []
+    for p in range(_CATALOGUE_PRODUCTS):
+        for v in range(p % 3 + 1):
+            lines.append({"product_title": f"Product {p:02d}", "product_vendor": f"Vendor {p % 4}",
+                          "product_type": ("Shirts", "Hats", "Mugs")[p % 3], "product_variant_title": f"Size {'SML'[v]}",
+                          "product_variant_sku": f"SKU-{p:02d}-{v}", "line_type": "product"})
+    lines.append({**lines[0], "product_title": "Gift Card", "product_variant_title": "Default",
+                  "product_variant_sku": None, "line_type": "gift_card"})
+    lines.append({"product_title": None, "product_vendor": None, "product_type": None,
+                  "product_variant_title": None, "product_variant_sku": None, "line_type": "shipping"})
+    return lines
+
+
+_SALES_LINES = _catalogue()
+_sales_day_cache = {}
+
+
+def sales_lines(shop_domain, day):
+    """The stub's order lines for one shop and day: (dimensions, measures) pairs."""
+    key = (shop_domain, day)
+    if key not in _sales_day_cache:
+        out = []
+        for dims in _SALES_LINES:
+            seed = f"{shop_domain}|{dims['product_variant_sku'] or dims['line_type']}|{day.isoformat()}"
+            if zlib.crc32(seed.encode()) % 3 == 0:
+                continue
+            h = zlib.crc32((seed + "|q").encode())
+            ordered = h % 9 + 1
+            returned = (h >> 8) % 3 if h % 4 == 0 else 0
+            gross = ordered * ((h >> 4) % 40 + 10)
+            discounts = gross * ((h >> 12) % 3) // 10
+            returns = returned * gross // ordered
+            net = gross - discounts - returns
+            taxes = net // 10
+            out.append((dims, {"quantity_ordered": ordered, "quantity_returned": returned,
+                               "net_items_sold": ordered - returned, "gross_sales": gross, "discounts": -discounts,
+                               "returns": -returns, "net_sales": net, "taxes": taxes, "total_sales": net + taxes}))
+        _sales_day_cache[key] = out
+    return _sales_day_cache[key]
+
+
+def _matches(dims, condition):
+    field, op, value = condition
+    cell = dims.get(field)
+    if op == "IS NULL":
+        return cell is None
+    if op == "IS NOT NULL":
+        return cell is not None
+    if cell is None:
+        return False
+    if op == "=":
+        return cell == value
+    if op == "!=":
+        return cell != value
+    if op == "CONTAINS":
+        return value.lower() in cell.lower()
+    if op == "STARTS WITH":
+        return cell.lower().startswith(value.lower())
+    return cell.lower().endswith(value.lower())
+
+
+def _grouped_totals(shop_domain, since, until, conditions, group_by):
+    totals = {}
+    for i in range((until - since).days + 1):
+        for dims, values in sales_lines(shop_domain, since + timedelta(days=i)):
+            if all(_matches(dims, c) for c in conditions):
+                key = tuple(dims[d] for d in group_by)
+                acc = totals.setdefault(key, dict.fromkeys(SALES_LINE_MEASURES, 0))
+                for m, v in values.items():
+                    acc[m] += v
+    return totals
+
+
+def _measure(acc, name):
+    if acc is None:
+        return None
+    if name in SALES_LINE_RATIOS:
+        num, den = SALES_LINE_RATIOS[name]
+        return acc[num] / acc[den] if acc[den] else None
+    return acc[name]
+
+
+def grouped_sales(shop_domain, query):
+    """Table for a grouped ``FROM sales`` query over product dimensions, or None.
+
+    Aggregates ``sales_lines`` row by row for SINCE..UNTIL: WHERE with
+    ANDed conditions on the dimensions (=, !=, IS [NOT] NULL, CONTAINS,
+    STARTS/ENDS WITH, case-insensitive), GROUP BY, ORDER BY (ties broken by
+    the group-by values, ascending) and LIMIT. With ``COMPARE TO
+    previous_period`` rows carry ``<measure>__previous_period`` (and
+    ``__percent_change`` with PERCENT_CHANGE) from the preceding window.
+    Returns None for anything else, which gets a synthetic table instead.
+    """
+    clauses = {}
+    for keyword, text in re.findall(r"^(FROM|SHOW|WHERE|GROUP BY|TIMESERIES|SINCE|COMPARE TO|ORDER BY|LIMIT|VISUALIZE)\b(.*)$", query, re.M):
+        clauses[keyword] = text.strip()
+    if clauses.get("FROM") != "sales" or "GROUP BY" not in clauses or "TIMESERIES" in clauses:
+        return None
+    group_text, _, modifiers = clauses["GROUP BY"].partition(" WITH ")
+    group_by = [g.strip() for g in group_text.split(",")]
+    show = [c.strip() for c in clauses.get("SHOW", "").split(",") if c.strip()]
+    if not set(group_by) <= set(SALES_LINE_DIMENSIONS) or not set(show) <= set(SALES_LINE_MEASURES) | set(SALES_LINE_RATIOS):
+        return None
+    conditions = []
+    for text in filter(None, re.split(r" AND (?=[a-z_]+ )", clauses.get("WHERE", ""))):
+        m = re.fullmatch(r"([a-z_]+) (IS NOT NULL|IS NULL|!=|=|CONTAINS|STARTS WITH|ENDS WITH) ?(?:'((?:[^'\\]|\\.)*)')?", text)
+        if not m:
+            return None
+        conditions.append((m.group(1), m.group(2), re.sub(r"\\(.)", r"\1", m.group(3) or "")))
+    window = re.fullmatch(r"(\S+) UNTIL (\S+)", clauses.get("SINCE", ""))
+    today = date.today()
+    since, until = (_stub_date(window.group(1), today), _stub_date(window.group(2), today)) if window else (None, None)
+    if not since or not until:
+        return None
+
+    compare = clauses.get("COMPARE TO") == "previous_period"
+    percent = compare and "PERCENT_CHANGE" in modifiers
+    length = (until - since).days + 1
+    current = _grouped_totals(shop_domain, since, until, conditions, group_by)
+    previous = _grouped_totals(shop_domain, since - timedelta(days=length), since - timedelta(days=1), conditions, group_by) if compare else {}
+    rows = []
+    for key in sorted(current, key=lambda k: [v or "" for v in k]):
+        row = list(key) + [_measure(current[key], m) for m in show]
+        if compare:
+            before = [_measure(previous.get(key), m) for m in show]
+            row += before
+            if percent:
+                row += [None if not b else f"{(c - b) / b * 100:.2f}" for c, b in zip(row[len(key):len(key) + len(show)], before)]
+        rows.append(row)
+    for spec in reversed([o.strip() for o in clauses.get("ORDER BY", "").split(",") if o.strip()]):
+        name, _, direction = spec.partition(" ")
+        i = (group_by + show).index(name)
+        rows.sort(key=lambda r: (r[i] is not None, r[i] if r[i] is not None else 0) if name in show else r[i] or "",
+                  reverse=direction == "DESC")
+    if clauses.get("LIMIT"):
+        rows = rows[:int(clauses["LIMIT"])]
+
+    columns = [{"name": d, "dataType": "STRING", "displayName": d} for d in group_by]
+    columns += [{"name": m, "dataType": "PERCENT" if m in SALES_LINE_RATIOS else "NUMBER", "displayName": m} for m in show]
+    if compare:
+        columns += [{"name": f"{m}__previous_period", "dataType": "PERCENT" if m in SALES_LINE_RATIOS else "NUMBER",
+                     "displayName": f"{m} (previous period)"} for m in show]
+    if percent:
+        columns += [{"name": f"{m}__percent_change", "dataType": "PERCENT", "displayName": f"{m} (% change)"} for m in show]
+    return {"data": {"shopifyqlQuery": {"tableData": {"columns": columns, "rows": rows}, "parseErrors": []}}}
+
+
+def make_stub_app(shopify_latency=0.05, llm_latency=0.2, rows=30, token_delay=0.02, llm_latency_per_kb=0.0,
+                  throttle_bucket=None, throttle_restore=50.0, query_cost=10, jitter=0.0,
+                  shopify_error_rate=0.0, llm_error_rate=0.0, answer_bytes=0, seed=0, gzip=False):
+    """Build the stub app.
+
+    Latencies are scaled by a uniform random factor in ``1 ± jitter``.
+    ``shopify_error_rate`` / ``llm_error_rate`` are the shares of calls that
+    fail with HTTP 503 / 500 (counted as ``shopify_errors`` / ``llm_errors``).
+    ``answer_bytes`` pads explain answers to about that size. Randomness is
+    seeded with ``seed``, so a replay sees the same draws in the same order.
+
+    With ``throttle_bucket`` set, every shop gets a Shopify-style leaky
+    bucket of that many cost points refilling at ``throttle_restore`` per
+    second; each query costs ``query_cost`` and responses carry
+    ``extensions.cost``. Queries that do not fit get Shopify's THROTTLED
+    error instead of data.
+
+    The chat endpoint answers the parser, ShopifyQL and explain prompts
+    (counted separately as ``llm_parse``, ``llm_sql`` and ``llm_explain``);
+    the parser maps questions mentioning "custom" to an intent with no
+    predefined query, so they go on to ShopifyQL generation.
+
+    Ungrouped ``TIMESERIES day`` queries get date-accurate rows from
+    ``daily_series`` and grouped ``FROM sales`` queries over product
+    dimensions are aggregated from ``sales_lines`` (``grouped_sales``).
+    ``POST /_today?add=N`` adds N to every daily metric for today, like
+    orders arriving between two requests.
+
+    A shop named like "slow-5s.example" answers after that many seconds,
+    "down.example" always fails with HTTP 503 and "html.example" with an
+    HTML 502 page, as from a proxy. ``connections`` counts
+    the distinct client connections seen, so a client that re-handshakes
+    per request shows one per call. With ``gzip`` set, responses are
+    gzip-compressed for clients that accept it. ``max_shop_in_flight`` is
+    the most Shopify queries seen in flight at once for any one shop.
+    """
+    app = FastAPI()
+    if gzip:
+        from starlette.middleware.gzip import GZipMiddleware
+        app.add_middleware(GZipMiddleware, minimum_size=500)
+    calls = {"shopify": 0, "llm": 0, "llm_parse": 0, "llm_sql": 0, "llm_explain": 0, "throttled": 0, "days": 0,
+             "shopify_errors": 0, "llm_errors": 0, "connections": 0, "max_shop_in_flight": 0}
+    peers = set()
+    in_flight = {}
+    today_extra = {"value": 0}
+    buckets = {}
+    rng = random.Random(seed)
+
+    def delay(seconds):
+        return asyncio.sleep(seconds * rng.uniform(1 - jitter, 1 + jitter) if jitter else seconds)
+
+    def charge(shop_domain):
+        # Returns (admitted, extensions) for one query against the shop's bucket
+        now = time.monotonic()
+        available, updated = buckets.get(shop_domain, (float(throttle_bucket), now))
+        available = min(float(throttle_bucket), available + (now - updated) * throttle_restore)
+        admitted = available >= query_cost
+        if admitted:
+            available -= query_cost
+        buckets[shop_domain] = (available, now)
+        return admitted, {"cost": {
+            "requestedQueryCost": query_cost,
+            "actualQueryCost": query_cost if admitted else None,
+            "throttleStatus": {
+                "maximumAvailable": float(throttle_bucket),
+                "currentlyAvailable": int(available),
+                "restoreRate": float(throttle_restore)
+            }
+        }}
+
+    @app.get("/_stats")
+    async def stats(reset: bool = False):
+        """Upstream calls served so far; `?reset=true` zeroes the counters."""
+        out = dict(calls)
+        if reset:
+            calls.update(dict.fromkeys(calls, 0))
+            peers.clear()
+        return out
+
+    def count_connection(request):
+        peer = (request.client.host, request.client.port) if request.client else None
+        if peer not in peers:
+            peers.add(peer)
+            calls["connections"] += 1
+
+    @app.post("/_today")
+    async def add_today(add: int = 1):
+        today_extra["value"] += add
+        return today_extra
+
+    @app.post("/{shop_domain}/graphql.json")
+    async def shopify(shop_domain: str, request: Request):
+        in_flight[shop_domain] = in_flight.get(shop_domain, 0) + 1
+        calls["max_shop_in_flight"] = max(calls["max_shop_in_flight"], in_flight[shop_domain])
+        try:
+            return await shopify_query(shop_domain, request)
+        finally:
+            in_flight[shop_domain] -= 1
+
+    async def shopify_query(shop_domain, request):
+        calls["shopify"] += 1
+        count_connection(request)
+        body = await request.json()
+        slow = re.match(r"slow-(\d+(?:\.\d+)?)s\b", shop_domain)
+        if slow:
+            await asyncio.sleep(float(slow.group(1)))
+        if shop_domain.startswith("down."):
+            calls["shopify_errors"] += 1
+            return JSONResponse({"errors": [{"message": "Service Unavailable"}]}, status_code=503)
+        if shop_domain.startswith("html."):
+            calls["shopify_errors"] += 1
+            return HTMLResponse("<html><body><h1>502 Bad Gateway</h1></body></html>", status_code=502)
+        extensions = None
+        if throttle_bucket is not None:
+            admitted, extensions = charge(shop_domain)
+            if not admitted:
+                calls["throttled"] += 1
+                return {"errors": [{"message": "Throttled", "extensions": {"code": "THROTTLED"}}], "extensions": extensions}
+        await delay(shopify_latency)
+        if shopify_error_rate and rng.random() < shopify_error_rate:
+            calls["shopify_errors"] += 1
+            return JSONResponse({"errors": [{"message": "Service Unavailable"}]}, status_code=503)
+        query = ((body.get("variables") or {}).get("query") or body.get("query", "")).replace('\\"', '"')
+        # A shop named like "rows-50000.example" gets that many rows, and
+        # "rows-50000-keys-100.example" repeats only 100 distinct dimension values
+        m = re.match(r"rows-(\d+)(?:-keys-(\d+))?\b", shop_domain)
+        n = int(m.group(1)) if m else rows
+        keys = int(m.group(2)) if m and m.group(2) else None
+        series = None if m else daily_series(shop_domain, query, today_extra["value"])
+        grouped = None if m or series is not None else grouped_sales(shop_domain, query)
+        if grouped is not None:
+            if extensions:
+                grouped["extensions"] = extensions
+            return grouped
+        if series is not None:
+            data, days = series
+            calls["days"] += days
+            if extensions:
+                data["extensions"] = extensions
+            return data
+        if n > STREAM_ROWS_ABOVE:
+            return StreamingResponse(synthetic_table_chunks(query, n, keys, extensions=extensions), media_type="application/json")
+        data = synthetic_table(query, n, keys)
+        if extensions:
+            data["extensions"] = extensions
+        return data
+
+    @app.post("/v1/chat/completions")
+    async def chat(request: Request):
+        calls["llm"] += 1
+        count_connection(request)
+        raw = await request.body()
+        body = json.loads(raw)
+        # Prompt processing time grows with prompt size, like a real model
+        await delay(llm_latency + llm_latency_per_kb * len(raw) / 1024)
+        if llm_error_rate and rng.random() < llm_error_rate:
+            calls["llm_errors"] += 1
+            return JSONResponse({"error": {"message": "The server had an error", "type": "server_error"}}, status_code=500)
+        system = body["messages"][0]["content"]
+        user = body["messages"][-1]["content"]
+        batch = "BATCH MODE" in system
+        if "query parser" in system:
+            calls["llm_parse"] += 1
+            intent = "custom_breakdown" if "custom" in user.lower() else "total_sales_over_time"
+            parsed = {"intent": intent, "since": "startOfDay(-30d)", "until": "today"}
+            n = len(re.findall(r"^\d+\. ", user, re.M))
+            content = json.dumps({"results": [parsed] * n} if batch else parsed)
+        elif "ShopifyQL expert" in system:
+            calls["llm_sql"] += 1
+            content = "FROM sales SHOW product_title, total_sales GROUP BY product_title SINCE -30d ORDER BY total_sales DESC LIMIT 5"
+        else:
+            calls["llm_explain"] += 1
+            answer = "Your total sales are ₹12,450 over the last 30 days, led by product_title-0."
+            if answer_bytes > len(answer):
+                answer += " Sales held steady through the period." * ((answer_bytes - len(answer)) // 38)
+            n = len(re.findall(r"^### Question \d+:", user, re.M))
+            content = json.dumps({"answers": [answer] * n}) if batch else answer
+        if body.get("stream"):
+            return StreamingResponse(_stream_tokens(content, token_delay), media_type="text/event-stream")
+        return {"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}]}
+
+    return app
+
+
+async def _stream_tokens(content, token_delay):
+    for word in re.findall(r"\S+\s*", content):
+        chunk = {"choices": [{"index": 0, "delta": {"content": word}}]}
+        yield f"data: {json.dumps(chunk)}\n\n"
+        await asyncio.sleep(token_delay)
+    yield "data: [DONE]\n\n"
+
+
+def _serve(port, options, tls):
+    certfile, keyfile = tls or (None, None)
+    uvicorn.run(make_stub_app(**options), host="127.0.0.1", port=port, log_level="warning",
+                ssl_certfile=certfile, ssl_keyfile=keyfile)
+
+
+def make_tls_cert(directory):
+    """Write a self-signed certificate for 127.0.0.1 with openssl. Returns ``(certfile, keyfile)``.
+
+    Point ``SSL_CERT_FILE`` at the certificate for httpx to trust it.
+    """
+    certfile, keyfile = os.path.join(directory, "stub-cert.pem"), os.path.join(directory, "stub-key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=127.0.0.1",
+         "-addext", "subjectAltName=IP:127.0.0.1,DNS:localhost", "-keyout", keyfile, "-out", certfile],
+        check=True, capture_output=True
+    )
+    return certfile, keyfile
+
+
+def start_stub_server(tls=None, **options):
+    """Start the stubs in a child process. Returns ``(process, base_url)``.
+
+    ``tls=(certfile, keyfile)`` serves HTTPS (see ``make_tls_cert``).
+    """
+    port = free_port()
+    proc = multiprocessing.Process(target=_serve, args=(port, options, tls), daemon=True)
+    proc.start()
+    wait_for_port(port)
+    return proc, f"{'https' if tls else 'http'}://127.0.0.1:{port}"
+
+
+class RespStandIn:
+    """In-memory Redis-protocol server with the commands the shared cache uses.
+
+    GET, SET (EX/PX/NX), DEL, EXISTS, KEYS, PING, SELECT, DBSIZE and FLUSHDB,
+    with lazy expiry, and EVAL of the cache's compare-and-delete lock
+    release (the only script it knows). ``commands`` counts what was served, by name; the
+    extra ``_STATS`` command returns those counts as JSON.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.commands = {}
+
+    def _live(self, key):
+        entry = self.data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+            del self.data[key]
+            return None
+        return entry
+
+    def run(self, args):
+        name = args[0].decode().upper()
+        self.commands[name] = self.commands.get(name, 0) + 1
+        keys = [a.decode() for a in args[1:]]
+        if name == "PING":
+            return "+PONG"
+        if name in ("SELECT", "AUTH"):
+            return "+OK"
+        if name == "GET":
+            entry = self._live(keys[0])
+            return entry[0] if entry else None
+        if name == "SET":
+            options = [k.upper() for k in keys[2:]]
+            if "NX" in options and self._live(keys[0]):
+                return None
+            expires = None
+            for unit, scale in (("EX", 1.0), ("PX", 0.001)):
+                if unit in options:
+                    expires = time.monotonic() + float(keys[2 + options.index(unit) + 1]) * scale
+            self.data[keys[0]] = (args[2], expires)
+            return "+OK"
+        if name == "DEL":
+            return sum(1 for k in keys if self._live(k) and self.data.pop(k))
+        if name == "EXISTS":
+            return sum(1 for k in keys if self._live(k))
+        if name == "EVAL":
+            if "== ARGV[1]" not in keys[0] or '"DEL"' not in keys[0]:
+                return "-ERR only the compare-and-delete lock release script is supported"
+            entry = self._live(keys[2])
+            if entry and entry[0].decode() == keys[3]:
+                del self.data[keys[2]]
+                return 1
+            return 0
+        if name == "KEYS":
+            return [k.encode() for k in list(self.data) if self._live(k) and fnmatch.fnmatchcase(k, keys[0])]
+        if name == "DBSIZE":
+            return len(self.data)
+        if name == "FLUSHDB":
+            self.data.clear()
+            return "+OK"
+        return f"-ERR unknown command '{name}'"
+
+
+def _resp_encode(reply):
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, int):
+        return f":{reply}\r\n".encode()
+    if isinstance(reply, str):
+        return (reply + "\r\n").encode()
+    if isinstance(reply, list):
+        return f"*{len(reply)}\r\n".encode() + b"".join(_resp_encode(r) for r in reply)
+    return f"${len(reply)}\r\n".encode() + reply + b"\r\n"
+
+
+def _serve_resp(port):
+    server = RespStandIn()
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                args = []
+                for _ in range(int(line[1:-2])):
+                    n = int((await reader.readline())[1:-2])
+                    args.append((await reader.readexactly(n + 2))[:-2])
+                if args[0].upper() == b"_STATS":
+                    reply = json.dumps(server.commands).encode()
+                else:
+                    reply = server.run(args)
+                writer.write(_resp_encode(reply))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def main():
+        async with await asyncio.start_server(handle, "127.0.0.1", port) as srv:
+            await srv.serve_forever()
+
+    asyncio.run(main())
+
+
+def start_resp_server():
+    """Start the Redis-protocol stand-in in a child process. Returns ``(process, url)``."""
+    port = free_port()
+    proc = multiprocessing.Process(target=_serve_resp, args=(port,), daemon=True)
+    proc.start()
+    wait_for_port(port)
+    return proc, f"redis://127.0.0.1:{port}/0"
+
+
+def stub_env(base_url):
+    """Environment overrides that point clients.py at a running stub server."""
+    return {
+        "SHOPIFY_GRAPHQL_URL": base_url + "/{shop_domain}/graphql.json",
+        "OPENAI_BASE_URL": base_url + "/v1",
+        "OPENAI_API_KEY": "stub"
+    }
@@ -0,0 +1,267 @@
+"""Bulk export of predefined reports across many shops.
+
+    python bulk_export.py --shops stores.csv --intents total_sales_over_time,top_product_variants_by_units_sold \
+        --since startOfDay(-30d) --until today --out exports/nightly.ndjson
+
+`--shops` is a CSV with `shop_domain` and `access_token` columns, or JSON
+lines with the same keys (e.g. the Rails `Store` table). Rerunning the same
+command resumes from the checkpoint; `--restart` starts over.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import time
+from datetime import date
+from types import SimpleNamespace
+
+from metrics import REGISTRY, stage, trace_request
+
+EXPORT_JOBS = REGISTRY.counter(
+    "export_jobs_total", "Bulk export shop × report jobs, by outcome.", ("outcome",)
+)
+
+
+class ExportArgumentError(ValueError):
+    """Intents or a window the export cannot run with, as opposed to a failure while running."""
+
+
+def export_intents():
+    from agent import AnalyticsAgent
+    return set(AnalyticsAgent.TEMPLATES) | {"reorder_forecast"}
+
+
+def check_intents(intents):
+    unknown = sorted(set(intents) - export_intents())
+    if not intents or unknown:
+        raise ExportArgumentError(f"unknown report intents {unknown}" if unknown else "no report intents given")
+    return list(dict.fromkeys(intents))
+
+
+class BulkExport:
+    """Runs report intents for many shops and appends the results to an NDJSON file.
+
+    `workers` workers take shops from a queue; each runs one shop's reports
+    at a time, at most `per_shop` at once, so a shop's reports share its
+    cached base pulls and rollups and no shop sees more than `per_shop`
+    queries from the export. The shop's scheduler and circuit breaker apply
+    on top, as for `/ask`.
+
+    Every finished report is one line in `path` (shop, intent, window,
+    query, columns and rows; with `explain` an answer too, and only the
+    answer for reorder_forecast). After each line, `<path>.checkpoint` gets the job's outcome
+    and the output's length. A rerun skips the reports already written,
+    retries the failed ones and cuts off anything written after the last
+    checkpoint. Relative windows are resolved to dates once and kept in the
+    checkpoint, so a resumed export covers the same days.
+    """
+
+    def __init__(self, agent, path, workers=16, per_shop=2, explain=False):
+        self.agent = agent
+        self.path = path
+        self.checkpoint_path = path + ".checkpoint"
+        self.workers = workers
+        self.per_shop = per_shop
+        self.explain = explain
+        self.task = None
+        self.stats = {"jobs": 0, "skipped": 0, "done": 0, "failed": 0}
+        self.started = self.finished = None
+        self.error = None
+
+    def start(self, shops, intents, since="startOfDay(-30d)", until="today", resume=True):
+        """Run the export in the background; `status()` reports progress."""
+        self.task = asyncio.create_task(self.run(shops, intents, since, until, resume))
+        # Failures are reported by status(), not as an unretrieved task exception
+        self.task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return self.task
+
+    def status(self):
+        if self.error:
+            state = "failed"
+        elif self.task is not None and self.task.cancelled():
+            state = "cancelled"
+        else:
+            state = "done" if self.finished else "running"
+        elapsed = ((self.finished or time.perf_counter()) - self.started) if self.started else 0.0
+        finished = self.stats["done"] + self.stats["failed"]
+        return {
+            "state": state, **self.stats, "path": self.path,
+            "elapsed_s": round(elapsed, 1), "jobs_per_s": round(finished / elapsed, 1) if elapsed else 0.0,
+            "error": self.error
+        }
+
+    async def run(self, shops, intents, since="startOfDay(-30d)", until="today", resume=True):
+        """Export every (shop, intent) not already in the checkpoint. Returns the stats."""
+        intents = check_intents(intents)
+        shops = list({s["shop_domain"]: s for s in shops}.values())
+        self.started = time.perf_counter()
+        try:
+            window, done = self._open(since, until, resume)
+            pending = {}
+            for shop in shops:
+                todo = [i for i in intents if (shop["shop_domain"], i) not in done]
+                if todo:
+                    pending[shop["shop_domain"]] = (shop, todo)
+            jobs = len(shops) * len(intents)
+            self.stats.update(jobs=jobs, skipped=jobs - sum(len(todo) for _, todo in pending.values()))
+            print(f"📦 Export {os.path.basename(self.path)}: {self.stats['jobs']} jobs, {self.stats['skipped']} already done, "
+                  f"{window['since']}..{window['until']}")
+
+            queue = asyncio.Queue()
+            for item in pending.values():
+                queue.put_nowait(item)
+            with open(self.path, "a", encoding="utf-8") as out, open(self.checkpoint_path, "a", encoding="utf-8") as checkpoint:
+                async def worker():
+                    while not queue.empty():
+                        shop, todo = queue.get_nowait()
+                        sem = asyncio.Semaphore(self.per_shop)
+
+                        async def job(intent):
+                            async with sem:
+                                record, error = await self._report(shop, intent, window)
+                            self._write(out, checkpoint, shop["shop_domain"], intent, record, error)
+
+                        await asyncio.gather(*(job(i) for i in todo))
+
+                await asyncio.gather(*(worker() for _ in range(min(self.workers, len(pending)))))
+        except Exception as e:
+            self.error = str(e)
+            raise
+        finally:
+            self.finished = time.perf_counter()
+        status = self.status()
+        print(f"✅ Export {os.path.basename(self.path)}: {status['done']} written, {status['failed']} failed "
+              f"in {status['elapsed_s']}s ({status['jobs_per_s']} jobs/s)")
+        return status
+
+    def _open(self, since, until, resume):
+        """Resolve the window and read the checkpoint. Returns (window, {(shop, intent) done})."""
+        from rollup_store import resolve_date
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        header, entries, done, offset = None, [], set(), 0
+        if resume and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line cut short by a crash; nothing after it was checkpointed
+                        break
+                    if "window" in entry:
+                        header = entry
+                        continue
+                    entries.append(entry)
+                    offset = entry["offset"]
+                    if entry["ok"]:
+                        done.add((entry["shop"], entry["intent"]))
+        if header is not None:
+            window = header["window"]
+            requested = {"since": since, "until": until}
+            if requested not in (window, header["requested"]):
+                raise ExportArgumentError(f"{self.checkpoint_path} is for {header['requested']}, not {requested}; "
+                                          f"use another output path or restart")
+        else:
+            # Relative dates are pinned so a resumed export covers the same days
+            today = date.today()
+            window = {k: (resolve_date(v, today).isoformat() if resolve_date(v, today) else v)
+                      for k, v in (("since", since), ("until", until))}
+            header = {"window": window, "requested": {"since": since, "until": until}}
+        # Whatever was written after the last checkpoint is rewritten
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.truncate(offset)
+        with open(self.checkpoint_path, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(e) + "\n" for e in [header] + entries)
+        return window, done
+
+    async def _report(self, shop, intent, window):
+        """Run one report. Returns (record, error message)."""
+        req = SimpleNamespace(
+            shop_domain=shop["shop_domain"], access_token=shop["access_token"],
+            question=intent.replace("_", " ")
+        )
+        params = {"intent": intent, **window}
+        record = {"shop": req.shop_domain, "intent": intent, **window}
+        try:
+            with trace_request("export") as trace:
+                trace.intent = self.agent._intent_label(intent)
+                trace.origin = "predefined"
+                if intent == "reorder_forecast":
+                    result = await self.agent.handle_reorder_forecast(req, params)
+                    if result["confidence"] == "low" or result["answer"].startswith(("Shopify API Error:", "Query Error:")):
+                        return None, result["answer"]
+                    # The forecast reads its own history window, not the export's
+                    return {"shop": req.shop_domain, "intent": intent, "answer": result["answer"]}, None
+                with stage("build"):
+                    query, origin = await self.agent.build_query(req, params)
+                data, error = await self.agent.run_query(req, query, origin)
+                if error:
+                    return None, error["answer"]
+                table = data["data"]["shopifyqlQuery"]["tableData"]
+                record.update(query=query, columns=table["columns"], rows=table["rows"])
+                if self.explain:
+                    record["answer"] = await self.agent.explain(data, req.question, intent)
+                return record, None
+        except Exception as e:
+            return None, f"{type(e).__name__}: {e}"
+
+    def _write(self, out, checkpoint, shop_domain, intent, record, error):
+        if record is not None:
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+        entry = {"shop": shop_domain, "intent": intent, "ok": error is None, "offset": out.tell()}
+        if error is not None:
+            entry["error"] = error[:500]
+        checkpoint.write(json.dumps(entry) + "\n")
+        checkpoint.flush()
+        outcome = "done" if error is None else "failed"
+        self.stats[outcome] += 1
+        EXPORT_JOBS.inc(outcome=outcome)
+
+
+def read_shops(path):
+    """[{shop_domain, access_token}] from a CSV with a header row or a JSON lines file."""
+    with open(path, encoding="utf-8") as f:
+        if path.endswith((".jsonl", ".ndjson", ".json")):
+            shops = [json.loads(line) for line in f if line.strip()]
+        else:
+            shops = list(csv.DictReader(f))
+    return [{"shop_domain": s["shop_domain"], "access_token": s["access_token"]} for s in shops]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export predefined reports for many shops to NDJSON.")
+    parser.add_argument("--shops", required=True, help="CSV or JSON lines with shop_domain and access_token")
+    parser.add_argument("--intents", required=True, help="comma-separated report intents")
+    parser.add_argument("--since", default="startOfDay(-30d)")
+    parser.add_argument("--until", default="today")
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("EXPORT_WORKERS", "16")))
+    parser.add_argument("--per-shop", type=int, default=int(os.getenv("EXPORT_PER_SHOP", "2")))
+    parser.add_argument("--explain", action="store_true", help="add an answer to every report")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start over")
+    args = parser.parse_args()
+
+    from agent import AnalyticsAgent
+    from clients import close_http_client
+
+    async def run():
+        agent = AnalyticsAgent()
+        export = BulkExport(agent, args.out, args.workers, args.per_shop, args.explain)
+        try:
+            return await export.run(read_shops(args.shops), args.intents.split(","), args.since, args.until,
+                                    resume=not args.restart)
+        finally:
+            await agent.close()
+            await close_http_client()
+
+    try:
+        status = asyncio.run(run())
+    except ExportArgumentError as e:
+        parser.error(str(e))
+    raise SystemExit(1 if status["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
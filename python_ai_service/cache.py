@@ -0,0 +1,360 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import date
+
+from metrics import COALESCED
+from resp_client import RespClient, RespError
+
+_SINCE_RE = re.compile(r"\bSINCE\s+(\S+)", re.IGNORECASE)
+_UNTIL_RE = re.compile(r"\bUNTIL\s+(\S+)", re.IGNORECASE)
+_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+# Deletes the lock only while it still holds our token, so a holder whose
+# PX expired cannot release the next holder's lock
+_RELEASE_LOCK = 'if redis.call("GET", KEYS[1]) == ARGV[1] then return redis.call("DEL", KEYS[1]) end return 0'
+
+
+def normalize_query(query):
+    return " ".join((query or "").split())
+
+
+class _Broadcast:
+    """Items of one async iterator, replayed to any number of followers."""
+
+    def __init__(self):
+        self.items = []
+        self.done = False
+        self.error = None
+        self._changed = asyncio.Event()
+
+    async def pump(self, items):
+        try:
+            async for item in items:
+                self.items.append(item)
+                self._wake()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._wake()
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self):
+        i = 0
+        while True:
+            while i < len(self.items):
+                yield self.items[i]
+                i += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into one.
+
+    The first caller's `fn()` runs as its own task and everyone asking for
+    the key meanwhile awaits that task, so a caller that gives up (e.g. a
+    disconnected client) does not cancel the work for the others. `stream`
+    does the same for async generators. With a `name`, joins are counted
+    in agent_coalesced_total under that stage.
+    """
+
+    def __init__(self, name=None):
+        self.name = name
+        self._inflight = {}
+        self._streams = {}
+        self.coalesced = 0
+
+    def _joined(self):
+        self.coalesced += 1
+        if self.name:
+            COALESCED.inc(stage=self.name)
+
+    async def do(self, key, fn):
+        task = self._inflight.get(key)
+        if task is not None:
+            self._joined()
+        else:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # retrieved here so an unawaited failure is not logged
+
+    async def stream(self, key, make):
+        """Iterate `make()` once per key; concurrent callers replay the same items as they arrive."""
+        flight = self._streams.get(key)
+        if flight is not None:
+            self._joined()
+        else:
+            flight = self._streams[key] = _Broadcast()
+            task = asyncio.ensure_future(flight.pump(make()))
+            task.add_done_callback(lambda t: self._streams.pop(key) if self._streams.get(key) is flight else None)
+        async for item in flight.follow():
+            yield item
+
+
+class ResultCache(ABC):
+    """Interface of the Shopify result cache backends.
+
+    Entries are keyed by shop domain plus whitespace-normalized ShopifyQL.
+    Queries over a closed historical range (absolute SINCE and an UNTIL date
+    before today) keep for `historical_ttl` seconds; anything relative to
+    today (`startOfDay(-30d)`, `today`, `-7d`, ...) keeps for `relative_ttl`.
+    `coalesce(shop, query, fetch)` runs `fetch()` once for concurrent
+    misses on the same key; `fetch` is expected to `put` what it gets.
+    Backends implement `get`, `put` and `clear`.
+    """
+
+    def __init__(self, relative_ttl=300, historical_ttl=86400):
+        self.relative_ttl = relative_ttl
+        self.historical_ttl = historical_ttl
+        self.hits = 0
+        self.misses = 0
+        self._flights = SingleFlight()
+
+    def ttl_for(self, query):
+        since = _SINCE_RE.search(query)
+        until = _UNTIL_RE.search(query)
+        if since and until and _DATE_RE.match(since.group(1)) and _DATE_RE.match(until.group(1)):
+            if date.fromisoformat(until.group(1)) < date.today():
+                return self.historical_ttl
+        return self.relative_ttl
+
+    @abstractmethod
+    async def get(self, shop_domain, query):
+        """The cached value, or None on a miss."""
+
+    @abstractmethod
+    async def put(self, shop_domain, query, value, size, ttl=None):
+        """Store `value`; `ttl` overrides the window-based lifetime."""
+
+    @abstractmethod
+    async def clear(self):
+        """Drop every entry."""
+
+    async def close(self):
+        """Release the backend's connections; the in-process one has none."""
+
+    async def coalesce(self, shop_domain, query, fetch, cached=None):
+        """Single-flight `fetch()` per key; `cached` maps a value found in the cache to fetch's shape."""
+        return await self._flights.do((shop_domain, normalize_query(query)), fetch)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "coalesced": self._flights.coalesced}
+
+
+class QueryResultCache(ResultCache):
+    """In-process LRU backend, the default for a single worker.
+
+    Least recently used entries are evicted once `max_bytes` is exceeded.
+    Concurrent misses for the same query within the process share one fetch.
+    """
+
+    def __init__(self, relative_ttl=300, historical_ttl=86400, max_bytes=64 * 1024 * 1024):
+        super().__init__(relative_ttl, historical_ttl)
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.evictions = 0
+
+    async def get(self, shop_domain, query):
+        key = (shop_domain, normalize_query(query))
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, size, value = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    async def put(self, shop_domain, query, value, size, ttl=None):
+        if size > self.max_bytes:
+            return
+        key = (shop_domain, normalize_query(query))
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + (ttl or self.ttl_for(key[1])), size, value)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    async def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self):
+        return {
+            **super().stats(),
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "evictions": self.evictions
+        }
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+
+def _encode(value):
+    # JSON with NumPy arrays tagged, so per-SKU totals survive the round trip.
+    # Without NumPy loaded there can be no arrays, and no reason to load it.
+    np = sys.modules.get("numpy")
+    if np is not None and isinstance(value, np.ndarray):
+        return {"__ndarray__": value.dtype.str if value.dtype != object else "object", "values": value.tolist()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _encode(v) for k, v in value.items()}
+    return value
+
+
+def _decode(value):
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    if isinstance(value, dict):
+        if "__ndarray__" in value:
+            import numpy as np
+            return np.array(value["values"], dtype=value["__ndarray__"])
+        return {k: _decode(v) for k, v in value.items()}
+    return value
+
+
+class SharedResultCache(ResultCache):
+    """Result cache in a Redis-protocol server, shared by workers and nodes.
+
+    Values are stored as JSON under `<prefix>:<shop>:<sha1 of query>` with
+    the window-based TTL; eviction is left to the server's maxmemory policy.
+    Misses are coalesced in-process first and then across workers with a
+    `SET NX PX` lock: the worker holding it checks the key once more, then
+    fetches and stores the result while the others poll for it, and fetch themselves only if the holder
+    goes away without storing anything (errors are not cached) or the lock
+    expires. If the server is unreachable every call degrades to a miss.
+    """
+
+    def __init__(self, url, prefix="autoshop", relative_ttl=300, historical_ttl=86400, lock_ttl=30.0, poll_interval=0.05):
+        super().__init__(relative_ttl, historical_ttl)
+        self.client = RespClient(url)
+        self.prefix = prefix
+        self.lock_ttl = lock_ttl
+        self.poll_interval = poll_interval
+        self.errors = 0
+        self.waited = 0
+
+    def _key(self, shop_domain, query):
+        digest = hashlib.sha1(normalize_query(query).encode()).hexdigest()
+        return f"{self.prefix}:{shop_domain}:{digest}"
+
+    async def _call(self, *args):
+        try:
+            return await self.client.execute(*args)
+        except (OSError, RespError, asyncio.TimeoutError) as e:
+            self.errors += 1
+            print(f"⚠️ Shared cache unavailable: {e!r}")
+            return None
+
+    async def _load(self, key):
+        raw = await self._call("GET", key)
+        return _decode(json.loads(raw)) if raw is not None else None
+
+    async def get(self, shop_domain, query):
+        value = await self._load(self._key(shop_domain, query))
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def put(self, shop_domain, query, value, size, ttl=None):
+        payload = json.dumps(_encode(value), separators=(",", ":"))
+        await self._call("SET", self._key(shop_domain, query), payload, "EX", ttl or self.ttl_for(normalize_query(query)))
+
+    async def clear(self):
+        keys = await self._call("KEYS", f"{self.prefix}:*")
+        if keys:
+            await self._call("DEL", *keys)
+
+    async def coalesce(self, shop_domain, query, fetch, cached=None):
+        key = self._key(shop_domain, query)
+        return await self._flights.do((shop_domain, normalize_query(query)), lambda: self._shared(key, fetch, cached))
+
+    async def _shared(self, key, fetch, cached):
+        lock = key + ":lock"
+        token = uuid.uuid4().hex
+        try:
+            acquired = await self.client.execute("SET", lock, token, "NX", "PX", int(self.lock_ttl * 1000))
+        except (OSError, RespError, asyncio.TimeoutError) as e:
+            self.errors += 1
+            print(f"⚠️ Shared cache unavailable: {e!r}")
+            return await fetch()
+        if acquired == "OK":
+            try:
+                # The previous holder may have stored the value and released
+                # the lock between our miss and our SET NX
+                value = await self._load(key)
+                if value is not None:
+                    self.hits += 1
+                    return cached(value) if cached else value
+                return await fetch()
+            finally:
+                await self._call("EVAL", _RELEASE_LOCK, 1, lock, token)
+
+        # Another worker is fetching this query; wait for its result
+        self.waited += 1
+        deadline = time.monotonic() + self.lock_ttl
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.poll_interval)
+            # Checked before the read: the holder stores its result before
+            # it releases, so a released lock means the read sees it
+            released = not await self._call("EXISTS", lock)
+            value = await self._load(key)
+            if value is not None:
+                self.hits += 1
+                return cached(value) if cached else value
+            if released:
+                break
+        return await fetch()
+
+    def stats(self):
+        return {**super().stats(), "waited": self.waited, "errors": self.errors}
+
+    async def close(self):
+        await self.client.close()
+
+
+def make_result_cache(prefix="autoshop", max_bytes=64 * 1024 * 1024):
+    """The backend selected by RESULT_CACHE_URL: unset for in-process, redis://... for shared.
+
+    `prefix` namespaces the shared backend's keys; `max_bytes` caps the
+    in-process one.
+    """
+    url = os.getenv("RESULT_CACHE_URL", "")
+    if url.startswith("redis://"):
+        print(f"🗄️ Shared result cache at {url.split('@')[-1]} ({prefix})")
+        return SharedResultCache(url, prefix=prefix)
+    return QueryResultCache(max_bytes=max_bytes)
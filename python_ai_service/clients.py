@@ -0,0 +1,129 @@
+import json
+import os
+from dotenv import load_dotenv
+from metrics import LLM_TOKENS, UPSTREAM_BYTES, UPSTREAM_REQUESTS
+
+load_dotenv()
+
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+SHOPIFY_GRAPHQL_URL = os.getenv(
+    "SHOPIFY_GRAPHQL_URL",
+    "https://{shop_domain}/admin/api/2025-10/graphql.json"
+)
+
+# Connection pools: one client per upstream service (Shopify, OpenAI), each
+# keeping connections to every host it talks to alive, so repeated queries
+# to a shop reuse one TLS session instead of re-handshaking per call.
+# HTTP_KEEPALIVE=0 closes every connection after its request.
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "100"))
+HTTP_KEEPALIVE = int(os.getenv("HTTP_KEEPALIVE", "20"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+# Longest wait for the next bytes of a response, per service; a shop that
+# stops answering fails the call instead of holding the request forever
+READ_TIMEOUTS = {
+    "shopify": float(os.getenv("SHOPIFY_READ_TIMEOUT", "30")),
+    "openai": float(os.getenv("OPENAI_READ_TIMEOUT", "60"))
+}
+# HTTP/2 is negotiated when the optional `h2` package is installed
+HTTP2 = os.getenv("HTTP2", "1") != "0"
+
+_http_clients = {}
+
+
+def _http2_available():
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def get_http_client(service="shopify"):
+    client = _http_clients.get(service)
+    if client is None or client.is_closed:
+        # Imported on first use so importing the service stays cheap
+        import httpx
+        # Responses are gzip-compressed when the server supports it
+        # (httpx sends Accept-Encoding and decodes transparently)
+        client = _http_clients[service] = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_KEEPALIVE),
+            timeout=httpx.Timeout(READ_TIMEOUTS[service], connect=HTTP_CONNECT_TIMEOUT),
+            http2=HTTP2 and _http2_available()
+        )
+    return client
+
+
+async def close_http_client():
+    for client in list(_http_clients.values()):
+        if not client.is_closed:
+            await client.aclose()
+    _http_clients.clear()
+
+
+def shopify_graphql_url(shop_domain):
+    return SHOPIFY_GRAPHQL_URL.format(shop_domain=shop_domain)
+
+
+def _openai_headers():
+    return {
+        "Authorization": f"Bearer {os.getenv('OPENAI_API_KEY', '')}",
+        "Content-Type": "application/json"
+    }
+
+
+def _count_llm_usage(request, usage, messages, completion):
+    UPSTREAM_BYTES.inc(len(request.content), service="openai", direction="out")
+    if usage:
+        LLM_TOKENS.inc(usage.get("prompt_tokens", 0), kind="prompt")
+        LLM_TOKENS.inc(usage.get("completion_tokens", 0), kind="completion")
+    else:
+        from digest import estimate_tokens
+        LLM_TOKENS.inc(sum(estimate_tokens(m["content"]) for m in messages), kind="prompt")
+        LLM_TOKENS.inc(estimate_tokens(completion), kind="completion")
+
+
+async def chat_completion(messages, model="gpt-4o-mini"):
+    response = await get_http_client("openai").post(
+        f"{OPENAI_BASE_URL}/chat/completions",
+        headers=_openai_headers(),
+        json={"model": model, "messages": messages}
+    )
+    UPSTREAM_REQUESTS.inc(service="openai", status=response.status_code)
+    response.raise_for_status()
+    body = response.json()
+    content = body["choices"][0]["message"]["content"]
+    UPSTREAM_BYTES.inc(response.num_bytes_downloaded, service="openai", direction="in")
+    _count_llm_usage(response.request, body.get("usage"), messages, content)
+    return content
+
+
+async def stream_chat_completion(messages, model="gpt-4o-mini"):
+    """Yield content deltas from a streamed chat completion (SSE)."""
+    async with get_http_client("openai").stream(
+        "POST",
+        f"{OPENAI_BASE_URL}/chat/completions",
+        headers=_openai_headers(),
+        json={
+            "model": model, "messages": messages, "stream": True,
+            "stream_options": {"include_usage": True}
+        }
+    ) as response:
+        UPSTREAM_REQUESTS.inc(service="openai", status=response.status_code)
+        response.raise_for_status()
+        parts, usage = [], None
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            payload = line[len("data:"):].strip()
+            if payload == "[DONE]":
+                break
+            chunk = json.loads(payload)
+            # With include_usage the last chunk has no choices, only usage
+            usage = chunk.get("usage") or usage
+            choices = chunk.get("choices") or [{}]
+            delta = choices[0].get("delta", {}).get("content")
+            if delta:
+                parts.append(delta)
+                yield delta
+        UPSTREAM_BYTES.inc(response.num_bytes_downloaded, service="openai", direction="in")
+        _count_llm_usage(response.request, usage, messages, "".join(parts))
@@ -0,0 +1,106 @@
+import csv
+import io
+import math
+import re
+
+import numpy as np
+
+from table import ColumnarTable
+
+# Measures that are ratios or averages are averaged, not summed, for totals.
+_AVERAGED_RE = re.compile(r"rate|percent|average|_per_|per_order|per_day")
+
+
+def estimate_tokens(text):
+    # ~4 characters per token for English/CSV text is close enough for budgeting
+    return len(text) // 4 + 1
+
+
+def _fmt(x):
+    # e.g. a ratio over a zero base
+    if not math.isfinite(x):
+        return "n/a"
+    if x == int(x) and abs(x) < 1e15:
+        return str(int(x))
+    return f"{x:.2f}"
+
+
+def _relevant_measures(measures, question, max_measures):
+    q = set(re.findall(r"[a-z]+", (question or "").lower()))
+    scored = sorted(
+        enumerate(measures),
+        key=lambda im: (-sum(1 for part in im[1].split("_") if part in q), im[0])
+    )
+    return [m for _, m in scored[:max_measures]]
+
+
+def summarize_result(data, question, token_budget=1500, max_measures=4, top_k=10):
+    """Reduce a shopifyqlQuery response to a compact text digest for the LLM.
+
+    Keeps only the measures most relevant to `question`, computes totals,
+    trend statistics for time series and top-k rows for grouped reports
+    locally, and appends a CSV sample of rows trimmed to fit `token_budget`.
+    """
+    table = ColumnarTable.from_shopifyql(data)
+    if not len(table):
+        return "No rows returned."
+
+    time_dims, dims, measures = table.classify()
+    measures = _relevant_measures(measures, question, max_measures)
+
+    lines = [f"rows: {len(table)}"]
+    if measures:
+        totals = []
+        for m in measures:
+            averaged = bool(_AVERAGED_RE.search(m))
+            agg = table[m].mean() if averaged else table[m].sum()
+            totals.append(f"{m}={_fmt(agg)}" + (" (avg)" if averaged else ""))
+        lines.append("totals: " + ", ".join(totals))
+
+    primary = measures[0] if measures else None
+    if time_dims and primary:
+        t = table[time_dims[0]]
+        for m in measures:
+            vals = table[m]
+            hi, lo = int(vals.argmax()), int(vals.argmin())
+            change = ((vals[-1] - vals[0]) / vals[0] * 100) if vals[0] else 0.0
+            lines.append(
+                f"trend {m}: first {_fmt(vals[0])} ({t[0]}), last {_fmt(vals[-1])} ({t[-1]}), "
+                f"min {_fmt(vals[lo])} ({t[lo]}), max {_fmt(vals[hi])} ({t[hi]}), "
+                f"mean {_fmt(vals.mean())}, change {change:+.1f}%"
+            )
+        order = np.arange(len(table))
+    elif primary:
+        order = np.argsort(-table[primary], kind="stable")
+        lines.append(f"top by {primary}:")
+    else:
+        order = np.arange(len(table))
+
+    header = "\n".join(lines)
+    keep = time_dims[:1] + dims + measures
+    k = len(order) if time_dims else min(top_k, len(order))
+    # Start near the budget using the width of one rendered row
+    row_tokens = estimate_tokens(_csv(table, keep, measures, order[:1]))
+    k = max(1, min(k, (token_budget - estimate_tokens(header)) // row_tokens))
+    while True:
+        sample = _sample(order, k) if time_dims else order[:k]
+        digest = header + "\n" + _csv(table, keep, measures, sample)
+        if estimate_tokens(digest) <= token_budget or k <= 1:
+            return digest
+        k = max(1, k // 2)
+
+
+def _sample(order, k):
+    # Evenly spaced rows across the series, always keeping first and last
+    if k >= len(order):
+        return order
+    return order[np.unique(np.linspace(0, len(order) - 1, k).round().astype(int))]
+
+
+def _csv(table, keep, measures, idx):
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    writer.writerow(keep)
+    cols = [[_fmt(v) for v in table[c][idx]] if c in measures else table[c][idx].tolist() for c in keep]
+    writer.writerows(zip(*cols))
+    return buf.getvalue().rstrip("\n")
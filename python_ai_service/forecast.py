@@ -0,0 +1,136 @@
+from datetime import date, timedelta
+from statistics import NormalDist
+
+import numpy as np
+
+
+def weekday_factors(sales, start, prior=7.0):
+    """Per-SKU multiplicative day-of-week factors, shape (n, 7), Monday first.
+
+    Each factor is the SKU's mean on that weekday over its overall daily
+    mean, shrunk toward 1 by `prior` units of demand, so slow sellers get a
+    flat week instead of noise. Factors average to 1 across the week.
+    """
+    n, days = sales.shape
+    if days < 28:
+        return np.ones((n, 7))
+    weekday = (start.weekday() + np.arange(days)) % 7
+    onehot = np.zeros((days, 7))
+    onehot[np.arange(days), weekday] = 1.0
+    counts = onehot.sum(axis=0)
+    by_day = sales @ onehot
+    overall = sales.sum(axis=1, keepdims=True) / days
+    factors = (by_day + prior) / (overall * counts + prior)
+    return factors / factors.mean(axis=1, keepdims=True)
+
+
+def damped_holt(series, alpha=0.2, beta=0.05, phi=0.9, warmup=7):
+    """Damped-trend exponential smoothing of every row of `series` at once.
+
+    Returns (level, trend, sigma): the state after the last day and the RMS
+    one-step-ahead error from day `warmup` on. One vector update per day,
+    so the cost is O(days) NumPy operations whatever the number of SKUs.
+    """
+    n, days = series.shape
+    level = series[:, :min(warmup, days)].mean(axis=1) if days else np.zeros(n)
+    trend = np.zeros(n)
+    sq_err = np.zeros(n)
+    for t in range(days):
+        predicted = level + phi * trend
+        err = series[:, t] - predicted
+        if t >= warmup:
+            sq_err += err * err
+        level = predicted + alpha * err
+        trend = phi * trend + alpha * beta * err
+    sigma = np.sqrt(sq_err / max(1, days - warmup))
+    return level, trend, sigma
+
+
+class ReorderForecaster:
+    """Multi-horizon demand forecast and reorder plan for a SKU x day sales matrix.
+
+    Sales are deseasonalized with `weekday_factors`, smoothed with
+    `damped_holt`, and projected per horizon with the weekday pattern put
+    back. Safety stock is z * sigma * sqrt(lead time) for the `service_level`
+    (sigma being the daily forecast error), and the reorder quantity for a
+    horizon tops stock up to the demand over lead time plus horizon, plus
+    safety stock. Lead times are `lead_time` days unless overridden per SKU
+    in `lead_times`. The 30-day horizon is always included; it is the one
+    answers plan for. Everything is computed on whole arrays: a single pass
+    over the days, then closed-form sums per horizon.
+    """
+
+    def __init__(self, horizons=(7, 30, 60, 90), lead_time=14, service_level=0.95,
+                 alpha=0.04, beta=0.05, phi=0.95, lead_times=None):
+        self.horizons = tuple(sorted(set(horizons) | {30}))
+        self.lead_time = lead_time
+        self.lead_times = dict(lead_times or {})
+        self.service_level = service_level
+        self.z = NormalDist().inv_cdf(service_level)
+        self.alpha = alpha
+        self.beta = beta
+        self.phi = phi
+
+    def lead_days(self, skus):
+        """Lead time per SKU, as an int array aligned with `skus`."""
+        lead = np.full(len(skus), self.lead_time, dtype=np.int64)
+        if self.lead_times:
+            for i, sku in enumerate(skus.tolist()):
+                if sku in self.lead_times:
+                    lead[i] = self.lead_times[sku]
+        return lead
+
+    def _future_weights(self, first_day, days):
+        # Row h (h = 0..days) sums, per weekday, the day counts and damped
+        # trend multipliers over the first h future days
+        steps = np.arange(1, days + 1)
+        weekday = (first_day.weekday() + steps - 1) % 7
+        damp = np.cumsum(self.phi ** steps)
+        counts = np.zeros((days + 1, 7))
+        trends = np.zeros((days + 1, 7))
+        counts[steps, weekday] = 1.0
+        trends[steps, weekday] = damp
+        return np.cumsum(counts, axis=0), np.cumsum(trends, axis=0)
+
+    def forecast(self, skus, sales, on_hand, start):
+        """Forecast for `sales` (n x days, day 0 = `start`) against `on_hand` stock.
+
+        Returns a dict of arrays aligned with `skus`: "demand" and "reorder"
+        (each {horizon: array}), "lead_days", "lead_demand", "safety_stock",
+        "reorder_point", "daily_rate" and "cover_days".
+        """
+        sales = np.asarray(sales, dtype=np.float64)
+        on_hand = np.asarray(on_hand, dtype=np.float64)
+        n, days = sales.shape
+        factors = weekday_factors(sales, start)
+        weekday = (start.weekday() + np.arange(days)) % 7
+        level, trend, sigma = damped_holt(sales / factors[:, weekday], self.alpha, self.beta, self.phi)
+        lead = self.lead_days(skus)
+        counts, trends = self._future_weights(start + timedelta(days=days), int(lead.max(initial=0)) + max(self.horizons))
+
+        def demand(h):
+            # Forecast units over the next h days (h scalar or per SKU)
+            return np.maximum(0.0, level * (factors * counts[h]).sum(axis=1) + trend * (factors * trends[h]).sum(axis=1))
+
+        lead_demand = demand(lead)
+        safety = self.z * sigma * np.sqrt(lead)
+        out = {
+            "demand": {},
+            "reorder": {},
+            "lead_days": lead,
+            "lead_demand": lead_demand,
+            "safety_stock": safety,
+            "reorder_point": lead_demand + safety
+        }
+        for h in self.horizons:
+            out["demand"][h] = demand(h)
+            out["reorder"][h] = np.maximum(0.0, demand(lead + h) + safety - on_hand)
+        out["daily_rate"] = out["demand"][30] / 30
+        with np.errstate(divide="ignore", invalid="ignore"):
+            out["cover_days"] = np.where(out["daily_rate"] > 0, on_hand / out["daily_rate"], np.inf)
+        return out
+
+
+def history_start(days, today=None):
+    """First day of a `days`-day history ending yesterday."""
+    return (today or date.today()) - timedelta(days=days)
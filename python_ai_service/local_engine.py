@@ -0,0 +1,249 @@
+import re
+from datetime import date, timedelta
+
+from metrics import REGISTRY
+from rollup_store import MAX_WINDOW_DAYS, resolve_date
+from shopifyql import ShopifyqlQuery, parse
+
+LOCAL_REPORTS = REGISTRY.counter(
+    "local_reports_total", "Grouped reports answered from a base pull, by outcome.", ("outcome",)
+)
+
+# The base pull: every product dimension, every additive sales measure
+BASE_DIMENSIONS = ("product_title", "product_vendor", "product_type", "product_variant_title",
+                   "product_variant_sku", "line_type")
+BASE_MEASURES = ("quantity_ordered", "quantity_returned", "net_items_sold", "gross_sales", "discounts",
+                 "returns", "net_sales", "taxes", "total_sales")
+# Ratios are recomputed from their summed parts: name -> (numerator, denominator)
+RATIO_MEASURES = {"returned_quantity_rate": ("quantity_returned", "quantity_ordered")}
+# A base pull this long may have been cut off; the report then runs remotely
+BASE_LIMIT = 100000
+
+_CONDITION_RE = re.compile(
+    r"\s*([a-z_][a-z0-9_]*)\s+(IS NOT NULL|IS NULL|!=|=|CONTAINS|STARTS WITH|ENDS WITH)"
+    r"(?:\s+'((?:[^'\\]|\\.)*)')?\s*(AND\b\s*)?",
+    re.IGNORECASE
+)
+_ORDER_RE = re.compile(r"([a-z_][a-z0-9_]*)(?:\s+(ASC|DESC))?", re.IGNORECASE)
+
+
+def _conditions(texts):
+    """[(field, op, value)] for ANDed conditions on base dimensions, or None."""
+    out = []
+    for text in texts:
+        pos = 0
+        while pos < len(text):
+            m = _CONDITION_RE.match(text, pos)
+            if not m or (m.end() == len(text) and m.group(4)):
+                return None
+            field, op, value = m.group(1), m.group(2).upper(), m.group(3)
+            if field not in BASE_DIMENSIONS or (value is None) != op.startswith("IS "):
+                return None
+            out.append((field, op, None if value is None else re.sub(r"\\(.)", r"\1", value)))
+            pos = m.end()
+    return out
+
+
+class LocalAnalyticsEngine:
+    """Answers grouped sales reports from one wide base pull per shop and window.
+
+    The base pull groups `FROM sales` by every product dimension
+    (BASE_DIMENSIONS) with every additive measure (BASE_MEASURES); it goes
+    through the result cache like any query, so once it is cached, reports
+    such as total_sales_by_product or top_product_variants_by_units_sold
+    over the same window are a local filter, group-by, sort and limit with
+    no Shopify call. `COMPARE TO previous_period` adds the base pull of the
+    preceding window and the same `<measure>__previous_period` /
+    `<measure>__percent_change` columns as the rollup store. Ratios are
+    recomputed from their summed parts and WITH TOTALS is left to the
+    digest. Anything else (other sources, measure filters, OR, time
+    grouping) is not planned and runs remotely.
+    """
+
+    def plan(self, query, today=None):
+        """Describe how to answer `query` from base pulls, or None if it can't be."""
+        try:
+            q = parse(query)
+        except (KeyError, ValueError):
+            return None
+        if q.source != "sales" or not q.group_by or q.timeseries or not set(q.group_by) <= set(BASE_DIMENSIONS):
+            return None
+        if not set(q.show) <= set(BASE_MEASURES) | set(RATIO_MEASURES):
+            return None
+        modifiers = {m.strip() for m in (q.group_modifiers or "").split(",") if m.strip()}
+        if not modifiers <= {"TOTALS", "PERCENT_CHANGE"} or q.compare_to not in (None, "previous_period"):
+            return None
+        conditions = _conditions(q.conditions)
+        order_by = [_ORDER_RE.fullmatch(o) for o in q.order_by]
+        if conditions is None or not all(order_by) or any(o.group(1) not in q.show + q.group_by for o in order_by):
+            return None
+
+        today = today or date.today()
+        since = resolve_date(q.since, today)
+        until = resolve_date(q.until or "today", today)
+        if since is None or until is None or since > until or (until - since).days >= MAX_WINDOW_DAYS:
+            return None
+        windows = [(since, until)]
+        if q.compare_to:
+            length = (until - since).days + 1
+            windows.append((since - timedelta(days=length), since - timedelta(days=1)))
+        bases = [self.base_query(a, b) for a, b in windows]
+        # The base pull itself has nothing to be derived from
+        if q.render() in bases:
+            return None
+        return {
+            "group_by": list(q.group_by),
+            "show": list(q.show),
+            "conditions": conditions,
+            "order_by": [(o.group(1), (o.group(2) or "ASC").upper() == "DESC") for o in order_by],
+            "limit": q.limit,
+            "compare": bool(q.compare_to),
+            "percent_change": "PERCENT_CHANGE" in modifiers and bool(q.compare_to),
+            "bases": bases
+        }
+
+    def base_query(self, since, until):
+        return ShopifyqlQuery("sales", BASE_MEASURES, group_by=BASE_DIMENSIONS, since=since.isoformat(),
+                              until=until.isoformat(), limit=BASE_LIMIT).render()
+
+    def answer(self, plan, base, previous=None):
+        """Build the shopifyqlQuery response for `plan` from base pull responses.
+
+        Returns None when a base pull lacks a column the report needs or
+        may have been truncated at BASE_LIMIT rows.
+        """
+        import numpy as np
+        from table import ColumnarTable
+
+        tables = [ColumnarTable.from_shopifyql(base)]
+        if plan["compare"]:
+            tables.append(ColumnarTable.from_shopifyql(previous or {}))
+        needed = set(plan["group_by"]) | {c[0] for c in plan["conditions"]}
+        sums = [m for m in BASE_MEASURES if m in plan["show"] or any(m in RATIO_MEASURES.get(s, ()) for s in plan["show"])]
+        for t in tables:
+            if len(t) >= BASE_LIMIT or (len(t) and not needed | set(sums) <= set(t.names)):
+                return None
+
+        groups = [self._aggregate(t, plan, sums) for t in tables]
+        keys, dims, values = groups[0]
+        show = plan["show"]
+        current = [self._measure(values, m) for m in show]
+        previous_values = []
+        if plan["compare"]:
+            prev_keys, _, prev = groups[1]
+            at = {k: i for i, k in enumerate(prev_keys)}
+            index = np.array([at.get(k, -1) for k in keys], dtype=np.int64)
+            for m in show:
+                column = self._measure(prev, m)
+                aligned = np.where(index >= 0, column[np.maximum(index, 0)] if len(column) else np.nan, np.nan)
+                previous_values.append(aligned)
+
+        order = self._order(plan, dims, dict(zip(show, current)))
+        if plan["limit"] is not None:
+            order = order[:plan["limit"]]
+
+        columns = [{"name": d, "dataType": "STRING", "displayName": d} for d in plan["group_by"]]
+        meta = {n: {"name": n, "dataType": tables[0].types.get(n) or "NUMBER", "displayName": n} for n in BASE_MEASURES}
+        meta.update({n: {"name": n, "dataType": "PERCENT", "displayName": n} for n in RATIO_MEASURES})
+        columns += [meta[m] for m in show]
+        cells = [[d[i] for i in order] for d in dims] + [_cells(v[order]) for v in current]
+        if plan["compare"]:
+            columns += [{**meta[m], "name": f"{m}__previous_period", "displayName": f"{m} (previous period)"} for m in show]
+            cells += [_cells(v[order]) for v in previous_values]
+            if plan["percent_change"]:
+                columns += [{"name": f"{m}__percent_change", "dataType": "PERCENT", "displayName": f"{m} (% change)"}
+                            for m in show]
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    for now, before in zip(current, previous_values):
+                        change = (now[order] - before[order]) / before[order] * 100
+                        ok = np.isfinite(change) & np.isfinite(before[order]) & (before[order] != 0)
+                        cells.append([f"{c:.2f}" if k else None for c, k in zip(change.tolist(), ok.tolist())])
+        rows = [list(r) for r in zip(*cells)]
+        return {"data": {"shopifyqlQuery": {"tableData": {"columns": columns, "rows": rows}, "parseErrors": []}}}
+
+    def _aggregate(self, table, plan, sums):
+        """(group keys, [dimension values per group], {measure: sums}) for one base table."""
+        import numpy as np
+
+        n = len(table)
+        text = {}
+
+        def column(name):
+            # (values as str, missing mask); missing values read as ""
+            if name not in text:
+                raw = table.get(name, np.full(n, None, dtype=object)).tolist()
+                text[name] = (np.array(["" if v is None else str(v) for v in raw], dtype=str),
+                              np.fromiter((v is None for v in raw), dtype=bool, count=n))
+            return text[name]
+
+        mask = np.ones(n, dtype=bool)
+        for field, op, value in plan["conditions"]:
+            col, null = column(field)
+            if op == "IS NULL":
+                mask &= null
+            elif op == "IS NOT NULL":
+                mask &= ~null
+            elif op in ("=", "!="):
+                mask &= ~null & ((col == value) if op == "=" else (col != value))
+            else:
+                lower = np.char.lower(col)
+                found = {"CONTAINS": np.char.find(lower, value.lower()) >= 0,
+                         "STARTS WITH": np.char.startswith(lower, value.lower()),
+                         "ENDS WITH": np.char.endswith(lower, value.lower())}[op]
+                mask &= ~null & found
+
+        rows = np.flatnonzero(mask)
+        group = np.zeros(len(rows), dtype=np.int64)
+        for name in plan["group_by"]:
+            # Fold each dimension's codes in and renumber, so ids stay dense;
+            # a missing value is its own group, apart from ""
+            values, null = column(name)
+            _, codes = np.unique(values[rows], return_inverse=True)
+            codes = codes.reshape(-1) * 2 + null[rows]
+            _, group = np.unique(group * (codes.max() + 1 if len(codes) else 1) + codes, return_inverse=True)
+            group = group.reshape(-1)
+        count = int(group.max()) + 1 if len(group) else 0
+        _, first = np.unique(group, return_index=True)
+        dims = []
+        for name in plan["group_by"]:
+            values, null = column(name)
+            dims.append([None if missing else v for v, missing in zip(values[rows][first].tolist(), null[rows][first].tolist())])
+        keys = ["\x1f".join(map(str, k)) for k in zip(*dims)] if dims else []
+        values = {m: np.bincount(group, weights=table.numeric(m)[rows], minlength=count) for m in sums}
+        return keys, dims, values
+
+    @staticmethod
+    def _measure(values, name):
+        import numpy as np
+
+        if name not in RATIO_MEASURES:
+            return values[name]
+        num, den = (values[m] for m in RATIO_MEASURES[name])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(den != 0, num / np.where(den != 0, den, 1), np.nan)
+
+    @staticmethod
+    def _order(plan, dims, measures):
+        """Row order: ORDER BY, then the group-by values ascending (missing as "")."""
+        import numpy as np
+
+        ranks = {}
+        for name, values in zip(plan["group_by"], dims):
+            _, ranks[name] = np.unique(np.array(["" if v is None else v for v in values], dtype=str), return_inverse=True)
+        # np.lexsort sorts by the last key first
+        keys = [ranks[name] for name in reversed(plan["group_by"])]
+        for name, descending in reversed(plan["order_by"]):
+            if name in measures:
+                v = measures[name]
+                missing = np.isnan(v)
+                filled = np.where(missing, 0.0, v)
+                # Missing values sort first ascending and last descending
+                keys += [-filled, missing] if descending else [filled, ~missing]
+            else:
+                keys.append(-ranks[name] if descending else ranks[name])
+        return np.lexsort(keys) if keys else np.arange(len(dims[0]) if dims else 0)
+
+
+def _cells(values):
+    # Whole numbers go out as ints, like Shopify's counts and the remote report
+    return [None if v != v else int(v) if v.is_integer() else v for v in values.tolist()]
@@ -1,15 +1,151 @@
-from fastapi import FastAPI
-from pydantic import BaseModel
+import asyncio
+import json
+import os
+from contextlib import asynccontextmanager
+from typing import List, Optional, Union
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field, model_validator
 from agent import AnalyticsAgent
+from bulk_export import BulkExport, check_intents
+from clients import close_http_client
+from metrics import REGISTRY
+from shopifyql import condition
 
-app = FastAPI()
+
+# "background" (default): serve at once and preload alongside, reported by
+# /ready; "blocking": preload before serving; "off": load on first use
+PRELOAD = os.getenv("PRELOAD", "background")
+# Bulk exports started through /export write here, one file per export name
+EXPORT_DIR = os.getenv("EXPORT_DIR", "exports")
+
+
+async def preload():
+    try:
+        await agent.preload()
+    except Exception as e:
+        print(f"⚠️ Preload failed: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    task = None
+    if PRELOAD == "blocking":
+        await preload()
+    elif PRELOAD == "off":
+        agent.ready = True
+    else:
+        task = asyncio.create_task(preload())
+    # Warm-up runs in the background; the first refresh waits one interval
+    agent.warmer.start()
+    yield
+    if task is not None:
+        task.cancel()
+    await agent.warmer.stop()
+    # A stopped export resumes from its checkpoint when started again
+    for export in exports.values():
+        if export.task is not None:
+            export.task.cancel()
+    await agent.close()
+    await close_http_client()
+
+app = FastAPI(lifespan=lifespan)
 agent = AnalyticsAgent()
+exports = {}
+
+class QueryFilter(BaseModel):
+    field: str
+    op: str = "="
+    value: Optional[Union[bool, int, float, str]] = None
+
+    @model_validator(mode="after")
+    def _valid_condition(self):
+        # Rejected here (422) rather than when the query is built
+        condition(self.field, self.op, self.value)
+        return self
 
 class QuestionRequest(BaseModel):
     shop_domain: str
     access_token: str
     question: str
+    bypass_cache: bool = False
+    # Applied to predefined reports without asking the LLM again
+    limit: Optional[int] = None
+    filters: List[QueryFilter] = []
+
+class BatchQuestionRequest(BaseModel):
+    shop_domain: str
+    access_token: str
+    questions: List[str]
+    bypass_cache: bool = False
+
+class ExportShop(BaseModel):
+    shop_domain: str
+    access_token: str
+
+class ExportRequest(BaseModel):
+    name: str = Field(pattern=r"^[A-Za-z0-9_.-]+$")
+    shops: List[ExportShop]
+    intents: List[str]
+    since: str = "startOfDay(-30d)"
+    until: str = "today"
+    explain: bool = False
+    restart: bool = False
+
+    @model_validator(mode="after")
+    def _known_intents(self):
+        check_intents(self.intents)
+        return self
 
 @app.post("/ask")
-def ask(req: QuestionRequest):
-    return agent.handle(req)
+async def ask(req: QuestionRequest):
+    return await agent.handle(req)
+
+@app.post("/ask/batch")
+async def ask_batch(req: BatchQuestionRequest):
+    return await agent.handle_batch(req)
+
+@app.post("/ask/stream")
+async def ask_stream(req: QuestionRequest):
+    async def events():
+        try:
+            async for event, payload in agent.handle_stream(req):
+                yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/export")
+async def start_export(req: ExportRequest):
+    export = exports.get(req.name)
+    if export is None or export.status()["state"] != "running":
+        export = exports[req.name] = BulkExport(
+            agent, os.path.join(EXPORT_DIR, req.name + ".ndjson"),
+            workers=int(os.getenv("EXPORT_WORKERS", "16")), per_shop=int(os.getenv("EXPORT_PER_SHOP", "2")),
+            explain=req.explain
+        )
+        export.start([s.model_dump() for s in req.shops], req.intents, req.since, req.until, resume=not req.restart)
+    return {"name": req.name, **export.status()}
+
+@app.get("/export/{name}")
+async def export_status(name: str):
+    if name not in exports:
+        raise HTTPException(status_code=404, detail=f"no export named {name}")
+    return {"name": name, **exports[name].status()}
+
+@app.get("/ready")
+async def ready():
+    """200 once preloading is done (503 until then), for readiness probes."""
+    return JSONResponse(
+        {"ready": agent.ready, "preload": PRELOAD, "preload_ms": agent.preload_seconds and round(agent.preload_seconds * 1000)},
+        status_code=200 if agent.ready else 503
+    )
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,211 @@
+import bisect
+import contextvars
+import os
+import random
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from a cache hit up to a slow LLM call
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Share of Shopify response bodies echoed to stdout (0 = never, 1 = always)
+DEBUG_BODY_SAMPLE_RATE = float(os.getenv("DEBUG_BODY_SAMPLE_RATE", "0"))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _number(v):
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(str(labels.get(n, "")) for n in self.labelnames), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, v in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(v)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            series[0][i] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {repr(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """In-process metrics rendered in the Prometheus text format.
+
+    Counters and histograms are plain dicts updated from the event loop, so
+    no locking is needed. Collectors are callables run at scrape time that
+    return (name, type, help, [(labels_dict, value), ...]) tuples, used for
+    values owned elsewhere such as cache statistics.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collect, key=None):
+        """Run `collect` at scrape time. A collector registered under the
+        same `key` replaces the earlier one, so an object created more than
+        once (e.g. an agent per benchmark run) reports its metrics once."""
+        if key is not None:
+            self._collectors = [c for c in self._collectors if c[0] != key]
+        self._collectors.append((key, collect))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for _, collect in self._collectors:
+            for name, kind, help, samples in collect():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(labels.keys(), labels.values())} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "agent_stage_seconds", "Time spent per pipeline stage.", ("stage", "intent", "origin")
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "agent_request_seconds", "End-to-end time per handled request.", ("endpoint", "intent", "origin")
+)
+REQUESTS = REGISTRY.counter(
+    "agent_requests_total", "Handled requests.", ("endpoint", "intent", "origin")
+)
+ROUTER_DECISIONS = REGISTRY.counter(
+    "agent_router_decisions_total", "Questions resolved by the local router vs the LLM parser.", ("resolver",)
+)
+UPSTREAM_REQUESTS = REGISTRY.counter(
+    "upstream_requests_total", "HTTP calls to upstream APIs.", ("service", "status")
+)
+UPSTREAM_BYTES = REGISTRY.counter(
+    "upstream_bytes_total", "Bytes sent to and received from upstream APIs.", ("service", "direction")
+)
+COALESCED = REGISTRY.counter(
+    "agent_coalesced_total", "Calls that joined an identical call already in flight instead of running, by stage.", ("stage",)
+)
+EXPLAIN_ANSWERS = REGISTRY.counter(
+    "agent_explain_answers_total", "Explanations by where they came from: local template, explanation cache or LLM.", ("source",)
+)
+LLM_TOKENS = REGISTRY.counter(
+    "llm_tokens_total", "LLM tokens (from `usage`, or estimated when the API omits it).", ("kind",)
+)
+
+_trace = contextvars.ContextVar("agent_trace", default=None)
+
+
+class RequestTrace:
+    """Stage timings for one request, labelled once intent and origin are known."""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.intent = "unknown"
+        self.origin = "none"
+        self.stages = []
+        self.started = time.perf_counter()
+
+    def finish(self):
+        for stage_name, seconds in self.stages:
+            STAGE_SECONDS.observe(seconds, stage=stage_name, intent=self.intent, origin=self.origin)
+        labels = {"endpoint": self.endpoint, "intent": self.intent, "origin": self.origin}
+        REQUEST_SECONDS.observe(time.perf_counter() - self.started, **labels)
+        REQUESTS.inc(**labels)
+
+
+@contextmanager
+def trace_request(endpoint):
+    """Collect stage timings for the current request (and tasks it spawns)."""
+    trace = RequestTrace(endpoint)
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+        trace.finish()
+
+
+def current_trace():
+    return _trace.get()
+
+
+@contextmanager
+def stage(name):
+    """Time a pipeline stage; recorded against the current request if any."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        trace = _trace.get()
+        if trace is not None:
+            trace.stages.append((name, seconds))
+        else:
+            STAGE_SECONDS.observe(seconds, stage=name, intent="none", origin="none")
+
+
+def sample_debug_body():
+    """True for the share of responses whose body should be printed."""
+    return DEBUG_BODY_SAMPLE_RATE > 0 and random.random() < DEBUG_BODY_SAMPLE_RATE
@@ -0,0 +1,179 @@
+import re
+
+import numpy as np
+
+from digest import _AVERAGED_RE
+from table import ColumnarTable
+
+# Questions asking for reasons or advice need the LLM, not a restated figure
+OPEN_ENDED_RE = re.compile(
+    r"\b(why|how (?:can|could|do|should|to)|should|recommend\w*|advi[cs]e|suggest\w*|improve|explain|reasons?|"
+    r"insights?|caus\w*|compare|versus|vs|predict\w*|forecast\w*|what if)\b"
+)
+# Business names for field names, as the explain prompt asks of the LLM
+LABELS = {
+    "net_items_sold": "units sold",
+    "quantity_ordered": "items ordered",
+    "quantity_returned": "items returned",
+    "returned_quantity_rate": "return rate",
+    "quantity_ordered_per_order": "items per order",
+    "inventory_units_sold": "units sold",
+    "inventory_units_sold_per_day": "units sold per day",
+    "percent_of_inventory_sold": "share of inventory sold",
+    "total_amount_spent": "total spend",
+    "total_number_of_orders": "orders",
+}
+MONEY = {
+    "gross_sales", "discounts", "returns", "net_sales", "taxes", "total_sales", "shipping_charges", "duties",
+    "additional_fees", "total_returns", "average_order_value", "total_amount_spent", "total_amount_spent_per_order",
+}
+# Measures a question can name; a question naming one the report does not
+# chart is answered about that one, or left to the LLM
+ASKED_MEASURES = (
+    (re.compile(r"\bnet sales?\b"), "net_sales"),
+    (re.compile(r"\bgross sales?\b"), "gross_sales"),
+    (re.compile(r"\btotal sales\b|\brevenue\b"), "total_sales"),
+    (re.compile(r"\btax(?:es)?\b"), "taxes"),
+    (re.compile(r"\bdiscounts?\b"), "discounts"),
+    (re.compile(r"\bshipping\b"), "shipping_charges"),
+    (re.compile(r"\bdut(?:y|ies)\b"), "duties"),
+    (re.compile(r"\bfees\b"), "additional_fees"),
+    (re.compile(r"\baov\b|\baverage order value\b"), "average_order_value"),
+    (re.compile(r"\breturn rate\b"), "returned_quantity_rate"),
+    # Stock levels, not how fast stock sells
+    (re.compile(r"\bstock\b|\bon hand\b|\brunning low\b|\b(?:check|current) (?:my |the )?inventory\b|"
+                r"\b(?:ending inventory|inventory (?:levels?|status|left))\b"), "ending_inventory_units"),
+)
+NOUNS = (
+    ("product_variant_sku", "product variants"), ("product_variant_title", "product variants"),
+    ("product_title", "products"), ("customer_name", "customers"),
+)
+TOP_ROWS = 5
+
+
+def label(measure):
+    return LABELS.get(measure, measure.replace("_", " "))
+
+
+def _fmt_value(measure, value, percent):
+    if percent:
+        return f"{value:.1f}%"
+    text = f"{value:,.0f}" if float(value).is_integer() else f"{value:,.2f}"
+    if measure in MONEY:
+        return ("-₹" + text[1:]) if text.startswith("-") else "₹" + text
+    return text
+
+
+def _primary(template, measures):
+    # The measure the report charts (VISUALIZE), else its first one
+    charted = (template.visualize or "").split(" ")[0]
+    return charted if charted in measures else (measures[0] if measures else None)
+
+
+def _asked(question, measures, primary):
+    """The measure to describe: the one the question names, else `primary`.
+
+    None when the question names several, or one the table does not have.
+    """
+    asked = {m for pattern, m in ASKED_MEASURES if pattern.search(question)}
+    if not asked:
+        return primary
+    return asked.pop() if len(asked) == 1 and asked <= set(measures) else None
+
+
+def _percent_values(table, column):
+    # PERCENT columns hold ratios (0.004 is 0.4%); other rate-like columns
+    # are already in percent
+    values = table.numeric(column)
+    return values * 100 if table.types.get(column) == "PERCENT" else values
+
+
+def templated_answer(data, question, template, limit=None):
+    """Deterministic answer for a predefined report, or None to ask the LLM.
+
+    Covers daily time series (total or average, change on the previous
+    period, highest and lowest day) and top-N reports (grouped without a time dimension and
+    ordered by a measure, descending): the leading `limit` rows (TOP_ROWS
+    when the question set none) and their share of the total. Questions asking why, what to do or for a comparison, and
+    reports of any other shape, return None. The figures are those of the
+    measure the question names (net sales, taxes, ...) when the report has
+    it, else of the charted one; a question naming a measure the report
+    lacks, or several, returns None too.
+    """
+    question = (question or "").lower()
+    if OPEN_ENDED_RE.search(question):
+        return None
+    series = (template.timeseries or "").split(" ")[0] == "day"
+    ranked = (
+        template.group_by and not template.timeseries and template.order_by
+        and template.order_by[0].upper().endswith(" DESC")
+    )
+    if not series and not ranked:
+        return None
+    table = ColumnarTable.from_shopifyql(data)
+    time_dims, dims, measures = table.classify()
+    measures = [m for m in measures if "__" not in m]
+    charted = _primary(template, measures)
+    primary = _asked(question, measures, charted)
+    # Top-N rows are ranked by the charted measure; another one needs the LLM
+    if primary is None or (ranked and primary != charted):
+        return None
+    percent = table.types.get(primary) == "PERCENT" or "rate" in primary or "percent" in primary
+    values = _percent_values(table, primary) if percent else table[primary]
+    if not len(table):
+        return f"No {label(primary)} were recorded in this period."
+    if series and "day" in time_dims:
+        return _series_answer(table, primary, values, percent)
+    if ranked and dims and not time_dims:
+        return _top_answer(table, template, dims, primary, values, percent, limit or TOP_ROWS)
+    return None
+
+
+def _series_answer(table, primary, values, percent):
+    days = table["day"].astype(str)
+    order = np.argsort(days, kind="stable")
+    days, values = days[order], values[order]
+    averaged = percent or bool(_AVERAGED_RE.search(primary))
+    current = values.mean() if averaged else values.sum()
+    name = label(primary)
+    verb = "was on average" if averaged else "came to"
+    answer = f"{name[0].upper() + name[1:]} {verb} {_fmt_value(primary, current, percent)} from {days[0][:10]} to {days[-1][:10]}"
+
+    previous = table.get(f"{primary}__previous_period")
+    if previous is not None:
+        column = f"{primary}__previous_period"
+        before = (_percent_values(table, column) if percent else table.numeric(column))[order]
+        before = before.mean() if averaged else before.sum()
+        if before:
+            change = (current - before) / abs(before) * 100
+            direction = "up" if change >= 0 else "down"
+            answer += f", {direction} {abs(change):.1f}% on the previous period ({_fmt_value(primary, before, percent)})"
+    answer += "."
+    if len(values) > 1:
+        hi, lo = int(values.argmax()), int(values.argmin())
+        answer += (
+            f" It peaked at {_fmt_value(primary, values[hi], percent)} on {days[hi][:10]} and was lowest at "
+            f"{_fmt_value(primary, values[lo], percent)} on {days[lo][:10]}."
+        )
+    return answer
+
+
+def _top_answer(table, template, dims, primary, values, percent, rows):
+    noun = next((n for d, n in NOUNS if d in dims), "rows")
+    name = label(primary)
+    order = np.argsort(-values, kind="stable")[:rows]
+    compared = f"{primary}__percent_change" in table and f"{primary}__previous_period" in table
+    lines = []
+    for rank, i in enumerate(order.tolist(), 1):
+        parts = [str(table[d][i]) for d in template.group_by if d in table and table[d][i] not in (None, "")]
+        line = f"{rank}. {' / '.join(parts[:2]) or 'Unknown'}: {_fmt_value(primary, values[i], percent)}"
+        # A blank change (nothing sold before) reads as 0; leave it out
+        if compared and table.numeric(f"{primary}__previous_period")[i]:
+            line += f" ({table.numeric(f'{primary}__percent_change')[i]:+.1f}% on the previous period)"
+        lines.append(line)
+    answer = f"Your top {noun} by {name}:\n" + "\n".join(lines)
+    total = values.sum()
+    if not percent and not _AVERAGED_RE.search(primary) and total > 0 and len(values) > len(order):
+        share = values[order].sum() / total
+        answer += f"\n\nThe top {len(order)} account for {share:.0%} of {name} across {len(values)} {noun}."
+    return answer
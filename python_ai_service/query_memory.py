@@ -0,0 +1,221 @@
+import asyncio
+import heapq
+import json
+import math
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+from router import _DIMENSION_RE, extract_dates, extract_limit, tokenize
+
+STOP_WORDS = set(tokenize(
+    "a an the of for in on to and or is are was were be me my i we our you your it what "
+    "which how show give tell list please can could do does did with by per about that this "
+    "there from at get want know see broken breakdown"
+))
+
+
+def _terms(question):
+    return Counter(t for t in tokenize(question) if t not in STOP_WORDS)
+
+
+def _signature(question):
+    # Paraphrases only share a query when they ask for the same window, the
+    # same top-N and the same breakdowns, otherwise the stored SINCE/UNTIL/
+    # LIMIT or GROUP BY would be wrong.
+    dimensions = sorted({" ".join(tokenize(m.group(0))) for m in _DIMENSION_RE.finditer((question or "").lower())})
+    return json.dumps([*extract_dates(question), extract_limit(question), dimensions])
+
+
+class GeneratedQueryCache:
+    """Persistent question -> LLM-generated ShopifyQL cache.
+
+    Entries live in SQLite so they survive restarts, and are only written
+    once Shopify has accepted the query. Lookups try the normalized question
+    first, then a TF-IDF cosine match against stored questions with the same
+    date window, limit and breakdowns; a question with a word no stored
+    question has is never matched. Past `max_entries` the least recently
+    used rows are evicted.
+
+    The TF-IDF vectors of the stored questions are kept in memory, already
+    normalized, and rebuilt only after a store or forget; a lookup scores
+    every entry with one sparse matrix-vector product. Lookups do not touch
+    SQLite: hits are counted in memory and written in one batch, in a worker
+    thread, once `flush_every` entries are pending or the oldest has waited
+    `flush_interval` seconds. `store` and `forget` update the index at once
+    and write to SQLite in a worker thread.
+    """
+
+    def __init__(self, path="generated_queries.db", max_entries=5000, min_similarity=0.75,
+                 flush_every=64, flush_interval=30.0):
+        self.max_entries = max_entries
+        self.min_similarity = min_similarity
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.hits = 0
+        self.misses = 0
+        self._used = {}
+        self._used_since = None
+        self._flushing = None
+        self._lock = threading.Lock()
+        self._matrix = None
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS generated_queries ("
+            " key TEXT PRIMARY KEY, question TEXT NOT NULL, signature TEXT NOT NULL,"
+            " query TEXT NOT NULL, last_used REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._db.commit()
+        self._entries = {}
+        self._df = Counter()
+        for key, question, query, last_used in self._db.execute(
+            "SELECT key, question, query, last_used FROM generated_queries"
+        ):
+            # Recomputed, so rows stored under an older signature still match
+            self._index(key, question, _signature(question), query, last_used)
+
+    def lookup(self, question):
+        key = " ".join(tokenize(question))
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._most_similar(question)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._record_hit(entry)
+        return entry["query"]
+
+    def _record_hit(self, entry):
+        now = entry["last_used"] = time.time()
+        key = entry["key"]
+        self._used[key] = (now, self._used.get(key, (0.0, 0))[1] + 1)
+        if self._used_since is None:
+            self._used_since = now
+        if len(self._used) < self.flush_every and now - self._used_since < self.flush_interval:
+            return
+        if self._flushing is not None and not self._flushing.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        self._flushing = loop.create_task(asyncio.to_thread(self._write_hits, self._take_hits()))
+
+    def _take_hits(self):
+        used, self._used, self._used_since = self._used, {}, None
+        return used
+
+    def flush(self):
+        """Write the pending hit counts and last-used times to SQLite."""
+        self._write_hits(self._take_hits())
+
+    def _write_hits(self, used):
+        if not used:
+            return
+        with self._lock:
+            self._db.executemany(
+                "UPDATE generated_queries SET last_used = MAX(last_used, ?), hits = hits + ? WHERE key = ?",
+                [(last_used, count, key) for key, (last_used, count) in used.items()]
+            )
+            self._db.commit()
+
+    async def store(self, question, query):
+        key = " ".join(tokenize(question))
+        signature = _signature(question)
+        now = time.time()
+        self._unindex(key)
+        self._index(key, question, signature, query, now)
+        overflow = len(self._entries) - self.max_entries
+        stale = [e["key"] for e in heapq.nsmallest(overflow, self._entries.values(), key=lambda e: e["last_used"])] \
+            if overflow > 0 else []
+        for k in stale:
+            self._unindex(k)
+        await asyncio.to_thread(self._write_store, (key, question, signature, query, now), stale)
+
+    def _write_store(self, row, stale):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO generated_queries (key, question, signature, query, last_used)"
+                " VALUES (?, ?, ?, ?, ?)", row
+            )
+            self._db.executemany("DELETE FROM generated_queries WHERE key = ?", [(k,) for k in stale])
+            self._db.commit()
+
+    async def forget(self, query):
+        """Drop entries whose stored query Shopify has started rejecting."""
+        stale = [k for k, e in self._entries.items() if e["query"] == query]
+        for k in stale:
+            self._unindex(k)
+        await asyncio.to_thread(self._delete, stale)
+
+    def _delete(self, keys):
+        with self._lock:
+            self._db.executemany("DELETE FROM generated_queries WHERE key = ?", [(k,) for k in keys])
+            self._db.commit()
+
+    def stats(self):
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def _index(self, key, question, signature, query, last_used):
+        terms = _terms(question)
+        self._entries[key] = {"key": key, "signature": signature, "terms": terms, "query": query,
+                              "last_used": last_used}
+        self._df.update(terms.keys())
+        self._matrix = None
+
+    def _unindex(self, key):
+        entry = self._entries.pop(key, None)
+        self._used.pop(key, None)
+        if entry is not None:
+            self._df.subtract(entry["terms"].keys())
+            self._matrix = None
+
+    def _idf(self, term):
+        return math.log((len(self._entries) + 1) / (self._df[term] + 1)) + 1.0
+
+    def _vectors(self):
+        """(entries, signatures, rows, cols, weights, vocabulary): the stored
+        questions' normalized TF-IDF vectors as a sparse matrix in COO form."""
+        import numpy as np
+        if self._matrix is None:
+            entries = list(self._entries.values())
+            vocabulary = {t: i for i, t in enumerate(t for t, n in self._df.items() if n > 0)}
+            idf = np.array([self._idf(t) for t in vocabulary])
+            rows, cols, counts = [], [], []
+            for i, entry in enumerate(entries):
+                for t, c in entry["terms"].items():
+                    rows.append(i)
+                    cols.append(vocabulary[t])
+                    counts.append(c)
+            rows, cols = np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp)
+            weights = np.array(counts, dtype=np.float64) * idf[cols]
+            norms = np.sqrt(np.bincount(rows, weights=weights * weights, minlength=len(entries)))
+            weights /= np.where(norms > 0, norms, 1.0)[rows]
+            signatures = np.array([e["signature"] for e in entries], dtype=object)
+            self._matrix = (entries, signatures, rows, cols, weights, vocabulary)
+        return self._matrix
+
+    def _most_similar(self, question):
+        terms = _terms(question)
+        if not terms or not self._entries:
+            return None
+        import numpy as np
+        entries, signatures, rows, cols, weights, vocabulary = self._vectors()
+        # A word no stored question has ("country" against "channel") can
+        # change what is asked however close the rest is
+        if any(t not in vocabulary for t in terms):
+            return None
+        qvec = {t: c * self._idf(t) for t, c in terms.items()}
+        norm = math.sqrt(sum(v * v for v in qvec.values())) or 1.0
+        dense = np.zeros(len(vocabulary))
+        for t, v in qvec.items():
+            dense[vocabulary[t]] = v / norm
+        # Cosine similarity of the question with every stored one at once
+        scores = np.bincount(rows, weights=weights * dense[cols], minlength=len(entries))
+        scores[signatures != _signature(question)] = -1.0
+        # Ties go to the most recently stored, as the scan did
+        best = len(scores) - 1 - int(np.argmax(scores[::-1]))
+        return entries[best] if scores[best] >= self.min_similarity else None
@@ -0,0 +1,95 @@
+import asyncio
+from urllib.parse import urlparse
+
+
+class RespError(Exception):
+    """Error reply from a Redis-protocol server."""
+
+
+def _pack(args):
+    out = [f"*{len(args)}\r\n".encode()]
+    for arg in args:
+        data = arg if isinstance(arg, bytes) else str(arg).encode()
+        out.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+    return b"".join(out)
+
+
+async def _read_reply(reader):
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("connection closed by server")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest.decode()
+    if kind == b"-":
+        return RespError(rest.decode())
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        n = int(rest)
+        if n < 0:
+            return None
+        data = await reader.readexactly(n + 2)
+        return data[:-2]
+    if kind == b"*":
+        n = int(rest)
+        if n < 0:
+            return None
+        return [await _read_reply(reader) for _ in range(n)]
+    raise RespError(f"unexpected reply {line[:40]!r}")
+
+
+class RespClient:
+    """Minimal asyncio client for Redis-protocol (RESP2) servers.
+
+    Enough for a shared cache: one command per round trip over a small pool
+    of connections, opened lazily. `url` is redis://[:password@]host:port/db.
+    A connection that fails or is cancelled mid-command is closed rather
+    than returned to the pool.
+    """
+
+    def __init__(self, url="redis://127.0.0.1:6379/0", pool_size=8, timeout=2.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(pool_size)
+        self._idle = []
+
+    async def _connect(self):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+        conn = (reader, writer)
+        if self.password:
+            await self._roundtrip(conn, ("AUTH", self.password))
+        if self.db:
+            await self._roundtrip(conn, ("SELECT", self.db))
+        return conn
+
+    async def _roundtrip(self, conn, args):
+        reader, writer = conn
+        writer.write(_pack(args))
+        await writer.drain()
+        reply = await asyncio.wait_for(_read_reply(reader), self.timeout)
+        if isinstance(reply, RespError):
+            raise reply
+        return reply
+
+    async def execute(self, *args):
+        async with self._slots:
+            conn = self._idle.pop() if self._idle else await self._connect()
+            try:
+                reply = await self._roundtrip(conn, args)
+            except RespError:
+                self._idle.append(conn)
+                raise
+            except BaseException:
+                conn[1].close()
+                raise
+            self._idle.append(conn)
+            return reply
+
+    async def close(self):
+        while self._idle:
+            self._idle.pop()[1].close()
@@ -0,0 +1,321 @@
+import asyncio
+import json
+import re
+import sqlite3
+import threading
+from datetime import date, timedelta
+
+from metrics import REGISTRY
+
+ROLLUP_DAYS = REGISTRY.counter(
+    "rollup_days_total", "Daily buckets behind time-series answers, by where they came from.", ("source",)
+)
+
+_CLAUSE_RE = re.compile(
+    r"\b(FROM|SHOW|WHERE|GROUP BY|HAVING|TIMESERIES|SINCE|UNTIL|DURING|COMPARE TO|ORDER BY|LIMIT|VISUALIZE)\b"
+)
+_ISO_RE = re.compile(r"\d{4}-\d{2}-\d{2}")
+# Longest window served from the store; COMPARE TO doubles what is fetched
+MAX_WINDOW_DAYS = 400
+# Daily sales measures kept as one shared series: an unfiltered `FROM sales`
+# report showing any of them is a projection of it, so the daily reports
+# share one fetch per day instead of one per report
+SALES_DAILY_MEASURES = (
+    "quantity_ordered", "orders", "quantity_returned", "average_order_value", "quantity_ordered_per_order",
+    "returned_quantity_rate", "total_returns", "gross_sales", "discounts", "returns", "net_sales",
+    "shipping_charges", "duties", "additional_fees", "taxes", "total_sales"
+)
+
+
+def parse_clauses(query):
+    """Split ShopifyQL into {keyword: text}; None if a keyword repeats."""
+    parts = _CLAUSE_RE.split(query or "")
+    clauses = {}
+    for keyword, text in zip(parts[1::2], parts[2::2]):
+        if keyword in clauses:
+            return None
+        clauses[keyword] = " ".join(text.split())
+    return clauses
+
+
+def _month_start(day, months):
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def resolve_date(expr, today):
+    """Resolve a ShopifyQL SINCE/UNTIL expression to a date, or None.
+
+    Handles ISO dates, today/yesterday, `-Nd`/`-Nw` offsets and the
+    startOfDay/Month/Quarter/Year functions.
+    """
+    expr = (expr or "").strip()
+    if _ISO_RE.fullmatch(expr):
+        return date.fromisoformat(expr)
+    if expr == "today":
+        return today
+    if expr == "yesterday":
+        return today - timedelta(days=1)
+    m = re.fullmatch(r"-(\d+)([dw])", expr)
+    if m:
+        return today - timedelta(days=int(m.group(1)) * (7 if m.group(2) == "w" else 1))
+    m = re.fullmatch(r"startOfDay\((-?\d+)d\)", expr)
+    if m:
+        return today + timedelta(days=int(m.group(1)))
+    m = re.fullmatch(r"startOfMonth\((-?\d+)m\)", expr)
+    if m:
+        return _month_start(today, int(m.group(1)))
+    m = re.fullmatch(r"startOfQuarter\((-?\d+)q\)", expr)
+    if m:
+        return _month_start(today, 3 * int(m.group(1)) - (today.month - 1) % 3)
+    m = re.fullmatch(r"startOfYear\((-?\d+)y\)", expr)
+    if m:
+        return date(today.year + int(m.group(1)), 1, 1)
+    return None
+
+
+def _days(start, end):
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+class DailyRollupStore:
+    """Per-shop store of closed daily buckets for `TIMESERIES day` reports.
+
+    A report such as total_sales_over_time is reduced to its series (FROM,
+    SHOW, WHERE; unfiltered daily sales reports all share the
+    SALES_DAILY_MEASURES series) and each day's row is kept in SQLite once the day is
+    closed, i.e. older than the last `open_days` days. A later request for
+    any window of that series only asks Shopify for the open days and for
+    days it has never seen, then rebuilds the table locally: the window's
+    rows in order, and for `COMPARE TO previous_period` the matching
+    previous-period values as `<metric>__previous_period` columns (plus
+    `<metric>__percent_change` with PERCENT_CHANGE). WITH TOTALS is left
+    to the digest, which totals the series itself. Merged days are written
+    to SQLite from a worker thread.
+    """
+
+    def __init__(self, path="daily_rollups.db", open_days=2):
+        self.open_days = open_days
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS rollup_series ("
+            " shop TEXT NOT NULL, series TEXT NOT NULL, columns TEXT NOT NULL,"
+            " PRIMARY KEY (shop, series))"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS rollup_days ("
+            " shop TEXT NOT NULL, series TEXT NOT NULL, day TEXT NOT NULL, row TEXT,"
+            " PRIMARY KEY (shop, series, day))"
+        )
+        self._db.commit()
+
+    def plan(self, query, today=None):
+        """Describe how to serve `query` from daily buckets, or None if it can't be.
+
+        Only ungrouped `TIMESERIES day` queries over a resolvable window,
+        ordered by day, qualify.
+        """
+        clauses = parse_clauses(query)
+        if not clauses or not {"FROM", "SHOW", "TIMESERIES", "SINCE", "UNTIL"} <= clauses.keys():
+            return None
+        if {"HAVING", "DURING"} & clauses.keys() or clauses.get("GROUP BY", "day") != "day":
+            return None
+        m = re.fullmatch(r"day(?: WITH ((?:TOTALS|PERCENT_CHANGE)(?:, ?(?:TOTALS|PERCENT_CHANGE))*))?", clauses["TIMESERIES"])
+        if not m:
+            return None
+        if clauses.get("COMPARE TO", "previous_period") != "previous_period":
+            return None
+        order = re.fullmatch(r"day(?: (ASC|DESC))?", clauses.get("ORDER BY", "day"))
+        limit = clauses.get("LIMIT")
+        if not order or (limit is not None and not limit.isdigit()):
+            return None
+
+        today = today or date.today()
+        since = resolve_date(clauses["SINCE"], today)
+        until = resolve_date(clauses["UNTIL"], today)
+        if since is None or until is None or since > until or (until - since).days >= MAX_WINDOW_DAYS:
+            return None
+
+        show = [c.strip() for c in clauses["SHOW"].split(",") if c.strip() and c.strip() != "day"]
+        if clauses["FROM"] == "sales" and "WHERE" not in clauses and set(show) <= set(SALES_DAILY_MEASURES):
+            series = f"FROM sales SHOW {', '.join(SALES_DAILY_MEASURES)}"
+        else:
+            series = f"FROM {clauses['FROM']} SHOW {clauses['SHOW']}"
+            if "WHERE" in clauses:
+                series += f" WHERE {clauses['WHERE']}"
+        return {
+            "series": series + " TIMESERIES day",
+            "show": show,
+            "since": since,
+            "until": until,
+            "compare": "COMPARE TO" in clauses,
+            "percent_change": "PERCENT_CHANGE" in (m.group(1) or ""),
+            "descending": order.group(1) == "DESC",
+            "limit": int(limit) if limit else None,
+            "today": today
+        }
+
+    def needed_range(self, plan):
+        if not plan["compare"]:
+            return plan["since"], plan["until"]
+        length = (plan["until"] - plan["since"]).days + 1
+        return plan["since"] - timedelta(days=length), plan["until"]
+
+    def load(self, shop_domain, plan):
+        """Return (columns, {day: row}) for the stored closed days the plan needs."""
+        start, end = self.needed_range(plan)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT columns FROM rollup_series WHERE shop = ? AND series = ?", (shop_domain, plan["series"])
+            ).fetchone()
+            if row is None:
+                return None, {}
+            stored = self._db.execute(
+                "SELECT day, row FROM rollup_days WHERE shop = ? AND series = ? AND day BETWEEN ? AND ?",
+                (shop_domain, plan["series"], start.isoformat(), end.isoformat())
+            ).fetchall()
+        days = {date.fromisoformat(day): (json.loads(cells) if cells is not None else None) for day, cells in stored}
+        return json.loads(row[0]), days
+
+    def missing_ranges(self, plan, days):
+        """Contiguous (start, end) runs of needed days that must come from Shopify."""
+        start, end = self.needed_range(plan)
+        first_open = plan["today"] - timedelta(days=self.open_days - 1)
+        runs = []
+        for day in _days(start, end):
+            if day in days and day < first_open:
+                continue
+            if runs and runs[-1][1] == day - timedelta(days=1):
+                runs[-1][1] = day
+            else:
+                runs.append([day, day])
+        return [tuple(r) for r in runs]
+
+    def fetch_query(self, plan, start, end):
+        n = (end - start).days + 1
+        return f"{plan['series']} SINCE {start.isoformat()} UNTIL {end.isoformat()} ORDER BY day ASC LIMIT {n}"
+
+    async def merge(self, shop_domain, plan, start, end, data):
+        """Take one fetched run into the store.
+
+        Returns (columns, {day: row}) for every day in start..end (None for
+        days Shopify returned no row for), or None when the response has no
+        `day` column to key rows by. Only closed days are persisted.
+        """
+        table = data.get("data", {}).get("shopifyqlQuery", {}).get("tableData", {})
+        columns = table.get("columns", [])
+        names = [c.get("name") for c in columns]
+        if "day" not in names:
+            return None
+        day_index = names.index("day")
+        fetched = dict.fromkeys(_days(start, end))
+        for row in table.get("rows", []):
+            cell = row.get("day") if isinstance(row, dict) else row[day_index]
+            try:
+                day = date.fromisoformat(str(cell)[:10])
+            except ValueError:
+                continue
+            if day in fetched:
+                fetched[day] = row
+
+        first_open = plan["today"] - timedelta(days=self.open_days - 1)
+        closed = [
+            (shop_domain, plan["series"], day.isoformat(), json.dumps(row) if row is not None else None)
+            for day, row in fetched.items() if day < first_open
+        ]
+        await asyncio.to_thread(self._write, (shop_domain, plan["series"], json.dumps(columns)), closed)
+        return columns, fetched
+
+    def _write(self, series, days):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO rollup_series (shop, series, columns) VALUES (?, ?, ?)", series)
+            self._db.executemany("INSERT OR REPLACE INTO rollup_days (shop, series, day, row) VALUES (?, ?, ?, ?)", days)
+            self._db.commit()
+
+    def assemble(self, plan, columns, days):
+        """Build the shopifyqlQuery response for `plan` from daily rows.
+
+        Rows of a shared series are first cut down to `day` and the
+        measures the report shows, in its order.
+        """
+        names = [c.get("name") for c in columns]
+        keep = [names.index(n) for n in ["day"] + plan.get("show", []) if n in names]
+        if keep != list(range(len(names))):
+            days = {d: self._project(r, names, keep) for d, r in days.items()}
+            columns = [columns[i] for i in keep]
+            names = [names[i] for i in keep]
+        metrics = [(i, c) for i, c in enumerate(columns) if c.get("name") != "day"]
+        out_columns = list(columns)
+        if plan["compare"]:
+            out_columns += [
+                {**c, "name": f"{c['name']}__previous_period",
+                 "displayName": f"{c.get('displayName') or c['name']} (previous period)"}
+                for _, c in metrics
+            ]
+            if plan["percent_change"]:
+                out_columns += [
+                    {"name": f"{c['name']}__percent_change", "dataType": "PERCENT",
+                     "displayName": f"{c.get('displayName') or c['name']} (% change)"}
+                    for _, c in metrics
+                ]
+
+        length = (plan["until"] - plan["since"]).days + 1
+        rows = []
+        for day in _days(plan["since"], plan["until"]):
+            row = days.get(day)
+            if row is None:
+                continue
+            if plan["compare"]:
+                row = self._with_comparison(row, days.get(day - timedelta(days=length)), names, metrics, plan["percent_change"])
+            rows.append(row)
+        if plan["descending"]:
+            rows.reverse()
+        if plan["limit"] is not None:
+            rows = rows[:plan["limit"]]
+        return {"data": {"shopifyqlQuery": {"tableData": {"columns": out_columns, "rows": rows}, "parseErrors": []}}}
+
+    @staticmethod
+    def _project(row, names, keep):
+        if row is None:
+            return None
+        if isinstance(row, dict):
+            return {names[i]: row.get(names[i]) for i in keep}
+        return [row[i] for i in keep]
+
+    def _with_comparison(self, row, previous, names, metrics, percent_change):
+        from table import to_number
+
+        def cell(r, i):
+            if r is None:
+                return None
+            return r.get(names[i]) if isinstance(r, dict) else r[i]
+
+        extra = {}
+        for i, c in metrics:
+            extra[f"{c['name']}__previous_period"] = cell(previous, i)
+        if percent_change:
+            for i, c in metrics:
+                before = to_number(cell(previous, i)) if previous is not None else 0.0
+                change = (to_number(cell(row, i)) - before) / before * 100 if before else None
+                extra[f"{c['name']}__percent_change"] = None if change is None else f"{change:.2f}"
+        if isinstance(row, dict):
+            return {**row, **extra}
+        return list(row) + list(extra.values())
+
+    def stats(self):
+        with self._lock:
+            series, days = self._db.execute(
+                "SELECT COUNT(DISTINCT shop || char(0) || series), COUNT(*) FROM rollup_days"
+            ).fetchone()
+        return {"series": series, "days": days}
+
+    def clear(self, shop_domain=None):
+        with self._lock:
+            if shop_domain is None:
+                self._db.execute("DELETE FROM rollup_days")
+                self._db.execute("DELETE FROM rollup_series")
+            else:
+                self._db.execute("DELETE FROM rollup_days WHERE shop = ?", (shop_domain,))
+                self._db.execute("DELETE FROM rollup_series WHERE shop = ?", (shop_domain,))
+            self._db.commit()
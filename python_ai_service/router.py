@@ -0,0 +1,354 @@
+import calendar
+import re
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Canonical forms applied after plural stripping, so phrasings that mean the
+# same thing hit the same index entries.
+SYNONYMS = {
+    "revenue": "sale", "income": "sale", "earning": "sale", "earn": "sale",
+    "turnover": "sale", "money": "sale",
+    "refund": "return", "refunded": "return", "returned": "return",
+    "stock": "inventory", "stocked": "inventory",
+    "buyer": "customer", "shopper": "customer", "client": "customer",
+    "item": "unit", "piece": "unit", "quantity": "unit", "qty": "unit",
+    "sku": "variant", "purchase": "order", "ordered": "order",
+    "avg": "average", "repeat": "returning", "loyal": "returning",
+    "replenish": "restock", "replenishing": "restock", "restocking": "restock",
+    "reordering": "reorder", "bestseller": "best seller", "sellthrough": "sell through",
+    "versu": "vs", "v": "vs", "margin": "profit", "profitable": "profit",
+    "profitability": "profit", "class": "grade", "classification": "grade",
+}
+
+# Phrase -> weight, per intent. Longest phrases are matched first and consume
+# their tokens, so "gross sales" never also counts as plain "sales".
+INTENT_PHRASES = {
+    "total_sales_over_time": {
+        "sale": 1.0, "total sale": 1.5, "net sale": 1.5, "how much did": 0.5,
+        "how much": 0.3, "make": 0.5, "made": 0.5, "tax": 0.8, "sell in total": 1.5,
+        "sale report": 1.0, "store": 0.2,
+    },
+    "gross_sales_over_time": {
+        "gross": 2.5, "gross sale": 3.0,
+    },
+    "orders_over_time": {
+        "order": 1.0, "how many order": 1.5, "number of order": 1.5, "order count": 1.5,
+        "order volume": 1.5, "came in": 0.5,
+    },
+    "items_ordered_over_time": {
+        "unit order": 2.2, "order unit": 0.5, "total unit order": 2.5,
+    },
+    "average_order_quantity_over_time": {
+        "unit per order": 3.0, "average order unit": 3.0, "average unit per order": 3.0,
+        "average number of unit": 2.5, "basket size in unit": 3.0, "average order quantity": 3.0,
+    },
+    "average_order_value_over_time": {
+        "aov": 3.0, "average order value": 3.0, "spend per order": 3.0, "average basket value": 3.0,
+        "order value": 2.0, "basket value": 2.0,
+    },
+    "total_returns_over_time": {
+        "return": 1.2, "how much was": 0.3, "value of return": 1.5, "return report": 1.0,
+    },
+    "return_rate_over_time": {
+        "return rate": 3.0, "percentage of unit": 1.0, "return unit rate": 3.0,
+        "get return": 1.0, "rate": 0.8,
+    },
+    "items_returned_over_time": {
+        "unit return": 1.8, "return unit": 1.8, "return unit over time": 2.5, "came back": 1.8,
+        "unit came back": 2.2,
+    },
+    "items_returned_by_product": {
+        "most return": 2.0, "highest return": 2.0, "return by product": 3.0, "sending back": 2.0,
+        "return unit per product": 3.0, "return most": 2.0,
+    },
+    "orders_and_returns_by_product": {
+        "order and return": 2.5, "order vs return": 2.5, "and return": 1.0, "order and return by product": 3.5,
+    },
+    "inventory_sold_daily_by_product": {
+        "inventory": 1.5, "out of inventory": 3.0, "inventory level": 3.0, "running low": 2.5,
+        "on hand": 1.5, "left": 0.5, "check my inventory": 3.0, "inventory status": 3.0,
+        "ending inventory": 3.0, "inventory unit sold per day": 3.5, "daily inventory sold": 3.5,
+        "inventory report": 3.0,
+    },
+    "products_by_percentage_sold": {
+        "percent of inventory sold": 4.0, "percentage of inventory": 4.0, "sell through": 3.5,
+        "percent of inventory": 4.0, "starting inventory": 4.0, "percentage sold": 3.0,
+        "percent sold": 3.0,
+    },
+    "abc_product_analysis": {
+        "abc": 4.0, "grade": 2.5, "a grade": 3.0,
+    },
+    "new_customer_sales_over_time": {
+        "new customer": 2.5, "first time customer": 3.0, "first time": 2.0,
+    },
+    "new_vs_returning_customer_sales": {
+        "new vs returning": 4.0, "new and returning": 4.0, "customer": 1.0, "customer breakdown": 2.5,
+        "by type": 1.5, "about my customer": 2.0,
+    },
+    "one_time_customers": {
+        "one time customer": 4.0, "one time": 3.0, "only ordered once": 4.0, "once": 2.5,
+        "single order": 3.5, "never came back": 4.0,
+    },
+    "returning_customers": {
+        "returning customer": 3.0, "returning": 1.5, "more than one order": 4.0, "buy again": 3.5,
+    },
+    "sales_by_customer_name": {
+        "top customer": 3.5, "best customer": 3.5, "biggest customer": 3.5, "by customer": 3.0,
+        "per customer": 3.0, "each customer": 3.0, "customers spent the most": 3.5,
+        "spent the most": 3.0,
+    },
+    "total_sales_by_product": {
+        "top product": 3.5, "best seller": 3.5, "top selling": 3.0, "best selling": 3.0,
+        "by product": 2.0, "which product": 1.5, "sell the most": 2.0, "product sale": 2.5,
+        "made the most": 2.0, "top 5": 2.0, "top 10": 2.0, "product": 0.5,
+        "top": 1.0, "best": 0.8, "sells the most": 2.5,
+    },
+    "top_product_variants_by_units_sold": {
+        "top variant": 4.0, "best selling variant": 4.5, "popular variant": 4.0,
+        "variant by unit": 3.5, "variant sell the most": 4.5, "variant sold the most": 4.5,
+        "variant sell": 3.0, "variant sold": 3.0,
+    },
+    "total_sales_by_product_variant": {
+        "variant": 2.0, "by variant": 3.0, "per variant": 3.0, "product variant": 2.5,
+        "variant sale": 3.0, "each variant": 3.0,
+    },
+    "profit_margin_by_order": {
+        "profit": 4.0, "cost of good": 4.0, "cogs": 4.0,
+    },
+    "reorder_forecast": {
+        "reorder": 4.0, "restock": 4.0, "forecast": 3.0, "will i need": 4.0, "next month": 2.0,
+        "how much should i buy": 4.0, "order planning": 4.0, "from my supplier": 4.0,
+        "should i order": 3.0, "need to restock": 4.0, "buy": 1.0,
+    },
+}
+
+# Word sets that signal an intent when all of them appear anywhere in the
+# question, e.g. "how many items were returned" -> units + returns.
+INTENT_COMBOS = {
+    "items_ordered_over_time": [("unit order", 2.0)],
+    "items_returned_over_time": [("unit return", 2.0)],
+    "items_returned_by_product": [("product return", 2.0)],
+    "orders_and_returns_by_product": [("order return product", 2.0)],
+    "average_order_quantity_over_time": [("average unit", 2.0), ("unit per order", 2.5)],
+    "total_sales_over_time": [("how much sell", 1.5)],
+    "sales_by_customer_name": [("top customer", 2.5), ("best customer", 2.5)],
+}
+
+# Cue phrases shared by a family of intents. They break ties between, say,
+# "returns" over time and returns by product.
+TREND_CUES = ("over time", "trend", "daily", "per day", "each day", "by day", "day by day",
+              "monthly", "by month", "chart", "graph", "plot", "going up", "change", "increasing")
+PRODUCT_CUES = ("by product", "per product", "each product", "which product", "what product",
+                "product", "for each product")
+TREND_INTENTS = [k for k in INTENT_PHRASES if k.endswith("_over_time")]
+PRODUCT_INTENTS = ["items_returned_by_product", "orders_and_returns_by_product",
+                   "products_by_percentage_sold", "inventory_sold_daily_by_product"]
+
+NUMBER_WORDS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8,
+    "nine": 9, "ten": 10, "eleven": 11, "twelve": 12, "fourteen": 14, "thirty": 30,
+    "sixty": 60, "ninety": 90,
+}
+_UNIT_DAYS = {"day": 1, "week": 7, "month": 30, "quarter": 90, "year": 365}
+_MONTHS = {m.lower(): i for i, m in enumerate(calendar.month_name) if m}
+_MONTHS.update({m.lower(): i for i, m in enumerate(calendar.month_abbr) if m})
+_ISO = r"(\d{4}-\d{2}-\d{2})"
+_NUM = r"(\d+|" + "|".join(NUMBER_WORDS) + r")"
+_PERIODS = (
+    (r"\b(year to date|ytd|this year)\b", "startOfYear(0y)", "today"),
+    (r"\b(this quarter|quarter to date|qtd)\b", "startOfQuarter(0q)", "today"),
+    (r"\b(this month|month to date|mtd)\b", "startOfMonth(0m)", "today"),
+    (r"\bthis week\b", "startOfWeek(0w)", "today"),
+    (r"\byesterday\b", "yesterday", "yesterday"),
+)
+# Granularity cues ("daily", "per day", "by month") are not date ranges
+_GRANULARITY_RE = re.compile(r"\b(?:daily|weekly|monthly|yearly|(?:per|each|by|every|a|one) (?:day|week|month))\b")
+# Left over after the date phrase is taken out, these mean a period the
+# router did not understand. "may" counts only after a preposition.
+_TEMPORAL_RE = re.compile(
+    r"\b(?:(?:in|of|during|for|since|last|this|next|early|late|mid) may"
+    r"|" + "|".join(m for m in _MONTHS if m != "may") + r"|q[1-4]|h[12]|quarters?|weekends?|weeks?|months?|years?"
+    r"|(?:19|20)\d{2}|\d{4}-\d{2}(?:-\d{2})?|\d{1,2}/\d{1,2}(?:/\d{2,4})?"
+    r"|monday|tuesday|wednesday|thursday|friday|saturday|sunday|yesterday|tomorrow|tonight|ago"
+    r"|since|until|during|holidays?|christmas|black friday|cyber monday|season)\b"
+)
+# Breakdowns and entities no predefined report has
+_DIMENSION_RE = re.compile(
+    r"\b(?:channels?|countr(?:y|ies)|regions?|cit(?:y|ies)|provinces?|states?|locations?|markets?|referr(?:er|al)s?"
+    r"|devices?|collections?|tags?|gateways?|payment methods?|discount codes?|shipping methods?|utm|campaigns?"
+    r"|(?:by|per|each) (?:hour|source|store))\b"
+    r"|\bsku[\s#:-]*[a-z0-9-]*\d|#\d+"
+)
+
+
+def _stem(token):
+    if len(token) > 3 and token.endswith("ies"):
+        token = token[:-3] + "y"
+    elif len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        token = token[:-1]
+    return SYNONYMS.get(token, token)
+
+
+def tokenize(text):
+    out = []
+    for tok in _TOKEN_RE.findall((text or "").lower()):
+        out.extend(_stem(tok).split())
+    return out
+
+
+def _to_int(word):
+    return int(word) if word.isdigit() else NUMBER_WORDS[word]
+
+
+def _match_dates(q):
+    """(since, until, matched span) for the first date phrase in lowercased `q`, or None."""
+    m = re.search(rf"(?:from|between)\s+{_ISO}\s+(?:to|and|until|-)\s+{_ISO}", q)
+    if m:
+        return m.group(1), m.group(2), m.span()
+    m = re.search(rf"since\s+{_ISO}", q)
+    if m:
+        return m.group(1), "today", m.span()
+    m = re.search(r"\b(" + "|".join(_MONTHS) + r")\w*\s+(\d{4})\b", q)
+    if m:
+        year, month = int(m.group(2)), _MONTHS[m.group(1)]
+        last = calendar.monthrange(year, month)[1]
+        return f"{year}-{month:02d}-01", f"{year}-{month:02d}-{last:02d}", m.span()
+    m = re.search(r"\bin\s+(\d{4})\b", q)
+    if m:
+        return f"{m.group(1)}-01-01", f"{m.group(1)}-12-31", m.span()
+
+    for pattern, since, until in _PERIODS:
+        m = re.search(pattern, q)
+        if m:
+            return since, until, m.span()
+
+    m = re.search(rf"\b(?:last|past|previous)\s+{_NUM}\s+(day|week|month|quarter|year)s?\b", q)
+    if m:
+        return f"startOfDay(-{_to_int(m.group(1)) * _UNIT_DAYS[m.group(2)]}d)", "today", m.span()
+    m = re.search(r"\b(?:last|past|previous)\s+(day|week|month|quarter|year)\b", q)
+    if m:
+        return f"startOfDay(-{_UNIT_DAYS[m.group(1)]}d)", "today", m.span()
+    m = re.search(r"\btoday'?s?\b", q)
+    if m:
+        return "today", "today", m.span()
+    return None
+
+
+def extract_dates(question):
+    """Map date phrases in `question` to ShopifyQL (since, until) expressions.
+
+    Covers explicit ISO ranges, "since <date>", month/year names, calendar
+    periods ("this month", "ytd"), "today"/"yesterday" and rolling windows
+    ("last 2 weeks"). Defaults to the last 30 days.
+    """
+    matched = _match_dates((question or "").lower())
+    return matched[:2] if matched else ("startOfDay(-30d)", "today")
+
+
+def unparsed_phrases(question, dates=True):
+    """Date and breakdown phrases in `question` that routing would ignore.
+
+    A date phrase outside the one extract_dates understood ("Q1 2024",
+    "in may", "last weekend") would silently become the default window; a
+    breakdown no predefined report has ("by channel", "by country") or a
+    specific SKU would be answered with the wrong report. Either sends the
+    question to the LLM parser instead. `dates=False` skips date phrases,
+    for reports that pick their own window.
+    """
+    q = (question or "").lower()
+    matched = _match_dates(q)
+    if matched:
+        a, b = matched[2]
+        q = q[:a] + " " + q[b:]
+    q = _GRANULARITY_RE.sub(" ", q)
+    patterns = (_TEMPORAL_RE, _DIMENSION_RE) if dates else (_DIMENSION_RE,)
+    return [m.group(0) for pattern in patterns for m in pattern.finditer(q)]
+
+
+def extract_limit(question):
+    m = re.search(rf"\b(?:top|best)\s+{_NUM}\b", (question or "").lower())
+    return _to_int(m.group(1)) if m else None
+
+
+class IntentRouter:
+    """Deterministic question -> report router built from a phrase index.
+
+    `INTENT_PHRASES` and the cue lists are compiled once into a dict keyed by
+    token tuples. A question is scanned left to right taking the longest
+    indexed phrase at each position; matched weights are summed per intent.
+    The winner is returned only when its score clears `min_score` and its
+    margin over the runner-up, (top - second) / top, clears `threshold`;
+    otherwise `route` returns None and the caller falls back to the LLM. It
+    also returns None when the question has date or breakdown phrases it
+    would ignore (see `unparsed_phrases`).
+    """
+
+    RANKED_INTENTS = ("total_sales_by_product", "top_product_variants_by_units_sold",
+                      "sales_by_customer_name", "total_sales_by_product_variant")
+    UNDATED_INTENTS = ("reorder_forecast",)
+
+    def __init__(self, threshold=0.25, min_score=1.0):
+        self.threshold = threshold
+        self.min_score = min_score
+        self.index = {}
+        for intent, phrases in INTENT_PHRASES.items():
+            for phrase, weight in phrases.items():
+                self._add(phrase, intent, weight)
+        for cue in TREND_CUES:
+            for intent in TREND_INTENTS:
+                self._add(cue, intent, 0.6)
+        for cue in PRODUCT_CUES:
+            for intent in PRODUCT_INTENTS:
+                self._add(cue, intent, 1.0)
+        self.max_len = max(len(k) for k in self.index)
+        self.combos = [
+            (frozenset(tokenize(words)), intent, weight)
+            for intent, combos in INTENT_COMBOS.items()
+            for words, weight in combos
+        ]
+
+    def _add(self, phrase, intent, weight):
+        weights = self.index.setdefault(tuple(tokenize(phrase)), {})
+        weights[intent] = weights.get(intent, 0.0) + weight
+
+    def score(self, question):
+        tokens = tokenize(question)
+        scores = {}
+        i = 0
+        while i < len(tokens):
+            for n in range(min(self.max_len, len(tokens) - i), 0, -1):
+                weights = self.index.get(tuple(tokens[i:i + n]))
+                if weights:
+                    for intent, w in weights.items():
+                        scores[intent] = scores.get(intent, 0.0) + w
+                    i += n
+                    break
+            else:
+                i += 1
+        present = set(tokens)
+        for words, intent, weight in self.combos:
+            if words <= present:
+                scores[intent] = scores.get(intent, 0.0) + weight
+        return scores
+
+    def classify(self, question):
+        """Return (intent, confidence) for the best match, or (None, 0.0)."""
+        ranked = sorted(self.score(question).items(), key=lambda kv: kv[1], reverse=True)
+        if not ranked or ranked[0][1] < self.min_score:
+            return None, 0.0
+        top = ranked[0][1]
+        second = ranked[1][1] if len(ranked) > 1 else 0.0
+        return ranked[0][0], (top - second) / top
+
+    def route(self, question):
+        intent, confidence = self.classify(question)
+        if intent is None or confidence < self.threshold:
+            return None
+        # The forecast reads its own history window, so only breakdowns matter there
+        if unparsed_phrases(question, dates=intent not in self.UNDATED_INTENTS):
+            return None
+        since, until = extract_dates(question)
+        params = {"intent": intent, "since": since, "until": until}
+        if intent in self.RANKED_INTENTS:
+            params["limit"] = extract_limit(question) or (5 if re.search(r"\b(top|best)\b", question.lower()) else None)
+        return params
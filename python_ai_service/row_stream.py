@@ -0,0 +1,137 @@
+import codecs
+import json
+import re
+
+from table import ColumnarTable
+
+_ROWS_RE = re.compile(r'"rows"\s*:\s*\[')
+_COLUMNS_RE = re.compile(r'"columns"\s*:\s*')
+_SEPARATORS = " \t\r\n,"
+
+
+class ShopifyqlRowStream:
+    """Incrementally parse a shopifyqlQuery response body.
+
+    Wraps an async iterator of body chunks (bytes or str) and yields
+    `tableData.rows` in batches as soon as each row is complete, without
+    ever holding the whole document. Only the text before the rows array
+    (which carries `columns`) and after it (`parseErrors`, `errors`) is
+    kept. Once iteration finishes, `document` holds the full response with
+    `rows` left empty, so the usual error checks still apply. A body that
+    is not JSON becomes an `errors` document naming `status`.
+    """
+
+    def __init__(self, chunks, batch_size=1000, status=None):
+        self.batch_size = batch_size
+        self.status = status
+        self.columns = []
+        self.document = None
+        self.row_count = 0
+        self._chunks = chunks.__aiter__()
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        self._prefix = None
+
+    @classmethod
+    def from_text(cls, text, batch_size=1000):
+        """A stream over a body already in memory, such as a locally built error response."""
+        async def chunks():
+            yield text
+        return cls(chunks(), batch_size)
+
+    async def _more(self):
+        if self._eof:
+            return False
+        # Drop consumed text so the buffer stays around one chunk in size
+        self._buf = self._buf[self._pos:]
+        self._pos = 0
+        try:
+            chunk = await self._chunks.__anext__()
+        except StopAsyncIteration:
+            self._eof = True
+            self._buf += self._decoder.decode(b"", final=True)
+            return False
+        self._buf += self._decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+        return True
+
+    async def __aiter__(self):
+        async for batch in self.batches():
+            for row in batch:
+                yield row
+
+    async def read_header(self):
+        """Read up to the rows array. Returns False if the body has none.
+
+        A body without rows (e.g. a top-level `errors` or throttled
+        response) is read in full and parsed into `document`.
+        """
+        if self._prefix is not None or self.document is not None:
+            return self.document is None
+        # Phase 1: everything up to the rows array, kept whole (it is small)
+        match = _ROWS_RE.search(self._buf)
+        while match is None:
+            scanned = max(0, len(self._buf) - 16)
+            if not await self._more():
+                try:
+                    self.document = json.loads(self._buf)
+                except ValueError:
+                    # e.g. an HTML error page from a proxy in front of Shopify
+                    self.document = {"errors": [{"message": f"HTTP {self.status}: {self._buf[:200]}"}]}
+                return False
+            match = _ROWS_RE.search(self._buf, scanned)
+        self._prefix = self._buf[:match.end() - 1]
+        self._pos = match.end()
+        columns = _COLUMNS_RE.search(self._prefix)
+        if columns:
+            self.columns = self._json.raw_decode(self._prefix, columns.end())[0]
+        return True
+
+    async def batches(self):
+        """Yield lists of up to `batch_size` rows."""
+        if not await self.read_header():
+            return
+
+        # Phase 2: decode one row at a time, pulling chunks as needed
+        batch = []
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in _SEPARATORS:
+                self._pos += 1
+            if self._pos >= len(self._buf):
+                if not await self._more():
+                    raise ValueError("shopifyqlQuery response ended inside tableData.rows")
+                continue
+            if self._buf[self._pos] == "]":
+                self._pos += 1
+                break
+            try:
+                row, end = self._json.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if await self._more():
+                    continue
+                raise
+            if not isinstance(row, (list, dict)) and (end == len(self._buf) or self._buf[end] not in _SEPARATORS + "]"):
+                # A bare scalar is only complete once a delimiter follows it
+                if await self._more():
+                    continue
+            self._pos = end
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                self.row_count += len(batch)
+                yield batch
+                batch = []
+        if batch:
+            self.row_count += len(batch)
+            yield batch
+
+        # Phase 3: the small tail after the rows array
+        while await self._more():
+            pass
+        self.document = json.loads(self._prefix + "[]" + self._buf[self._pos:])
+
+    async def tables(self):
+        """Yield each batch as a ColumnarTable."""
+        async for batch in self.batches():
+            yield ColumnarTable.from_table_data({"columns": self.columns, "rows": batch})
@@ -0,0 +1,314 @@
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+
+from metrics import REGISTRY, stage
+
+# Statuses worth retrying; anything else (401, 403, 404, ...) is final
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+SHOPIFY_QUEUE_WAIT = REGISTRY.histogram(
+    "shopify_queue_wait_seconds", "Time queries waited for Shopify cost budget before being sent."
+)
+SHOPIFY_RETRIES = REGISTRY.counter(
+    "shopify_retries_total", "Shopify requests retried, by reason.", ("reason",)
+)
+SHOPIFY_CIRCUIT_REJECTED = REGISTRY.counter(
+    "shopify_circuit_rejected_total", "Shopify requests failed fast because the shop's circuit was open."
+)
+
+
+def is_throttled(data):
+    errors = data.get("errors") if isinstance(data, dict) else None
+    if not isinstance(errors, list):
+        return False
+    return any(
+        isinstance(e, dict) and ((e.get("extensions") or {}).get("code") == "THROTTLED" or e.get("message") == "Throttled")
+        for e in errors
+    )
+
+
+class CostBucket:
+    """Leaky-bucket estimate of a shop's available GraphQL query cost.
+
+    Refills at `restore_rate` points per second up to `maximum`. Every
+    response that carries `throttleStatus` resets the estimate to Shopify's
+    own numbers, minus whatever other queries still have reserved.
+    """
+
+    def __init__(self, maximum=1000.0, restore_rate=50.0):
+        self.maximum = maximum
+        self.restore_rate = restore_rate
+        self.available = maximum
+        self.updated = time.monotonic()
+        self.in_flight = 0.0
+
+    def level(self, now=None):
+        now = time.monotonic() if now is None else now
+        return min(self.maximum, self.available + (now - self.updated) * self.restore_rate)
+
+    def wait_time(self, cost, now=None):
+        return max(0.0, (min(cost, self.maximum) - self.level(now)) / self.restore_rate)
+
+    def take(self, cost, now=None):
+        now = time.monotonic() if now is None else now
+        self.available = self.level(now) - cost
+        self.updated = now
+        self.in_flight += cost
+
+    def settle(self, reserved, status=None, actual_cost=None, now=None):
+        now = time.monotonic() if now is None else now
+        self.in_flight = max(0.0, self.in_flight - reserved)
+        if status:
+            self.maximum = float(status.get("maximumAvailable") or self.maximum)
+            self.restore_rate = float(status.get("restoreRate") or self.restore_rate)
+            self.available = float(status.get("currentlyAvailable", self.available)) - self.in_flight
+            self.updated = now
+        elif actual_cost is not None:
+            # Refund the part of the reservation the query did not use
+            self.available = self.level(now) + reserved - actual_cost
+            self.updated = now
+
+
+class CircuitBreaker:
+    """Stops calling a shop whose requests keep failing.
+
+    `threshold` failures in a row (transport errors, timeouts, 5xx) open
+    the circuit for `cooldown` seconds, during which calls fail fast. Then
+    one call is let through: success closes the circuit, failure opens it
+    for another cooldown.
+    """
+
+    def __init__(self, threshold=5, cooldown=30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.opens = 0
+
+    def state(self, now=None):
+        if self.opened_at is None:
+            return "closed"
+        now = time.monotonic() if now is None else now
+        return "open" if self.probing or now - self.opened_at < self.cooldown else "half-open"
+
+    def retry_in(self, now=None):
+        now = time.monotonic() if now is None else now
+        return max(0.0, self.opened_at + self.cooldown - now) if self.opened_at is not None else 0.0
+
+    def allow(self, now=None):
+        """Whether a call may be sent now; the first call after the cooldown is the probe."""
+        state = self.state(now)
+        if state == "half-open":
+            self.probing = True
+        return state != "open"
+
+    def record(self, ok, now=None):
+        """Record a call's outcome; None means it ended without one (cancelled)."""
+        now = time.monotonic() if now is None else now
+        probe, self.probing = self.probing, False
+        if ok is None:
+            return
+        if ok:
+            self.failures = 0
+            self.opened_at = None
+            return
+        self.failures += 1
+        if probe or (self.opened_at is None and self.failures >= self.threshold):
+            self.opened_at = now
+            self.opens += 1
+
+
+class _Shop:
+    def __init__(self, default_cost, breaker):
+        self.bucket = CostBucket()
+        self.breaker = breaker
+        self.lock = asyncio.Lock()
+        self.waiting = 0
+        self.cost = default_cost
+        self.throttled = 0
+
+
+class ShopifyScheduler:
+    """Per-shop admission control for Shopify GraphQL calls.
+
+    Each shop gets a CostBucket. Before a query is sent it waits, in FIFO
+    order behind that shop's other queued queries, until the estimated
+    budget covers the query's expected cost (the last `requestedQueryCost`
+    seen for the shop). Throttled, 429/5xx and transport failures are
+    retried up to `max_retries` times with full-jitter exponential backoff
+    on top of the bucket wait; after that the last response is returned
+    as before. Each shop also has a CircuitBreaker: while it is open,
+    queries get an `errors` response at once instead of being sent.
+    """
+
+    def __init__(self, default_cost=50.0, max_retries=4, base_backoff=0.5, max_backoff=8.0,
+                 breaker_threshold=5, breaker_cooldown=30.0):
+        self.default_cost = default_cost
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self._shops = {}
+        REGISTRY.register_collector(self._metrics, key="shopify_scheduler")
+
+    def _shop(self, shop_domain):
+        shop = self._shops.get(shop_domain)
+        if shop is None:
+            breaker = CircuitBreaker(self.breaker_threshold, self.breaker_cooldown)
+            shop = self._shops[shop_domain] = _Shop(self.default_cost, breaker)
+        return shop
+
+    def rejection(self, shop_domain):
+        """The `errors` response for a call the shop's circuit won't let through, else None.
+
+        A None return admits the call, which must then be passed to `record`.
+        """
+        breaker = self._shop(shop_domain).breaker
+        if breaker.allow():
+            return None
+        SHOPIFY_CIRCUIT_REJECTED.inc()
+        return self._circuit_error(shop_domain, breaker)
+
+    def _circuit_error(self, shop_domain, breaker):
+        return {"errors": [{
+            "message": f"Shopify unavailable for {shop_domain}: {breaker.failures} failed requests in a row, "
+                       f"retrying in {breaker.retry_in():.0f}s",
+            "extensions": {"code": "CIRCUIT_OPEN"}
+        }]}
+
+    def record(self, shop_domain, status_code):
+        """Feed an admitted call's outcome to the breaker: an HTTP status, False for a
+        transport failure, None if it was cancelled."""
+        ok = status_code if status_code is None or status_code is False else status_code < 500
+        self._shop(shop_domain).breaker.record(ok)
+
+    @asynccontextmanager
+    async def slot(self, shop_domain):
+        """Wait for budget, reserve the expected cost, and settle it on exit.
+
+        The body calls `settle(data)` on the yielded callback with the
+        response so the bucket can resync; if it never does, the
+        reservation is simply released.
+        """
+        shop = self._shop(shop_domain)
+        cost = shop.cost
+        started = time.monotonic()
+        shop.waiting += 1
+        try:
+            with stage("queue"):
+                async with shop.lock:
+                    wait = shop.bucket.wait_time(cost)
+                    while wait > 0:
+                        await asyncio.sleep(wait)
+                        wait = shop.bucket.wait_time(cost)
+                    shop.bucket.take(cost)
+        finally:
+            shop.waiting -= 1
+        SHOPIFY_QUEUE_WAIT.observe(time.monotonic() - started)
+
+        settled = False
+
+        def settle(data):
+            nonlocal settled
+            settled = True
+            cost_info = {}
+            if isinstance(data, dict):
+                cost_info = (data.get("extensions") or {}).get("cost") or {}
+            if cost_info.get("requestedQueryCost"):
+                shop.cost = float(cost_info["requestedQueryCost"])
+            if is_throttled(data):
+                shop.throttled += 1
+            if not cost_info:
+                # Nothing says the query was charged (error pages, proxies
+                # without cost extensions), so give the reservation back
+                shop.bucket.settle(cost, actual_cost=0)
+                return
+            shop.bucket.settle(cost, cost_info.get("throttleStatus"), cost_info.get("actualQueryCost"))
+
+        try:
+            yield settle
+        finally:
+            if not settled:
+                shop.bucket.settle(cost)
+
+    def retry_reason(self, status_code, data):
+        """Why a response should be retried, or None if it is final."""
+        if is_throttled(data):
+            return "throttled"
+        if status_code in RETRYABLE_STATUS:
+            return str(status_code)
+        return None
+
+    async def backoff(self, attempt, reason):
+        SHOPIFY_RETRIES.inc(reason=reason)
+        await asyncio.sleep(random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt)))
+
+    async def run(self, shop_domain, send):
+        """Send one request through the scheduler with retries.
+
+        `send()` performs the HTTP call and returns (status_code, data).
+        """
+        import httpx
+        breaker = self._shop(shop_domain).breaker
+        for attempt in range(self.max_retries + 1):
+            async with self.slot(shop_domain) as settle:
+                rejected = self.rejection(shop_domain)
+                if rejected:
+                    # Nothing was charged, so the reservation is refunded
+                    settle(rejected)
+                    return rejected
+                try:
+                    status_code, data = await send()
+                except httpx.TransportError:
+                    self.record(shop_domain, False)
+                    if attempt == self.max_retries:
+                        if breaker.state() == "open":
+                            return self._circuit_error(shop_domain, breaker)
+                        raise
+                    reason = "transport"
+                except BaseException:
+                    self.record(shop_domain, None)
+                    raise
+                else:
+                    self.record(shop_domain, status_code)
+                    settle(data)
+                    reason = self.retry_reason(status_code, data)
+                    if reason is None or attempt == self.max_retries:
+                        return data
+            if breaker.state() == "open":
+                # No point backing off for a call the circuit will refuse
+                return self._circuit_error(shop_domain, breaker)
+            await self.backoff(attempt, reason)
+
+    def stats(self):
+        return {
+            domain: {
+                "queued": shop.waiting,
+                "available": round(shop.bucket.level(), 1),
+                "maximum": shop.bucket.maximum,
+                "restore_rate": shop.bucket.restore_rate,
+                "expected_cost": shop.cost,
+                "throttled": shop.throttled,
+                "circuit": shop.breaker.state()
+            }
+            for domain, shop in self._shops.items()
+        }
+
+    def _metrics(self):
+        shops = self._shops.values()
+        return [
+            ("shopify_queue_depth", "gauge", "Queries waiting for Shopify cost budget.",
+             [({}, sum(s.waiting for s in shops))]),
+            ("shopify_cost_in_flight", "gauge", "Query cost reserved by requests still in flight.",
+             [({}, sum(s.bucket.in_flight for s in shops))]),
+            ("shopify_throttled_responses_total", "counter", "Responses Shopify returned as THROTTLED.",
+             [({}, sum(s.throttled for s in shops))]),
+            ("shopify_circuit_open", "gauge", "Shops whose circuit is open (calls fail fast).",
+             [({}, sum(s.breaker.state() == "open" for s in shops))]),
+            ("shopify_circuit_opens_total", "counter", "Times a shop's circuit opened.",
+             [({}, sum(s.breaker.opens for s in shops))]),
+        ]
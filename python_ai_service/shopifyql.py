@@ -0,0 +1,200 @@
+import json
+import re
+from json.encoder import encode_basestring_ascii
+
+# Clause order of a rendered query; each clause goes on its own line
+CLAUSES = ("FROM", "SHOW", "WHERE", "GROUP BY", "TIMESERIES", "SINCE", "UNTIL", "COMPARE TO", "ORDER BY", "LIMIT", "VISUALIZE")
+_CLAUSE_START_RE = re.compile(r"^(" + "|".join(CLAUSES) + r")\b\s*", re.MULTILINE)
+_FIELD_RE = re.compile(r"^[a-z_][a-z0-9_]*$")
+FILTER_OPS = ("=", "!=", "<", "<=", ">", ">=", "CONTAINS", "STARTS WITH", "ENDS WITH", "IS NULL", "IS NOT NULL")
+
+# One GraphQL document for every ShopifyQL query; the query travels as a variable
+SHOPIFYQL_DOCUMENT = (
+    "query ShopifyQL($query: String!) { shopifyqlQuery(query: $query) "
+    "{ tableData { columns { name dataType displayName } rows } parseErrors } }"
+)
+_BODY_PREFIX = ('{"query": ' + json.dumps(SHOPIFYQL_DOCUMENT) + ', "variables": {"query": ').encode()
+
+
+def graphql_body(query):
+    """JSON request body running `query` through SHOPIFYQL_DOCUMENT."""
+    return _BODY_PREFIX + encode_basestring_ascii(query).encode() + b"}}"
+
+
+def condition(field, op="=", value=None):
+    """One WHERE condition, with `value` quoted as a ShopifyQL literal.
+
+    Raises ValueError for an unknown operator or a field that is not a
+    plain column name, so request input never reaches the query as text.
+    """
+    op = op.upper()
+    if not _FIELD_RE.match(field or ""):
+        raise ValueError(f"invalid filter field {field!r}")
+    if op not in FILTER_OPS:
+        raise ValueError(f"invalid filter operator {op!r}")
+    if op in ("IS NULL", "IS NOT NULL"):
+        return f"{field} {op}"
+    if isinstance(value, bool):
+        literal = "true" if value else "false"
+    elif isinstance(value, (int, float)):
+        literal = repr(value)
+    elif isinstance(value, str):
+        literal = "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+    else:
+        raise ValueError(f"filter {field} {op} needs a value")
+    return f"{field} {op} {literal}"
+
+
+def _split_list(text):
+    return tuple(part.strip() for part in text.split(",") if part.strip())
+
+
+def _split_modifiers(text):
+    # "product_title WITH TOTALS" -> ("product_title", "TOTALS")
+    head, _, modifiers = text.partition(" WITH ")
+    return head, modifiers.strip() or None
+
+
+class ShopifyqlQuery:
+    """A ShopifyQL query held as clauses rather than text.
+
+    Built once per template with `parse`; `between`, `with_limit`, `where`
+    and `grouped_by` return modified copies, so the parsed templates are
+    shared and never edited. `render()` produces the text, one clause per
+    line in the canonical order, and remembers it. Clauses other than the
+    dates and limit are rendered once and shared with `bind` copies, so a
+    per-request render is a few string joins.
+    """
+
+    _FIELDS = ("source", "show", "conditions", "group_by", "group_modifiers", "timeseries",
+               "since", "until", "compare_to", "order_by", "limit", "visualize")
+    __slots__ = _FIELDS + ("_text", "_frame")
+
+    def __init__(self, source, show, conditions=(), group_by=(), group_modifiers=None, timeseries=None,
+                 since=None, until=None, compare_to=None, order_by=(), limit=None, visualize=None):
+        self.source = source
+        self.show = tuple(show)
+        self.conditions = tuple(conditions)
+        self.group_by = tuple(group_by)
+        self.group_modifiers = group_modifiers
+        self.timeseries = timeseries
+        self.since = since
+        self.until = until
+        self.compare_to = compare_to
+        self.order_by = tuple(order_by)
+        self.limit = limit
+        self.visualize = visualize
+        self._text = None
+        self._frame = None
+
+    def _replace(self, **changes):
+        clone = ShopifyqlQuery.__new__(ShopifyqlQuery)
+        for name in self._FIELDS:
+            setattr(clone, name, changes[name] if name in changes else getattr(self, name))
+        clone._text = clone._frame = None
+        return clone
+
+    def bind(self, since, until, limit=None):
+        """Copy with the date range (and limit, if given) set; one copy per request."""
+        if self._frame is None:
+            self._frame = self._render_frame()
+        clone = ShopifyqlQuery.__new__(ShopifyqlQuery)
+        (clone.source, clone.show, clone.conditions, clone.group_by, clone.group_modifiers,
+         clone.timeseries, clone.compare_to, clone.order_by, clone.visualize, clone._frame) = (
+            self.source, self.show, self.conditions, self.group_by, self.group_modifiers,
+            self.timeseries, self.compare_to, self.order_by, self.visualize, self._frame)
+        clone.since, clone.until, clone._text = since, until, None
+        clone.limit = self.limit if limit is None else int(limit)
+        return clone
+
+    def between(self, since, until):
+        return self.bind(since, until)
+
+    def with_limit(self, limit):
+        return self.bind(self.since, self.until, limit)
+
+    def where(self, *conditions):
+        """Add conditions, ANDed with the template's own."""
+        return self._replace(conditions=self.conditions + tuple(conditions))
+
+    def _where_text(self):
+        if len(self.conditions) == 1:
+            return self.conditions[0]
+        return " AND ".join(f"({c})" if " OR " in c.upper() else c for c in self.conditions)
+
+    def grouped_by(self, *dimensions):
+        for d in dimensions:
+            if not _FIELD_RE.match(d):
+                raise ValueError(f"invalid group-by dimension {d!r}")
+        return self._replace(group_by=tuple(dimensions))
+
+    def _render_frame(self):
+        # (text before SINCE, between UNTIL and LIMIT, after LIMIT)
+        head = [f"FROM {self.source}", "SHOW " + ", ".join(self.show)]
+        if self.conditions:
+            head.append("WHERE " + self._where_text())
+        if self.group_by:
+            group = "GROUP BY " + ", ".join(self.group_by)
+            head.append(group + (f" WITH {self.group_modifiers}" if self.group_modifiers else ""))
+        if self.timeseries:
+            head.append(f"TIMESERIES {self.timeseries}")
+        middle = []
+        if self.compare_to:
+            middle.append(f"COMPARE TO {self.compare_to}")
+        if self.order_by:
+            middle.append("ORDER BY " + ", ".join(self.order_by))
+        tail = [f"VISUALIZE {self.visualize}"] if self.visualize else []
+        return "".join(f"\n{line}" for line in head), "".join(f"\n{line}" for line in middle), "".join(f"\n{line}" for line in tail)
+
+    def render(self):
+        if self._text is None:
+            if self._frame is None:
+                self._frame = self._render_frame()
+            head, middle, tail = self._frame
+            dates = ""
+            if self.since:
+                dates = f"\nSINCE {self.since}" + (f" UNTIL {self.until}" if self.until else "")
+            elif self.until:
+                dates = f"\nUNTIL {self.until}"
+            limit = f"\nLIMIT {self.limit}" if self.limit is not None else ""
+            self._text = head + dates + middle + limit + tail + "\n"
+        return self._text
+
+    def __str__(self):
+        return self.render()
+
+
+def parse(text):
+    """Parse one query (clauses at line starts, as in PREDEFINED_QUERIES).
+
+    SINCE and UNTIL may share a line. Raises ValueError on an unknown or
+    repeated clause.
+    """
+    clauses = {}
+    matches = list(_CLAUSE_START_RE.finditer(text))
+    if not matches or text[:matches[0].start()].strip():
+        raise ValueError("query must start with a clause")
+    for m, following in zip(matches, matches[1:] + [None]):
+        body = " ".join(text[m.end():following.start() if following else len(text)].split())
+        keyword = m.group(1)
+        if keyword == "SINCE" and " UNTIL " in f" {body} ":
+            body, _, clauses["UNTIL"] = body.partition(" UNTIL ")
+        if keyword in clauses:
+            raise ValueError(f"repeated clause {keyword}")
+        clauses[keyword] = body
+
+    group_by, group_modifiers = _split_modifiers(clauses.get("GROUP BY", ""))
+    return ShopifyqlQuery(
+        source=clauses["FROM"],
+        show=_split_list(clauses["SHOW"]),
+        conditions=(clauses["WHERE"],) if clauses.get("WHERE") else (),
+        group_by=_split_list(group_by),
+        group_modifiers=group_modifiers,
+        timeseries=clauses.get("TIMESERIES"),
+        since=clauses.get("SINCE"),
+        until=clauses.get("UNTIL"),
+        compare_to=clauses.get("COMPARE TO"),
+        order_by=_split_list(clauses.get("ORDER BY", "")),
+        limit=int(clauses["LIMIT"]) if clauses.get("LIMIT") else None,
+        visualize=clauses.get("VISUALIZE")
+    )
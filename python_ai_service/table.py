@@ -0,0 +1,289 @@
+import re
+from itertools import repeat, zip_longest
+
+import numpy as np
+
+NUMERIC_TYPES = {"NUMBER", "INTEGER", "FLOAT", "DECIMAL", "MONEY", "PERCENT"}
+TIME_TYPES = {"HOUR", "DAY", "WEEK", "MONTH", "QUARTER", "YEAR", "DATE", "DATE_TIME"}
+TIME_COLUMNS = {"hour", "day", "week", "month", "quarter", "year"}
+_NUMERIC_TEXT_RE = re.compile(r"\s*[-₹$€£]?[\d,]*\.?\d+%?\s*")
+_STRIP_TABLE = str.maketrans("", "", ",₹$€£% ")
+
+
+def to_number(v):
+    if v is None:
+        return 0.0
+    if isinstance(v, (int, float)):
+        return float(v)
+    if isinstance(v, str):
+        s = v.strip()
+        if s == "":
+            return 0.0
+        s = re.sub(r"[^0-9\.-]", "", s)
+        if s in ("", ".", "-", "-."):
+            return 0.0
+        try:
+            return float(s)
+        except Exception:
+            return 0.0
+    return 0.0
+
+
+def to_numeric(values):
+    """Coerce a column of raw cells to float64 in bulk.
+
+    Clean numbers (the common case) convert in one C-level cast. Columns with
+    currency symbols, thousands separators or blanks have those characters
+    stripped in one pass; only columns that still fail fall back to the
+    per-cell `to_number`.
+    """
+    arr = np.asarray(values, dtype=object)
+    try:
+        out = arr.astype(np.float64)
+        # None casts to NaN; blank cells count as 0 everywhere else
+        out[np.isnan(out)] = 0.0
+        return out
+    except (TypeError, ValueError):
+        pass
+    try:
+        cleaned = [v.translate(_STRIP_TABLE) or "0" if isinstance(v, str) else (0 if v is None else v)
+                   for v in arr.tolist()]
+        return np.array(cleaned, dtype=np.float64)
+    except (TypeError, ValueError):
+        return np.fromiter((to_number(v) for v in arr), dtype=np.float64, count=len(arr))
+
+
+_truthy = np.frompyfunc(bool, 1, 1)
+
+
+def _looks_numeric(values):
+    sample = [v for v in values[:50] if v not in (None, "")]
+    if not sample:
+        return False
+    ok = sum(1 for v in sample if isinstance(v, (int, float)) or _NUMERIC_TEXT_RE.fullmatch(str(v)))
+    return ok >= 0.8 * len(sample)
+
+
+class ColumnarTable:
+    """Column-oriented shopifyqlQuery result.
+
+    Built once from `tableData`: rows are transposed into one array per
+    column, numeric columns (by `dataType`, or by sampling when the type is
+    missing) are coerced to float64 and string columns are kept as object
+    arrays. Rows that echo the header (a numeric cell equal to its column
+    name) are dropped at construction.
+    """
+
+    def __init__(self, columns, types):
+        self.columns = columns
+        self.types = types
+
+    @classmethod
+    def from_shopifyql(cls, data):
+        return cls.from_table_data(data.get("data", {}).get("shopifyqlQuery", {}).get("tableData", {}))
+
+    @classmethod
+    def from_table_data(cls, table):
+        meta = table.get("columns", [])
+        names = [c.get("name") for c in meta]
+        rows = table.get("rows", [])
+        # ShopifyQL may return rows as dicts (keyed by column name)
+        # or as arrays in the same order as `columns`.
+        if rows and isinstance(rows[0], dict):
+            raw = [[r.get(n) for r in rows] for n in names]
+        elif rows and isinstance(rows[0], (list, tuple)):
+            try:
+                grid = np.array(rows, dtype=object)
+            except ValueError:
+                grid = None
+            if grid is not None and grid.ndim == 2 and grid.shape[1] == len(names):
+                raw = list(grid.T)
+            else:
+                # Ragged rows: pad short ones with None, ignore extra cells
+                raw = [list(col) for col in zip_longest(*rows)][:len(names)]
+                raw += [[None] * len(rows) for _ in range(len(names) - len(raw))]
+        else:
+            # Fallback: single value rows, mapped to the first column
+            raw = [list(rows)] + [[None] * len(rows) for _ in names[1:]] if names else []
+
+        types = {}
+        for c, values in zip(meta, raw):
+            dtype = (c.get("dataType") or "").upper()
+            if not dtype and _looks_numeric(values):
+                dtype = "NUMBER"
+            types[c.get("name")] = dtype
+
+        arrays = {n: np.asarray(values, dtype=object) for n, values in zip(names, raw)}
+        keep = np.ones(len(rows), dtype=bool)
+        for n, arr in arrays.items():
+            if types[n] in NUMERIC_TYPES:
+                keep &= arr != n
+        columns = {}
+        for n, arr in arrays.items():
+            if not keep.all():
+                arr = arr[keep]
+            columns[n] = to_numeric(arr) if types[n] in NUMERIC_TYPES else arr
+        return cls(columns, types)
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @property
+    def names(self):
+        return list(self.columns)
+
+    def get(self, name, default=None):
+        return self.columns.get(name, default)
+
+    def numeric(self, name):
+        """Column as float64; missing columns read as zeros."""
+        col = self.columns.get(name)
+        if col is None:
+            return np.zeros(len(self))
+        return col if col.dtype == np.float64 else to_numeric(col)
+
+    def take(self, idx):
+        return ColumnarTable({n: c[idx] for n, c in self.columns.items()}, dict(self.types))
+
+    def classify(self):
+        """Split columns into (time_dims, dims, measures)."""
+        time_dims, dims, measures = [], [], []
+        for name, dtype in self.types.items():
+            if name in TIME_COLUMNS or dtype in TIME_TYPES:
+                time_dims.append(name)
+            elif dtype in NUMERIC_TYPES:
+                measures.append(name)
+            else:
+                dims.append(name)
+        return time_dims, dims, measures
+
+    def key(self, *names):
+        """First non-empty value among `names` per row, as strings ("" if none)."""
+        out = np.full(len(self), "", dtype=object)
+        for name in reversed(names):
+            col = self.columns.get(name)
+            if col is None:
+                continue
+            out = np.where(_truthy(col).astype(bool), col, out)
+        return out.astype(str)
+
+    def group_sum(self, keys, value):
+        return group_sum(keys, value)
+
+
+def group_sum(keys, value):
+    """Sum `value` per distinct key. Returns (keys, sums, first_row_index)."""
+    uniq, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    return uniq, np.bincount(inverse, weights=value, minlength=len(uniq)), first
+
+
+class GroupedSum:
+    """Running `group_sum` over row batches.
+
+    Each batch is reduced to one partial sum per key; partials are merged
+    once they outgrow the merged result, so memory stays proportional to
+    the number of distinct keys rather than rows. `labels` keeps the value
+    seen with each key's first row (e.g. a product title).
+    """
+
+    def __init__(self):
+        self._keys, self._sums, self._labels = [], [], []
+        self._pending = 0
+        self._merged = 0
+
+    def add(self, keys, values, labels):
+        uniq, sums, first = group_sum(keys, values)
+        self._keys.append(uniq)
+        self._sums.append(sums)
+        self._labels.append(np.asarray(labels, dtype=object)[first])
+        self._pending += len(uniq)
+        if self._pending > max(4096, 2 * self._merged):
+            self._merge()
+
+    def _merge(self):
+        if len(self._keys) > 1:
+            keys = np.concatenate(self._keys)
+            uniq, sums, first = group_sum(keys, np.concatenate(self._sums))
+            self._keys, self._sums = [uniq], [sums]
+            self._labels = [np.concatenate(self._labels)[first]]
+        self._merged = self._pending = len(self._keys[0]) if self._keys else 0
+
+    def result(self):
+        """(keys, sums, labels) with keys sorted and unique."""
+        self._merge()
+        if not self._keys:
+            return np.array([], dtype=str), np.zeros(0), np.array([], dtype=object)
+        return self._keys[0], self._sums[0], self._labels[0]
+
+
+class GroupedDaily:
+    """Running per-key daily sums over row batches, as a key x day matrix.
+
+    Column j holds day `start + j`; rows dated outside the `days`-day window
+    are dropped. Keys get a matrix row on first sight (the matrix doubles
+    when full), so each batch is one dict lookup per row plus a scatter-add
+    and memory stays within about twice the matrix. `labels` keeps the value
+    seen with each key's first row.
+    """
+
+    def __init__(self, start, days):
+        self.start = np.datetime64(start, "D")
+        self.days = days
+        # ISO day -> column; a dict lookup per row beats parsing dates
+        self._columns = {str(self.start + j): j for j in range(days)}
+        self._rows = {}
+        self._labels = []
+        self._matrix = np.zeros((0, days), dtype=np.float32)
+
+    def add(self, keys, days, values, labels):
+        days = np.asarray(days, dtype=object).tolist()
+        offset = np.fromiter(map(self._columns.get, days, repeat(-1)), dtype=np.int64, count=len(days))
+        for i in np.flatnonzero(offset < 0).tolist():
+            # Timestamps rather than plain days
+            if isinstance(days[i], str) and len(days[i]) > 10:
+                offset[i] = self._columns.get(days[i][:10], -1)
+        mask = offset >= 0
+        keys = np.asarray(keys)[mask]
+        rows = self._rows
+        row = np.fromiter(map(rows.get, keys.tolist(), repeat(-1)), dtype=np.int64, count=len(keys))
+        unseen = np.flatnonzero(row < 0)
+        if len(unseen):
+            fresh = keys[unseen].tolist()
+            # Number new keys in order of first appearance and keep their first label
+            first = dict(zip(reversed(fresh), range(len(fresh) - 1, -1, -1)))
+            new = list(dict.fromkeys(fresh))
+            rows.update(zip(new, range(len(rows), len(rows) + len(new))))
+            row[unseen] = np.fromiter(map(rows.get, fresh), dtype=np.int64, count=len(fresh))
+            fresh_labels = np.asarray(labels, dtype=object)[mask][unseen]
+            self._labels.extend(fresh_labels[[first[k] for k in new]].tolist())
+            if len(rows) > len(self._matrix):
+                grown = np.zeros((max(len(rows), 2 * len(self._matrix)), self.days), dtype=np.float32)
+                grown[:len(self._matrix)] = self._matrix
+                self._matrix = grown
+        np.add.at(self._matrix, (row, offset[mask]), np.asarray(values)[mask])
+
+    def result(self):
+        """(keys, matrix, labels) with keys sorted and unique."""
+        keys = np.array(list(self._rows), dtype=str)
+        order = np.argsort(keys, kind="stable")
+        return keys[order], self._matrix[:len(keys)][order], np.array(self._labels, dtype=object)[order]
+
+
+def align(keys_a, values_a, keys_b, values_b):
+    """Outer-join two key->value mappings given as sorted unique key arrays.
+
+    Returns (keys, a, b) over the union of keys, with 0.0 where a side has
+    no entry. Values may be rows of a matrix (e.g. daily sales per key).
+    """
+    keys = np.union1d(keys_a, keys_b)
+    a = np.zeros((len(keys),) + np.shape(values_a)[1:])
+    b = np.zeros((len(keys),) + np.shape(values_b)[1:])
+    a[np.searchsorted(keys, keys_a)] = values_a
+    b[np.searchsorted(keys, keys_b)] = values_b
+    return keys, a, b
@@ -0,0 +1,177 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+from metrics import REGISTRY
+
+WARMUP_JOBS = REGISTRY.counter(
+    "warmup_jobs_total", "Background report refreshes, by outcome.", ("outcome",)
+)
+
+
+class ReportWarmer:
+    """Keeps the popular reports of recently active shops warm.
+
+    `record` is called for every resolved question. Each (intent, window)
+    a shop asks for gets a popularity score that decays with `half_life`.
+    Every `interval` seconds the top `top_k` reports (scored at least
+    `min_score`) of each shop seen in the last `active_window` seconds are
+    refreshed once they are older than `max_age`, so `handle` finds them in
+    the result cache (and the reorder forecast its per-SKU totals) instead
+    of waiting on Shopify. Refreshes run on a pool of `workers` tasks and
+    go through the shop's Shopify scheduler like any other query; a shop
+    with queries already queued is skipped for that round. A shop whose
+    refreshes fail `max_failures` times in a row (e.g. a revoked token) is
+    left alone until it asks another question.
+    """
+
+    def __init__(self, agent, interval=30.0, max_age=240.0, workers=2, top_k=4, min_score=1.5,
+                 active_window=1800.0, half_life=3600.0, max_failures=3):
+        self.agent = agent
+        self.interval = interval
+        self.max_age = max_age
+        self.workers = workers
+        self.top_k = top_k
+        self.min_score = min_score
+        self.active_window = active_window
+        self.half_life = half_life
+        self.max_failures = max_failures
+        self._shops = {}
+        self._pending = set()
+        self._queue = None
+        self._runner = None
+        REGISTRY.register_collector(self._metrics, key="warmup")
+
+    def record(self, req, params):
+        intent = params.get("intent")
+        if intent not in self.agent.PREDEFINED_QUERIES and intent != "reorder_forecast":
+            return
+        now = time.monotonic()
+        shop = self._shops.setdefault(req.shop_domain, {"reports": {}, "warmed": {}})
+        shop.update(token=req.access_token, last_seen=now, failures=0)
+
+        if intent == "reorder_forecast":
+            report = {"intent": intent}
+        else:
+            report = {k: params.get(k) for k in ("intent", "since", "until", "limit", "filters")}
+        key = json.dumps(report, sort_keys=True)
+        score, updated, _ = shop["reports"].get(key, (0.0, now, report))
+        shop["reports"][key] = (self._decayed(score, updated, now) + 1.0, now, report)
+        if len(shop["reports"]) > 50:
+            # Forget the least popular long-tail report
+            coldest = min(shop["reports"], key=lambda k: self._decayed(*shop["reports"][k][:2], now))
+            del shop["reports"][coldest]
+            shop["warmed"].pop(coldest, None)
+
+    def _decayed(self, score, updated, now):
+        return score * 0.5 ** ((now - updated) / self.half_life)
+
+    def due(self, now=None):
+        """(shop_domain, key, report) for every report that needs a refresh now."""
+        now = time.monotonic() if now is None else now
+        busy = self.agent.shopify_scheduler.stats()
+        jobs = []
+        for domain in list(self._shops):
+            shop = self._shops[domain]
+            if now - shop["last_seen"] > self.active_window:
+                del self._shops[domain]
+                continue
+            if shop["failures"] >= self.max_failures or busy.get(domain, {}).get("queued"):
+                continue
+            scored = sorted(
+                ((self._decayed(score, updated, now), key, report) for key, (score, updated, report) in shop["reports"].items()),
+                key=lambda s: -s[0]
+            )
+            for score, key, report in scored[:self.top_k]:
+                if score < self.min_score:
+                    break
+                if now - shop["warmed"].get(key, float("-inf")) >= self.max_age:
+                    jobs.append((domain, key, report))
+        return jobs
+
+    async def warm(self, shop_domain, key, report):
+        """Refresh one report's Shopify data and local aggregates."""
+        shop = self._shops.get(shop_domain)
+        if shop is None:
+            return
+        shop["warmed"][key] = time.monotonic()
+        req = SimpleNamespace(shop_domain=shop_domain, access_token=shop["token"], question="", bypass_cache=True)
+        if report["intent"] == "reorder_forecast":
+            _, error = await self.agent.reorder_totals(req)
+        else:
+            query, _ = await self.agent.build_query(req, report)
+            data = await self.agent.execute_shopifyql(shop_domain, shop["token"], query, refresh=True)
+            error = self.agent._shopify_error(data)
+        if error:
+            shop["failures"] += 1
+            WARMUP_JOBS.inc(outcome="error")
+            print(f"⚠️ Warm-up of {report['intent']} for {shop_domain} failed: {error['answer'][:200]}")
+        else:
+            shop["failures"] = 0
+            WARMUP_JOBS.inc(outcome="ok")
+            print(f"🔥 Warmed {report['intent']} for {shop_domain}")
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self.warm(*job)
+            except Exception as e:
+                WARMUP_JOBS.inc(outcome="error")
+                print(f"⚠️ Warm-up of {job[2]['intent']} for {job[0]} failed: {e}")
+            finally:
+                self._pending.discard(job[:2])
+                self._queue.task_done()
+
+    def schedule(self, now=None):
+        """Queue every due report that is not already queued or running."""
+        for job in self.due(now):
+            if job[:2] not in self._pending:
+                self._pending.add(job[:2])
+                self._queue.put_nowait(job)
+
+    async def run(self):
+        """Schedule refreshes every `interval` seconds until cancelled."""
+        self._queue = asyncio.Queue()
+        workers = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                self.schedule()
+        finally:
+            for w in workers:
+                w.cancel()
+
+    def start(self):
+        """Start the scheduler in the background; an interval of 0 disables it."""
+        if self.interval > 0 and self._runner is None:
+            self._runner = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        if self._runner is not None:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+            self._runner = None
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            domain: {
+                "reports": len(shop["reports"]),
+                "warmed": len(shop["warmed"]),
+                "failures": shop["failures"],
+                "idle_seconds": round(now - shop["last_seen"], 1)
+            }
+            for domain, shop in self._shops.items()
+        }
+
+    def _metrics(self):
+        return [
+            ("warmup_active_shops", "gauge", "Shops whose popular reports are kept warm.", [({}, len(self._shops))]),
+            ("warmup_queue_depth", "gauge", "Report refreshes waiting for a warm-up worker.",
+             [({}, self._queue.qsize() if self._queue is not None else 0)]),
+        ]
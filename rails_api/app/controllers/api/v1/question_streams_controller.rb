@@ -0,0 +1,33 @@
+# Streaming lives in its own controller so only this action runs under
+# ActionController::Live (a separate thread and a streamed response);
+# QuestionsController#create and #batch stay plain JSON actions.
+class Api::V1::QuestionStreamsController < ApplicationController
+  include ActionController::Live
+
+  # Proxies the AI service's Server-Sent Events stream chunk by chunk so the
+  # chat widget sees the intent, table and answer tokens as they arrive.
+  def create
+    store = Store.find_by(shop_domain: params[:store_id])
+    return render json: { error: 'Store not found' }, status: 404 unless store
+
+    response.headers['Content-Type'] = 'text/event-stream'
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.headers['Last-Modified'] = Time.now.httpdate
+
+    HTTParty.post(
+      ENV['AI_SERVICE_URL'] + '/ask/stream',
+      headers: { 'Content-Type' => 'application/json' },
+      body: {
+        shop_domain: store.shop_domain,
+        access_token: store.access_token,
+        question: params[:question]
+      }.to_json,
+      stream_body: true
+    ) do |fragment|
+      response.stream.write(fragment)
+    end
+  ensure
+    response.stream.close
+  end
+end
@@ -6,13 +6,38 @@ class Api::V1::QuestionsController < ApplicationController
     response = HTTParty.post(
       ENV['AI_SERVICE_URL'] + '/ask',
       headers: { 'Content-Type' => 'application/json' },
+      body: ai_service_body(store)
+    )
+
+    render json: response.parsed_response
+  end
+
+  # Answers many questions for one store with a single AI service call;
+  # identical questions and queries are only run once.
+  def batch
+    store = Store.find_by(shop_domain: params[:store_id])
+    return render json: { error: 'Store not found' }, status: 404 unless store
+
+    response = HTTParty.post(
+      ENV['AI_SERVICE_URL'] + '/ask/batch',
+      headers: { 'Content-Type' => 'application/json' },
       body: {
         shop_domain: store.shop_domain,
         access_token: store.access_token,
-        question: params[:question]
+        questions: Array(params[:questions])
       }.to_json
     )
 
     render json: response.parsed_response
   end
+
+  private
+
+  def ai_service_body(store)
+    {
+      shop_domain: store.shop_domain,
+      access_token: store.access_token,
+      question: params[:question]
+    }.to_json
+  end
 end
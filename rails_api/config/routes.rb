@@ -7,6 +7,8 @@ Rails.application.routes.draw do
   namespace :api do
     namespace :v1 do
       post 'questions', to: 'questions#create'
+      post 'questions/stream', to: 'question_streams#create'
+      post 'questions/batch', to: 'questions#batch'
     end
   end
 end